@@ -0,0 +1,98 @@
+"""
+Microbenchmark of rendering the summarize prompt for the MCP prompt server.
+
+Compares the regex substitution the prompt server used before, which scans
+the template on every call, with the PromptCatalog path, which renders a
+Jinja template compiled once (including the catalog's periodic check for
+changed files), and with the bare compiled Jinja template. Prints one JSON
+result per renderer and text.
+
+The catalog is slower per call than the regex path it replaced: on a
+development machine the summarize prompt took about 3-4.5 us with the regex
+and 15-20 us with the catalog, nearly all of it in Jinja's render itself
+(the bare template takes 15-18 us). It buys Jinja syntax, typed defaults and
+hot reloading for every prompt, and stays far below the cost of a model call.
+
+Usage:
+    uv run python benchmarks/bench_prompt_render.py [rounds]
+"""
+import json
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict
+
+from jinja2 import Environment
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from prompt_utils import PromptCatalog  # noqa: E402
+
+DATA_DIR = Path(__file__).resolve().parents[1] / 'data'
+TEXTS = {
+    'short': 'The quarterly report shows revenue growth of 12 percent. ' * 2,
+    'long': 'The quarterly report shows revenue growth of 12 percent. ' * 200
+}
+
+
+def load_summarize_spec() -> Dict[str, Any]:
+    with (DATA_DIR / 'prompts' / 'summarize.yml').open('r', encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
+
+
+def regex_renderer() -> Callable[[str], str]:
+    # The previous prompt server: YAML loaded once, placeholders substituted with re.sub on every call
+    spec = load_summarize_spec()
+    template = spec.get('template', '')
+    defaults = {prompt_input['name']: prompt_input['default']
+                for prompt_input in spec.get('inputs', []) if 'default' in prompt_input}
+
+    def render(text: str) -> str:
+        context: Dict[str, Any] = {'text': text, 'bullets': int(defaults.get('bullets', 5))}
+
+        def replacer(match: re.Match) -> str:
+            key = match.group(1).strip()
+            return str(context.get(key, match.group(0)))
+        return re.sub(r"{{\s*([^}]+)\s*}}", replacer, template)
+    return render
+
+
+def jinja_renderer() -> Callable[[str], str]:
+    template = Environment(keep_trailing_newline=True).from_string(load_summarize_spec().get('template', ''))
+    return lambda text: template.render(text=text, bullets=5).strip()
+
+
+def catalog_renderer() -> Callable[[str], str]:
+    catalog = PromptCatalog(prompts_dir=DATA_DIR / 'prompts', templates_dir=DATA_DIR / 'templates')
+    return lambda text: catalog.render('summarize', {'text': text})
+
+
+def bench_render(render: Callable[[str], str], text: str, rounds: int) -> float:
+    render(text)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        render(text)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    renderers = {'regex': regex_renderer(), 'compiled': catalog_renderer(), 'jinja': jinja_renderer()}
+    for text_name, text in TEXTS.items():
+        assert renderers['regex'](text).strip() == renderers['compiled'](text) == renderers['jinja'](text)
+        for renderer_name, render in renderers.items():
+            elapsed = bench_render(render, text, rounds)
+            print(json.dumps({
+                "benchmark": "prompt_render",
+                "renderer": renderer_name,
+                "text": text_name,
+                "text_chars": len(text),
+                "us_per_call": round(elapsed / rounds * 1e6, 3),
+                "calls_per_s": round(rounds / elapsed)
+            }))
+
+
+if __name__ == '__main__':
+    main()
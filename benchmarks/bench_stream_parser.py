@@ -0,0 +1,64 @@
+"""
+Microbenchmark of ThinkStreamParser over recorded chunk streams.
+
+Each file in benchmarks/data/*_stream.jsonl holds one streamed response, one
+delta per line ({"content": ..., "reasoning": ...}). The benchmark parses every
+stream repeatedly and prints one JSON result per stream.
+
+Usage:
+    uv run python benchmarks/bench_stream_parser.py [rounds]
+"""
+import json
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from stream_utils import ThinkStreamParser  # noqa: E402
+
+DATA_DIR = Path(__file__).resolve().parent / 'data'
+
+
+def load_deltas(path: Path) -> List[SimpleNamespace]:
+    deltas = []
+    with path.open('r', encoding='utf-8') as f:
+        for line in f:
+            record = json.loads(line)
+            reasoning = record.get('reasoning')
+            deltas.append(SimpleNamespace(
+                content=record.get('content'),
+                reasoning=SimpleNamespace(content=reasoning) if reasoning else None
+            ))
+    return deltas
+
+
+def bench_stream(deltas: List[SimpleNamespace], rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        parser = ThinkStreamParser()
+        for delta in deltas:
+            parser.feed(delta)
+        parser.flush()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for path in sorted(DATA_DIR.glob('*_stream.jsonl')):
+        deltas = load_deltas(path)
+        elapsed = bench_stream(deltas, rounds)
+        chunks = len(deltas) * rounds
+        print(json.dumps({
+            "benchmark": "think_stream_parser",
+            "stream": path.stem,
+            "chunks": chunks,
+            "us_per_chunk": round(elapsed / chunks * 1e6, 3),
+            "chunks_per_s": round(chunks / elapsed)
+        }))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""
+Fake Ollama server for benchmarks.
+
+Serves the Ollama endpoints the app uses (/api/chat, /api/tags, /api/ps) from
+an asyncio server running on a background thread of the current process.
+Responses stream at a configurable token rate and can include thinking
+tokens, <think> tags and tool calls, so benchmarks exercise the same client
+code paths as a real Ollama instance without a GPU.
+"""
+import asyncio
+import json
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+FAKE_MODEL = 'fake-model:latest'
+
+
+@dataclass
+class FakeResponseSpec:
+    # Tokens per second of the streamed response
+    token_rate: float = 200.0
+    # Seconds before the first token, e.g. prompt processing or model load
+    first_token_delay: float = 0.0
+    # Answer tokens per response
+    content_tokens: int = 200
+    # Tokens streamed in the 'thinking' field (reasoning models such as gpt-oss)
+    thinking_tokens: int = 0
+    # Tokens streamed between <think> and </think> in the content (qwen3, deepseek-r1)
+    think_tag_tokens: int = 0
+    # Tool calls returned when the request has no assistant message yet
+    tool_calls: List[Dict[str, Any]] = field(default_factory=list)
+    # Models listed by /api/tags and /api/ps
+    models: List[str] = field(default_factory=lambda: [FAKE_MODEL])
+
+
+def _created_at() -> str:
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+
+def _token(index: int) -> str:
+    return f' tok{index % 100}'
+
+
+class FakeOllamaServer:
+    """
+    Ollama-compatible HTTP server with scripted streaming responses.
+
+    Usage:
+        with FakeOllamaServer(FakeResponseSpec(token_rate=100)) as server:
+            api_base = server.url
+    """
+
+    def __init__(self, spec: Optional[FakeResponseSpec] = None, host: str = '127.0.0.1', port: int = 0) -> None:
+        self.spec = spec or FakeResponseSpec()
+        self.host = host
+        self.port = port
+        self.requests: List[Dict[str, Any]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._started = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+    def start(self) -> 'FakeOllamaServer':
+        self._thread = threading.Thread(target=self._run, name='fake-ollama', daemon=True)
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self) -> None:
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def __enter__(self) -> 'FakeOllamaServer':
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port))
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, value = line.decode().split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                payload = json.loads(body) if body else {}
+                await self._route(method, path, payload, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method: str, path: str, payload: Dict[str, Any], writer: asyncio.StreamWriter) -> None:
+        if path == '/api/tags' or path == '/api/ps':
+            models = [{'name': name, 'model': name, 'size': 0, 'digest': '', 'details': {}}
+                      for name in self.spec.models]
+            await self._send_json(writer, {'models': models})
+        elif path == '/api/chat' and method == 'POST':
+            self.requests.append(payload)
+            if payload.get('stream', True):
+                await self._stream_chat(writer, payload)
+            else:
+                await self._send_json(writer, self._chat_response(payload))
+        else:
+            await self._send_json(writer, {'error': f'{method} {path} not found'}, status='404 Not Found')
+
+    async def _send_json(self, writer: asyncio.StreamWriter, data: Dict[str, Any], status: str = '200 OK') -> None:
+        body = json.dumps(data).encode()
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: application/json\r\n'
+            f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+        await writer.drain()
+
+    def _wants_tool_calls(self, payload: Dict[str, Any]) -> bool:
+        messages = payload.get('messages', [])
+        return bool(self.spec.tool_calls) and not any(m.get('role') == 'assistant' for m in messages)
+
+    def _messages(self, payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+        # Assistant message fragments of one response, in stream order
+        if self._wants_tool_calls(payload):
+            return [{'role': 'assistant', 'content': '', 'tool_calls': [
+                {'function': {'name': call['name'], 'arguments': call.get('arguments', {})}}
+                for call in self.spec.tool_calls
+            ]}]
+
+        fragments = [{'role': 'assistant', 'content': '', 'thinking': _token(i)}
+                     for i in range(self.spec.thinking_tokens)]
+        if self.spec.think_tag_tokens:
+            fragments.append({'role': 'assistant', 'content': '<think>'})
+            fragments += [{'role': 'assistant', 'content': _token(i)}
+                          for i in range(self.spec.think_tag_tokens)]
+            fragments.append({'role': 'assistant', 'content': '</think>'})
+        fragments += [{'role': 'assistant', 'content': _token(i)}
+                      for i in range(self.spec.content_tokens)]
+        return fragments
+
+    def _chat_response(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        fragments = self._messages(payload)
+        message = {'role': 'assistant', 'content': ''.join(f.get('content', '') for f in fragments)}
+        if fragments and 'tool_calls' in fragments[0]:
+            message['tool_calls'] = fragments[0]['tool_calls']
+        return {'model': payload.get('model'), 'created_at': _created_at(), 'message': message,
+                'done': True, 'done_reason': 'stop', 'eval_count': len(fragments)}
+
+    async def _stream_chat(self, writer: asyncio.StreamWriter, payload: Dict[str, Any]) -> None:
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\n'
+                     b'Transfer-Encoding: chunked\r\n\r\n')
+        fragments = self._messages(payload)
+        start = time.perf_counter() + self.spec.first_token_delay
+        for index, message in enumerate(fragments):
+            # Pace tokens against the start time so sleep overhead does not accumulate
+            delay = start + index / self.spec.token_rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._write_chunk(writer, {
+                'model': payload.get('model'), 'created_at': _created_at(),
+                'message': message, 'done': False})
+        await self._write_chunk(writer, {
+            'model': payload.get('model'), 'created_at': _created_at(),
+            'message': {'role': 'assistant', 'content': ''},
+            'done': True, 'done_reason': 'stop',
+            'prompt_eval_count': 1, 'eval_count': len(fragments)})
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    async def _write_chunk(self, writer: asyncio.StreamWriter, data: Dict[str, Any]) -> None:
+        line = json.dumps(data).encode() + b'\n'
+        writer.write(f'{len(line):x}\r\n'.encode() + line + b'\r\n')
+        await writer.drain()
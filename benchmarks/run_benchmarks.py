@@ -0,0 +1,204 @@
+"""
+End-to-end benchmarks of the chat pipeline against a fake Ollama server.
+
+Runs each scenario several times through the real client code paths and
+prints one JSON result per scenario:
+
+- llm_completion: a plain streamed completion through any-llm
+- agent_runner: thinking tokens and a tool-calling turn followed by the answer
+- stream_llm_response: agent_runner output rendered to a Chainlit message,
+  with <think> tags routed to a step
+
+Reported metrics are medians and 95th percentiles over the runs of time to
+first token (ms), end-to-end latency (ms), streamed tokens per second and
+client CPU time per token (µs). The fake server runs on its own thread, so the
+CPU time of the benchmark thread only covers the client side.
+
+Usage:
+    uv run python benchmarks/run_benchmarks.py [--runs 5] [--token-rate 500] [--output bench_output.txt]
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from chainlit.context import init_http_context  # noqa: E402
+from chainlit.emitter import BaseChainlitEmitter  # noqa: E402
+
+from agent_helper import agent_runner, llm_completion  # noqa: E402
+from fake_ollama import FAKE_MODEL, FakeOllamaServer, FakeResponseSpec  # noqa: E402
+from llm_service import stream_llm_response  # noqa: E402
+from local_tools import LOCAL_TOOL_HANDLERS, LOCAL_TOOLS_CONNECTION  # noqa: E402
+from tool_registry import get_session_tool_registry  # noqa: E402
+
+BENCH_MODEL = f'ollama:{FAKE_MODEL}'
+BENCH_TOOL = {
+    "name": "bench_echo",
+    "description": "Return the given arguments.",
+    "input_schema": {
+        "type": "object",
+        "properties": {"text": {"type": "string"}},
+    },
+}
+
+
+class RecordingEmitter(BaseChainlitEmitter):
+    # Emitter that records when the first token reaches the client instead of sending it
+    def __init__(self, session) -> None:
+        super().__init__(session)
+        self.first_token_time: Optional[float] = None
+
+    async def send_token(self, id: str, token: str, is_sequence=False, is_input=False):
+        if self.first_token_time is None and token:
+            self.first_token_time = time.perf_counter()
+
+
+async def _bench_echo(arguments: Dict[str, Any]) -> str:
+    return json.dumps(arguments)
+
+
+def _is_token(chunk: Any) -> bool:
+    if not chunk.choices:
+        return False
+    delta = chunk.choices[0].delta
+    return bool(delta.content or delta.reasoning)
+
+
+class Run:
+    # Timing of a single scenario run
+    def __init__(self) -> None:
+        self.start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        self.first_token_time: Optional[float] = None
+        self.tokens = 0
+
+    def token(self) -> None:
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.tokens += 1
+
+    def result(self, first_token_time: Optional[float] = None) -> Dict[str, float]:
+        end = time.perf_counter()
+        cpu = time.thread_time() - self.cpu_start
+        first = first_token_time or self.first_token_time or end
+        tokens = max(self.tokens, 1)
+        return {
+            "ttft_ms": (first - self.start) * 1e3,
+            "e2e_ms": (end - self.start) * 1e3,
+            "tokens_per_s": self.tokens / (end - first) if end > first else 0.0,
+            "cpu_us_per_token": cpu / tokens * 1e6,
+            "tokens": self.tokens,
+        }
+
+
+async def counted(response: AsyncIterator[Any], run: Run) -> AsyncIterator[Any]:
+    async for chunk in response:
+        if _is_token(chunk):
+            run.token()
+        yield chunk
+
+
+async def bench_llm_completion(api_base: str) -> Dict[str, float]:
+    run = Run()
+    response = await llm_completion(
+        model=BENCH_MODEL, messages=[{"role": "user", "content": "Hello"}], api_base=api_base)
+    async for _ in counted(response, run):
+        pass
+    return run.result()
+
+
+async def bench_agent_runner(api_base: str) -> Dict[str, float]:
+    run = Run()
+    messages = [{"role": "user", "content": "Hello"}]
+    response = agent_runner(
+        model=BENCH_MODEL, messages=messages,
+        tools=get_session_tool_registry().tools_payload(), api_base=api_base)
+    async for _ in counted(response, run):
+        pass
+    return run.result()
+
+
+async def bench_stream_llm_response(api_base: str) -> Dict[str, float]:
+    context = init_http_context()
+    emitter = context.emitter = RecordingEmitter(context.session)
+    run = Run()
+    response = agent_runner(
+        model=BENCH_MODEL, messages=[{"role": "user", "content": "Hello"}], api_base=api_base)
+    await stream_llm_response(counted(response, run), FAKE_MODEL)
+    return run.result(first_token_time=emitter.first_token_time)
+
+
+def summarize(name: str, results: List[Dict[str, float]], spec: FakeResponseSpec) -> Dict[str, Any]:
+    summary: Dict[str, Any] = {
+        "benchmark": name,
+        "runs": len(results),
+        "token_rate": spec.token_rate,
+        "tokens": results[0]["tokens"],
+    }
+    for metric in ("ttft_ms", "e2e_ms", "tokens_per_s", "cpu_us_per_token"):
+        values = sorted(result[metric] for result in results)
+        summary[f"{metric}_p50"] = round(statistics.median(values), 3)
+        summary[f"{metric}_p95"] = round(values[min(len(values) - 1, round(0.95 * (len(values) - 1)))], 3)
+    return summary
+
+
+def run_scenario(
+    name: str,
+    bench: Callable[[str], Any],
+    spec: FakeResponseSpec,
+    runs: int
+) -> Dict[str, Any]:
+    async def main() -> List[Dict[str, float]]:
+        init_http_context()
+        get_session_tool_registry().add_connection(LOCAL_TOOLS_CONNECTION, [BENCH_TOOL])
+        # Warm-up run: imports, provider client creation and connection setup
+        await bench(server.url)
+        return [await bench(server.url) for _ in range(runs)]
+
+    with FakeOllamaServer(spec) as server:
+        return summarize(name, asyncio.run(main()), spec)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5, help='measured runs per scenario')
+    parser.add_argument('--token-rate', type=float, default=500.0, help='tokens per second of the fake server')
+    parser.add_argument('--first-token-delay', type=float, default=0.0, help='seconds before the first token')
+    parser.add_argument('--tokens', type=int, default=300, help='answer tokens per response')
+    parser.add_argument('--thinking-tokens', type=int, default=100, help='reasoning tokens in agent_runner')
+    parser.add_argument('--think-tag-tokens', type=int, default=100,
+                        help='<think> tag tokens in stream_llm_response')
+    parser.add_argument('--tool-calls', type=int, default=2, help='tool calls in the first agent_runner turn')
+    parser.add_argument('--output', type=Path, help='also write the JSON lines to this file')
+    args = parser.parse_args()
+
+    LOCAL_TOOL_HANDLERS[BENCH_TOOL['name']] = _bench_echo
+    base = dict(token_rate=args.token_rate, first_token_delay=args.first_token_delay,
+                content_tokens=args.tokens)
+    scenarios = [
+        ("llm_completion", bench_llm_completion, FakeResponseSpec(**base)),
+        ("agent_runner", bench_agent_runner, FakeResponseSpec(
+            **base, thinking_tokens=args.thinking_tokens,
+            tool_calls=[{"name": BENCH_TOOL['name'], "arguments": {"text": f"call {i}"}}
+                        for i in range(args.tool_calls)])),
+        ("stream_llm_response", bench_stream_llm_response, FakeResponseSpec(
+            **base, think_tag_tokens=args.think_tag_tokens)),
+    ]
+
+    lines = []
+    for name, bench, spec in scenarios:
+        line = json.dumps(run_scenario(name, bench, spec, args.runs))
+        print(line, flush=True)
+        lines.append(line)
+    if args.output:
+        args.output.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,34 @@
+import asyncio
 import json
 import logging
+import os
+import time
+from contextlib import aclosing
 from typing import Any, AsyncIterator, List, Dict, Optional
 
 from any_llm import acompletion, prepare_tools
-from any_llm.types.completion import ChatCompletion, ChatCompletionChunk
+from any_llm.types.completion import ChatCompletion, ChatCompletionChunk, ChatCompletionMessageFunctionToolCall, ChoiceDeltaToolCall
 import chainlit as cl
+from chainlit.context import ChainlitContextException
+
+from local_tools import LOCAL_TOOLS_CONNECTION, call_local_tool
+from metrics import inc_counter, observe, span
+from ollama_pool import OLLAMA_API_BASE, OllamaNode, get_ollama_pool, is_connection_error, ollama_model_name
+from response_cache import get_response_cache, response_cache_key
+from scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, QueueCallback, get_request_scheduler
+from tool_cache import get_tool_cache, tool_cache_key, tool_cache_policy
+from tool_registry import get_session_tool_registry
+from tool_results import compact_tool_result, get_session_tool_result_store, tool_result_policy, tool_result_text
 
 logger = logging.getLogger(__name__)
 
-OLLAMA_API_BASE = "http://localhost:11434"
+# Default number of tool calls a session runs at the same time,
+# overridable per session with cl.user_session "tool_concurrency"
+TOOL_CONCURRENCY = int(os.getenv('TOOL_CONCURRENCY', '4'))
+# Seconds a single tool call may take before it is abandoned
+TOOL_TIMEOUT = float(os.getenv('TOOL_TIMEOUT', '120'))
+# Maximum number of tool-using model turns for a single user message
+AGENT_MAX_ITERATIONS = int(os.getenv('AGENT_MAX_ITERATIONS', '8'))
 
 
 async def llm_completion(
@@ -34,15 +54,27 @@ async def llm_completion(
     Raises:
         Exception: If the completion call fails.
     """
+    cache = get_response_cache()
+    if cache:
+        cache_key = response_cache_key(model, messages, tools, stream=bool(stream))
+        cached = await cache.get(cache_key)
+        if cached is not None:
+            return await cache.replay(cached, stream=bool(stream))
+
     try:
-        OpenAI_tools = prepare_tools(tools)
-        response = await acompletion(
-            model=model,
-            messages=messages,
-            tools=OpenAI_tools,
-            api_base=api_base,
-            stream=stream
-        )
+        OpenAI_tools = prepare_tools(tools) if tools else None
+        inc_counter('llm_requests', model=model)
+        # Time until the response starts, including queueing and model loading in Ollama
+        with span('llm_request', model=model):
+            response = await acompletion(
+                model=model,
+                messages=messages,
+                tools=OpenAI_tools,
+                api_base=api_base,
+                stream=stream
+            )
+        if cache:
+            return await cache.record(cache_key, response, stream=bool(stream))
         return response
     except Exception as e:
         logger.error(f"llm_completion error: {e}")
@@ -51,89 +83,351 @@ async def llm_completion(
 
 @cl.step(type="tool")
 async def call_tool(name: str, input: str) -> str:
-    current_step = cl.context.current_step
-    current_step.name = name
-    tool_input = json.loads(input)
-
-    # Find appropriate MCP connection for this tool
-    mcp_tools = cl.user_session.get("mcp_tools", {})
-    mcp_name = None
-
-    for connection_name, tools in mcp_tools.items():
-        if any(tool.get("name") == name for tool in tools):
-            mcp_name = connection_name
-            break
-
-    if not mcp_name:
-        current_step.output = json.dumps(
-            {"error": f"Tool {name} not found in any MCP connection"})
-        return current_step.output
-
-    # Get the MCP session
-    mcp_session, _ = cl.context.session.mcp_sessions.get(mcp_name)
-    if not mcp_session:
-        current_step.output = json.dumps(
-            {"error": f"MCP {mcp_name} not found in any MCP connection"})
-        return current_step.output
-
-    # Call the tool
+    with span('tool_call', tool=name) as tool_span:
+        current_step = cl.context.current_step
+        current_step.name = name
+        try:
+            tool_input = json.loads(input or '{}')
+            if not isinstance(tool_input, dict):
+                raise ValueError("arguments must be a JSON object")
+        except ValueError as e:
+            # Told to the model like any other tool error, so it can correct the call
+            tool_span.error = "invalid_arguments"
+            current_step.output = json.dumps({"error": f"Invalid arguments for tool {name}: {e}"})
+            return current_step.output
+
+        # Find appropriate MCP connection for this tool
+        tool = get_session_tool_registry().get(name)
+        if not tool:
+            tool_span.error = "not_found"
+            current_step.output = json.dumps(
+                {"error": f"Tool {name} not found in any MCP connection"})
+            return current_step.output
+        mcp_name = tool.connection
+
+        # Local tools run in-process, without an MCP session
+        if mcp_name == LOCAL_TOOLS_CONNECTION:
+            try:
+                current_step.output = await call_local_tool(tool.name, tool_input)
+            except Exception as e:
+                tool_span.error = type(e).__name__
+                current_step.output = json.dumps({"error": str(e)})
+            finally:
+                await current_step.send()
+            return await compact_step_output(name, current_step.output)
+
+        # Get the MCP session
+        mcp_session, _ = cl.context.session.mcp_sessions.get(mcp_name, (None, None))
+        if not mcp_session:
+            tool_span.error = "not_connected"
+            current_step.output = json.dumps(
+                {"error": f"MCP {mcp_name} not found in any MCP connection"})
+            return current_step.output
+
+        # Call the tool, or reuse the result of an identical call to a cacheable tool
+        try:
+            cache_policy = tool_cache_policy(name)
+            if cache_policy:
+                current_step.output = await get_tool_cache(cache_policy.scope).call(
+                    tool_cache_key(mcp_name, tool.name, tool_input), cache_policy.ttl,
+                    lambda: mcp_session.call_tool(tool.name, tool_input), tool_name=name)
+            else:
+                current_step.output = await mcp_session.call_tool(tool.name, tool_input)
+        except Exception as e:
+            tool_span.error = type(e).__name__
+            current_step.output = json.dumps({"error": str(e)})
+        finally:
+            await current_step.send()
+
+        return await compact_step_output(name, current_step.output)
+
+
+async def compact_step_output(name: str, output: Any) -> str:
+    # The step shows the full result, the model gets it within the tool's token budget
+    policy = tool_result_policy(name)
+    text = tool_result_text(output)
+    if policy.strategy == 'none' or len(text.encode('utf-8')) <= policy.max_tokens:
+        return text
+    with span('tool_result_compact', tool=name):
+        return await asyncio.to_thread(
+            compact_tool_result, name, text, policy, get_session_tool_result_store())
+
+
+def get_tool_semaphore() -> asyncio.Semaphore:
+    # Per-session limit on concurrently running tool calls
+    semaphore = cl.user_session.get("tool_semaphore")
+    if semaphore is None:
+        concurrency = cl.user_session.get("tool_concurrency", TOOL_CONCURRENCY)
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+        cl.user_session.set("tool_semaphore", semaphore)
+    return semaphore
+
+
+async def call_tools(tool_calls: List[Any], timeout: float = TOOL_TIMEOUT) -> List[Dict[str, str]]:
+    """
+    Run the tool calls of one assistant turn concurrently.
+
+    Args:
+        tool_calls: Tool calls from the assistant message.
+        timeout: Seconds a single tool call may take.
+
+    Returns:
+        List[Dict[str, str]]: Tool result messages in the original call order.
+    """
+    semaphore = get_tool_semaphore()
+
+    async def run_tool_call(tool_call: Any) -> Dict[str, str]:
+        tool_name = tool_call.function.name
+        tool_arguments = tool_call.function.arguments
+        async with semaphore:
+            try:
+                result = await asyncio.wait_for(
+                    call_tool(name=tool_name, input=tool_arguments), timeout=timeout)
+            except asyncio.TimeoutError:
+                result = json.dumps(
+                    {"error": f"Tool {tool_name} timed out after {timeout} seconds"})
+            except Exception as e:
+                # One failing call must not discard the results of the others
+                logger.exception(f"{tool_name} failed")
+                result = json.dumps({"error": f"Tool {tool_name} failed: {e}"})
+
+        logger.info(f"{tool_name} {tool_arguments} result: {result}")
+        return {
+            "role": "tool",
+            "tool_call_id": tool_call.id,
+            "name": tool_name,
+            "content": result
+        }
+
+    return list(await asyncio.gather(*(run_tool_call(tool_call) for tool_call in tool_calls)))
+
+
+def _session_id() -> str:
     try:
-        current_step.output = await mcp_session.call_tool(name, tool_input)
-    except Exception as e:
-        current_step.output = json.dumps({"error": str(e)})
-    finally:
-        await current_step.send()
+        return cl.context.session.id
+    except ChainlitContextException:
+        return ''
 
-    return current_step.output
+
+def accumulate_tool_call_deltas(tool_calls: Dict[int, Dict[str, str]], deltas: List[ChoiceDeltaToolCall],
+                                index_map: Dict[int, int]) -> None:
+    """
+    Merge streamed tool call deltas into partially assembled tool calls.
+
+    Args:
+        tool_calls: Tool calls assembled so far, keyed by tool call index.
+        deltas: Tool call deltas of one ChatCompletionChunk.
+        index_map: Streamed index of a reused delta index to the index of its current tool call,
+            kept across the chunks of one response.
+    """
+    for delta in deltas:
+        stream_index = delta.index if delta.index is not None else len(tool_calls)
+        index = index_map.get(stream_index, stream_index)
+        tool_call = tool_calls.get(index)
+        if tool_call and delta.id and tool_call["id"] and delta.id != tool_call["id"]:
+            # Providers sending complete tool calls may reuse index 0 for each of them;
+            # later deltas of that index continue the new call
+            index = index_map[stream_index] = max(tool_calls) + 1
+            tool_call = None
+        if tool_call is None:
+            tool_call = tool_calls[index] = {"id": "", "name": "", "arguments": ""}
+        if delta.id:
+            tool_call["id"] = delta.id
+        if delta.function:
+            if delta.function.name:
+                tool_call["name"] += delta.function.name
+            if delta.function.arguments:
+                arguments = delta.function.arguments
+                if not isinstance(arguments, str):
+                    arguments = json.dumps(arguments)
+                tool_call["arguments"] += arguments
+
+
+def build_tool_calls(tool_calls: Dict[int, Dict[str, str]]) -> List[ChatCompletionMessageFunctionToolCall]:
+    return [
+        ChatCompletionMessageFunctionToolCall.model_validate({
+            "id": tool_call["id"] or f"call_{index}",
+            "type": "function",
+            "function": {
+                "name": tool_call["name"],
+                "arguments": tool_call["arguments"] or "{}"
+            }
+        })
+        for index, tool_call in sorted(tool_calls.items())
+    ]
 
 
 async def agent_runner(model: str, messages: List[Dict[str, str]],
                        tools: Optional[List[Dict[str, str]]] = None,
-                       api_base: Optional[str] = OLLAMA_API_BASE,
-                       stream: Optional[bool] = True) -> ChatCompletion | AsyncIterator[ChatCompletionChunk]:
-    while True:
-        response = await llm_completion(
-            model=model,
-            messages=messages,
-            tools=tools,
-            api_base=api_base,
-            stream=stream
-        )
-
-        # Return streaming response directly
-        if response is not ChatCompletion:
-            return response
-
-        if hasattr(response, 'choices') and response.choices:
-            message = response.choices[0].message
-
-            use_tools = message.tool_calls
-            if use_tools:
-                # Call the tools
-                for tool in use_tools:
-                    tool_id = tool.get('id', '')
-                    tool_function = tool.get('function', {})
-                    tool_name = tool_function.get('name', '')
-                    tool_arguments = tool_function.get('arguments', {})
-                    result = await call_tool(
-                        name=tool_name,
-                        input=tool_arguments
-                    )
-
-                    logger.info(
-                        f"{tool_name} {tool_arguments} result: {result}")
-                    # Append the tool result to the messages
-                    messages.append(message)
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_id,
-                        "name": tool_name,
-                        "content": result
-                    })
-            else:
-                return await llm_completion(
+                       api_base: Optional[str] = None,
+                       max_iterations: int = AGENT_MAX_ITERATIONS,
+                       priority: int = PRIORITY_INTERACTIVE,
+                       on_queue: Optional[QueueCallback] = None) -> AsyncIterator[ChatCompletionChunk]:
+    """
+    Stream a model response, running requested tools and looping back to the model.
+
+    Content and reasoning chunks are forwarded as they arrive, while tool call
+    deltas are assembled into complete tool calls. Once a streamed turn ends
+    with tool calls, the tools run and the model is called again with their
+    results.
+
+    Without an api_base, each turn of an Ollama model goes to a node of the
+    Ollama pool. A turn that cannot reach its node before the first chunk is
+    retried on another node.
+
+    Args:
+        model: Model name.
+        messages: List of message dicts; assistant tool calls and tool results are appended.
+        tools: Optional list of tool dicts.
+        api_base: API base URL, None to route Ollama models through the Ollama pool.
+        max_iterations: Maximum number of tool-using turns before the model must answer without tools.
+        priority: Scheduler priority class of the request.
+        on_queue: Called with the queue position while the request waits for a scheduler slot.
+
+    Yields:
+        ChatCompletionChunk: Chunks carrying content, reasoning or finish reasons.
+    """
+    session = _session_id()
+    pool = get_ollama_pool()
+    pool_model = ollama_model_name(model) if api_base is None else None
+    for iteration in range(max_iterations + 1):
+        turn_tools = tools if iteration < max_iterations else None
+        if tools and turn_tools is None:
+            logger.warning(
+                f"Agent reached {max_iterations} tool iterations, answering without tools")
+
+        failed_nodes: List[OllamaNode] = []
+        while True:
+            node = pool.pick(pool_model, exclude=failed_nodes) if pool_model else None
+            turn_api_base = node.url if node else api_base
+            # Whether the node had the model loaded, to tell cold-start from warm TTFT
+            load_state = ('warm' if node.is_loaded(pool_model) else 'cold') if node else 'unknown'
+            received = False
+            try:
+                # Hold a scheduler slot while the model generates, not while tools run
+                async with get_request_scheduler().slot(
+                    backend=turn_api_base or '',
                     model=model,
-                    messages=messages,
-                    api_base=api_base,
-                    stream=True
-                )
+                    session=session,
+                    priority=priority,
+                    prompt_chars=sum(len(str(message.get('content') or '')) for message in messages),
+                    on_queue=on_queue
+                ):
+                    with pool.track(node, pool_model):
+                        turn_start = time.perf_counter()
+                        first_token_time = None
+                        response = await llm_completion(
+                            model=model,
+                            messages=messages,
+                            tools=turn_tools,
+                            api_base=turn_api_base,
+                            stream=True
+                        )
+
+                        tool_calls: Dict[int, Dict[str, str]] = {}
+                        tool_call_indexes: Dict[int, int] = {}
+                        content_parts: List[str] = []
+                        token_count = 0
+                        # Closing the stream ends the HTTP request, so Ollama stops generating
+                        # as soon as the consumer stops or the task is cancelled
+                        async with aclosing(response):
+                            async for chunk in response:
+                                received = True
+                                if not chunk.choices:
+                                    continue
+                                choice = chunk.choices[0]
+                                delta = choice.delta
+                                if first_token_time is None and (delta.content or delta.reasoning or delta.tool_calls):
+                                    first_token_time = time.perf_counter()
+                                if delta.tool_calls:
+                                    accumulate_tool_call_deltas(tool_calls, delta.tool_calls, tool_call_indexes)
+                                elif delta.content or delta.reasoning:
+                                    token_count += 1
+                                    if delta.content:
+                                        content_parts.append(delta.content)
+                                    yield chunk
+                                elif choice.finish_reason and not tool_calls:
+                                    # Forward the final chunk only when no tool turn follows
+                                    yield chunk
+
+                        stream_end = time.perf_counter()
+                break
+            except Exception as error:
+                if node is None or received or not is_connection_error(error):
+                    raise
+                pool.mark_failed(node, error)
+                failed_nodes.append(node)
+                if len(failed_nodes) >= len(pool.nodes):
+                    raise
+                logger.warning(f"Retrying {model} on another Ollama node after {node.url} failed")
+
+        ttft = (first_token_time or stream_end) - turn_start
+        observe('llm_ttft', ttft, model=model, load=load_state)
+        observe('llm_stream', stream_end - turn_start, model=model)
+        inc_counter('llm_stream_chunks', token_count, model=model)
+        if not tool_calls:
+            logger.info(
+                f"Agent turn {iteration + 1}: time to first token {ttft:.3f}s ({load_state}), "
+                f"stream {stream_end - turn_start:.3f}s")
+            return
+
+        use_tools = build_tool_calls(tool_calls)
+        messages.append({
+            "role": "assistant",
+            "content": ''.join(content_parts),
+            "tool_calls": [tool_call.model_dump() for tool_call in use_tools]
+        })
+        messages.extend(await call_tools(use_tools))
+        observe('agent_tools', time.perf_counter() - stream_end, model=model)
+        logger.info(
+            f"Agent turn {iteration + 1}: time to first token {ttft:.3f}s ({load_state}), "
+            f"stream {stream_end - turn_start:.3f}s, "
+            f"{len(use_tools)} tool calls {time.perf_counter() - stream_end:.3f}s")
+
+
+async def complete_text(model: str, messages: List[Dict[str, str]],
+                        api_base: Optional[str] = None,
+                        priority: int = PRIORITY_BATCH) -> str:
+    """
+    Get the complete text of a model answer without tools, e.g. for background work.
+
+    Like agent_runner, the request holds a scheduler slot and, without an
+    api_base, goes to a node of the Ollama pool, moving to another node if
+    its node cannot be reached.
+
+    Args:
+        model: Model name.
+        messages: List of message dicts.
+        api_base: API base URL, None to route Ollama models through the Ollama pool.
+        priority: Scheduler priority class of the request.
+
+    Returns:
+        str: Content of the answer.
+    """
+    session = _session_id()
+    pool = get_ollama_pool()
+    pool_model = ollama_model_name(model) if api_base is None else None
+    failed_nodes: List[OllamaNode] = []
+    while True:
+        node = pool.pick(pool_model, exclude=failed_nodes) if pool_model else None
+        request_api_base = node.url if node else api_base
+        try:
+            async with get_request_scheduler().slot(
+                backend=request_api_base or '',
+                model=model,
+                session=session,
+                priority=priority,
+                prompt_chars=sum(len(str(message.get('content') or '')) for message in messages)
+            ):
+                with pool.track(node, pool_model):
+                    response = await llm_completion(
+                        model=model, messages=messages, api_base=request_api_base, stream=False)
+            return response.choices[0].message.content or ''
+        except Exception as error:
+            if node is None or not is_connection_error(error):
+                raise
+            pool.mark_failed(node, error)
+            failed_nodes.append(node)
+            if len(failed_nodes) >= len(pool.nodes):
+                raise
+            logger.warning(f"Retrying {model} on another Ollama node after {node.url} failed")
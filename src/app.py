@@ -1,3 +1,4 @@
+import asyncio
 import json
 import logging
 from typing import Any
@@ -6,19 +7,58 @@ import chainlit as cl
 from chainlit.cli import run_chainlit
 from mcp import ClientSession
 
-from app_helper import MODEL_ID, append_message_to_session_history, initialize_session_chat_settings, prompt_to_fill_template, update_session_chat_settings
-from llm_service import chat_messages_send_response
+from app_helper import MODEL_ID, append_message_to_session_history, end_session_after_disconnect, index_session_documents, initialize_session_chat_settings, prompt_to_fill_template, touch_session_model, update_session_chat_settings, warm_session_model
+from local_tools import LOCAL_TOOLS_CONNECTION, PYTHON_EXEC_ENABLED, get_local_tools
+from image_utils import get_image_preprocessor
+from llm_service import chat_messages_send_response, get_available_models
+from metrics import inc_counter, profile_message, span, start_metrics, stop_metrics
+from ollama_pool import get_ollama_pool
+from python_exec import get_python_exec_pool
+from response_cache import get_response_cache
+from settings_store import get_user_settings_store
 from template_utils import list_templates
+from token_utils import preload_encodings
+from tool_registry import get_session_tool_registry
+from warmup import get_warmup_manager
 
 logger = logging.getLogger(__name__)
 
 
+@cl.on_app_startup
+async def on_app_startup():
+    # Load tokenizers, check Ollama nodes, discover models and start workers once so the first chat does not pay for it
+    startup_tasks = [
+        asyncio.to_thread(preload_encodings),
+        get_ollama_pool().start(),
+        get_available_models(),
+        start_metrics()
+    ]
+    if PYTHON_EXEC_ENABLED:
+        startup_tasks.append(get_python_exec_pool().start())
+    await asyncio.gather(*startup_tasks)
+
+
+@cl.on_app_shutdown
+async def on_app_shutdown():
+    await get_python_exec_pool().close()
+    await get_ollama_pool().close()
+    await get_warmup_manager().close()
+    get_image_preprocessor().close()
+    await get_user_settings_store().flush()
+    if response_cache := get_response_cache():
+        await response_cache.close()
+    await stop_metrics()
+
+
 @cl.on_mcp_connect
 async def on_mcp_connect(connection: Any, session: ClientSession):
     # Called when an MCP connection is established
     # npx @playwright/mcp@latest
 
     name = connection.name
+    if name == LOCAL_TOOLS_CONNECTION:
+        logger.warning(f"MCP connection name {name} is reserved for local tools, its tools are not used")
+        return
     result = await session.list_tools()
 
     attributes = vars(connection)
@@ -32,46 +72,69 @@ async def on_mcp_connect(connection: Any, session: ClientSession):
         "input_schema": t.inputSchema,
     } for t in result.tools]
 
-    mcp_tools = cl.user_session.get("mcp_tools", {})
-    mcp_tools[connection.name] = tools
-    cl.user_session.set("mcp_tools", mcp_tools)
+    get_session_tool_registry().add_connection(name, tools)
     logger.debug(f"{json.dumps(tools, indent=2)}")
 
 
 @cl.on_mcp_disconnect
 async def on_mcp_disconnect(name: str, session: ClientSession):
     # Called when an MCP connection is terminated
-    mcp_tools = cl.user_session.get("mcp_tools", {})
-    if name in mcp_tools:
-        del mcp_tools[name]
-        cl.user_session.set("mcp_tools", mcp_tools)
+    if name == LOCAL_TOOLS_CONNECTION:
+        return
+    get_session_tool_registry().remove_connection(name)
 
     logger.info(f"Disconnected from MCP: {name}")
 
 
 @cl.on_chat_start
 async def start():
-    await initialize_session_chat_settings()
+    local_tools = get_local_tools()
+    if local_tools:
+        get_session_tool_registry().add_connection(LOCAL_TOOLS_CONNECTION, local_tools)
+    model = await initialize_session_chat_settings()
+    warm_session_model(model)
 
 
 @cl.on_settings_update
 async def handle_settings_update(new_chat_settings: dict[str, Any]):
     await update_session_chat_settings(settings=new_chat_settings)
+    if MODEL_ID in new_chat_settings:
+        warm_session_model(new_chat_settings[MODEL_ID])
 
 
 @cl.on_message
 async def on_message(message: cl.Message):
     chat_settings = cl.user_session.get('chat_settings')
 
+    model = chat_settings[MODEL_ID]
+    inc_counter('messages', model=model)
     if 'template' in message.content.lower():
         template_message = await prompt_to_fill_template(command=message.content)
         await cl.Message(content=template_message, type="user_message").send()
-        messages = append_message_to_session_history(template_message)
+        content, elements = template_message, None
     else:
-        messages = append_message_to_session_history(message.content, message.elements)
+        content, elements = message.content, message.elements
 
-    model = chat_settings[MODEL_ID]
-    await chat_messages_send_response(model=model, messages=messages)
+    # Waiting for template parameters is excluded from the message span and profile
+    async with profile_message(message.id):
+        with span('message', model=model):
+            await index_session_documents(elements)
+            messages = await append_message_to_session_history(content, elements, model=model)
+            await chat_messages_send_response(model=model, messages=messages)
+    touch_session_model(model)
+
+
+@cl.on_stop
+async def on_stop():
+    # Chainlit cancels the message task, which closes the model stream and cancels running tools
+    inc_counter('messages_stopped')
+    logger.info(f"Session {cl.context.session.id} stopped its task")
+
+
+@cl.on_chat_end
+async def on_chat_end():
+    # Also called on transient disconnects, so a running answer and the session's documents survive a quick reconnect
+    end_session_after_disconnect(cl.context.session)
 
 
 @cl.set_starters
@@ -1,28 +1,55 @@
+import asyncio
 import json
 import logging
-from typing import Any, Dict, List
+import os
+from itertools import islice
+from typing import Any, Dict, List, Set
 
 import chainlit as cl
 from chainlit.input_widget import Select
+from chainlit.user_session import user_sessions
+import httpx
 
-from config import dump_config, load_config
-from llm_service import get_available_models
-from template_utils import extract_template_name, extract_template_vars, render_template_with_vars
-from text_utils import merge_sentences, sentence_split
+from config import load_config
+from context_window import CONTEXT_BUDGET, ContextWindow
+from document_index import RAG_ENABLED, RAG_TEMPLATE, DocumentIndex, open_document_index
+from image_utils import IMAGE_PREPROCESS_ENABLED, get_image_preprocessor, image_max_side
+from llm_service import any_llm_model_name, get_available_models
+from metrics import inc_counter, span
+from ollama_pool import ollama_model_name
+from settings_store import DEFAULT_USER, get_user_settings_store
+from summarizer import SUMMARIZE_LONG_INPUTS, Summarizer, get_summarizer
+from template_utils import extract_template_name, extract_template_vars, render_template_with_vars, render_text_template
+from text_utils import iter_merged_sentences, iter_sentence_split
+from warmup import WARMUP_ENABLED, get_warmup_manager
 
 APP_SETTINGS = 'app_settings'
 CONFIG = {
     APP_SETTINGS: 'settings.toml'
 }
 MODEL_ID = 'model'
+CONTEXT_BUDGETS = 'context_budgets'
+CONTEXT_WINDOW = 'context_window'
+DOCUMENT_INDEX = 'document_index'
+# Replaces a long user message in the history sent to the model
+LONG_INPUT_SUMMARY = 'Summary of a long text sent by the user:'
+# Seconds a disconnected session may reconnect, e.g. after a network blip, before its running answer is stopped
+SESSION_RECONNECT_GRACE = float(os.getenv('SESSION_RECONNECT_GRACE', '30'))
 
 logger = logging.getLogger(__name__)
 
 
-async def initialize_session_chat_settings() -> None:
-    settings = load_config(CONFIG[APP_SETTINGS])
+def session_user() -> str:
+    # Identifier of the authenticated user. Chainlit has no stable id for an anonymous browser, only
+    # per-tab sessions, so without authentication all browsers share the default user's settings
+    user = cl.user_session.get("user")
+    return user.identifier if user else DEFAULT_USER
+
+
+async def initialize_session_chat_settings() -> str:
+    settings = await get_user_settings_store().get(session_user())
     available_models = [model_object.display
-                        for model_object in get_available_models()]
+                        for model_object in await get_available_models()]
     if MODEL_ID in settings:
         selected_model = settings[MODEL_ID]
         if selected_model not in available_models:
@@ -44,38 +71,200 @@ async def initialize_session_chat_settings() -> None:
         ]
     ).send()
     logger.info(f"Chat settings: {chat_settings}")
+    return selected_model
 
 
 async def update_session_chat_settings(settings: dict[str, Any]) -> None:
-    dump_config(settings, CONFIG[APP_SETTINGS])
-    logger.info(f"{CONFIG[APP_SETTINGS]} changed to: {settings}")
+    # Saved per user in the background; config/settings.toml is no longer rewritten
+    try:
+        settings = await get_user_settings_store().update(session_user(), settings)
+    except ValueError as error:
+        logger.warning(f"Chat settings not saved: {error}")
+        return
+    logger.info(f"Chat settings of {session_user()} changed to: {settings}")
 
 
-def append_message_to_session_history(message: str, elements: List = None) -> List[Dict[str, str]]:
-    # get current chat history from session storage
-    messages = cl.chat_context.to_openai()
-    # ensure chat history does not duplicate the new message
-    last_message = messages[-1]
-    if last_message['role'] == 'user' and last_message['content'] == message:
-        messages = messages[:-1]
+def warm_session_model(model: str) -> None:
+    # Preload the session's Ollama model in the background
+    ollama_model = ollama_model_name(any_llm_model_name(model))
+    if WARMUP_ENABLED and ollama_model:
+        get_warmup_manager().warm(ollama_model, session=cl.context.session.id)
 
-    if elements:
-        images = [file.path for file in elements if "image" in file.mime]
-    else:
-        images = None
 
-    # split message into chunks and append to chat history
-    chunks = merge_sentences(sentence_split(message))
-    for index, chunk in enumerate(chunks):
-        message = {"role": "user", "content": chunk}
-        # Add images to the first chunk
-        if index == 0 and images:
-            message["images"] = images
-        messages.append(message)
-    logger.info(f'{len(chunks)} user message chunks')
-    logger.info(json.dumps(messages, indent=2))
+def touch_session_model(model: str) -> None:
+    # Keep the model loaded while the session is active
+    ollama_model = ollama_model_name(any_llm_model_name(model))
+    if WARMUP_ENABLED and ollama_model:
+        get_warmup_manager().touch(ollama_model, session=cl.context.session.id)
+
+
+def get_session_context_window(model: str) -> ContextWindow:
+    model_context_window = cl.user_session.get(CONTEXT_WINDOW)
+    if model_context_window is None or model_context_window[0] != model:
+        budgets = load_config(CONFIG[APP_SETTINGS]).get(CONTEXT_BUDGETS, {})
+        model_context_window = (model, ContextWindow(budget=budgets.get(model, CONTEXT_BUDGET)))
+        cl.user_session.set(CONTEXT_WINDOW, model_context_window)
+    return model_context_window[1]
+
+
+async def index_session_documents(elements: List) -> None:
+    # Add uploaded documents, i.e. files other than images, to the session's index
+    documents = [file for file in elements or [] if file.path and "image" not in (file.mime or "")]
+    if not RAG_ENABLED or not documents:
+        return
+    document_index = cl.user_session.get(DOCUMENT_INDEX)
+    if document_index is None:
+        document_index = open_document_index(cl.context.session.id)
+        cl.user_session.set(DOCUMENT_INDEX, document_index)
+
+    for file in documents:
+        async with cl.Step(name=f"Indexing {file.name}", type="tool") as step:
+            async def on_progress(chunk_count: int) -> None:
+                await step.stream_token(f"{chunk_count} chunks\n")
+
+            try:
+                chunk_count = await document_index.add_document(file.path, file.name, file.mime or "", on_progress)
+                step.output = f"Indexed {chunk_count} chunks of {file.name}"
+            except (ValueError, ConnectionError, httpx.HTTPError) as error:
+                logger.warning(f"Could not index {file.name}: {error!r}")
+                step.output = f"Could not index {file.name}: {error}"
+
+
+async def add_document_context(document_index: DocumentIndex, query: str) -> str:
+    # Send the question with the most relevant chunks of the uploaded documents
+    try:
+        with span('retrieve'):
+            hits = await document_index.search(query)
+    except (ConnectionError, httpx.HTTPError) as error:
+        logger.warning(f"Document search failed: {error!r}")
+        return query
+    if not hits:
+        return query
+    logger.info(f"Retrieved {len(hits)} chunks, best score {hits[0].score:.3f}")
+    information = '\n\n'.join(f"[{hit.source}]\n{hit.text}" for hit in hits)
+    return render_text_template(RAG_TEMPLATE, {'user query string': query, 'information chunk pieces': information})
+
+
+_session_end_tasks: Set[asyncio.Task] = set()
+
+
+def end_session(session: Any) -> None:
+    # Nobody reads the answer of a closed tab, stop generating it and remove the session's documents
+    # Taken now, Chainlit drops the user session of a closed tab right after on_chat_end
+    document_index = user_sessions.get(session.id, {}).pop(DOCUMENT_INDEX, None)
+    task = session.current_task
+    if task and not task.done():
+        inc_counter('messages_stopped')
+        logger.info(f"Session {session.id} is gone, cancelling its task")
+        task.cancel()
+        if document_index is not None:
+            # The task may still use the index until it handles the cancellation
+            task.add_done_callback(lambda _: document_index.delete())
+    elif document_index is not None:
+        document_index.delete()
+
+
+def end_session_after_disconnect(session: Any, grace: float = SESSION_RECONNECT_GRACE) -> None:
+    """
+    End a session once its user is gone.
+
+    Chainlit ends the chat on every websocket disconnect, but keeps the session
+    for the client to reconnect. A closed tab is ended at once; any other
+    disconnect only if the session has not reconnected within grace seconds.
+
+    Args:
+        session: Chainlit websocket session.
+        grace: Seconds to wait for a reconnect.
+    """
+    if session.to_clear:
+        end_session(session)
+        return
+
+    socket_id = session.socket_id
+
+    async def end_unless_reconnected() -> None:
+        await asyncio.sleep(grace)
+        # A reconnect moves the session to a new socket
+        if session.socket_id == socket_id:
+            end_session(session)
+
+    task = asyncio.create_task(end_unless_reconnected())
+    _session_end_tasks.add(task)
+    task.add_done_callback(_session_end_tasks.discard)
+
+
+async def summarize_long_message(summarizer: Summarizer, message: str) -> str:
+    # Summarize the message chunks concurrently, showing the progress in a step
+    async with cl.Step(name="Summarizing long input", type="tool") as step:
+        async def on_progress(stage: str, done: int, total: int) -> None:
+            await step.stream_token(f"{stage}: {done}/{total}\n")
+
+        summary = await summarizer.summarize(message, on_progress=on_progress)
+    return f"{LONG_INPUT_SUMMARY}\n\n{summary}"
+
+
+def replace_summarized_messages(summarizer: Summarizer, messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    # Earlier long user messages are sent as their cached summaries
+    replaced = []
+    for message in messages:
+        content = message.get('content')
+        summary = summarizer.cached(content) if message['role'] == 'user' and isinstance(content, str) else None
+        if summary is not None:
+            message = {**message, "content": f"{LONG_INPUT_SUMMARY}\n\n{summary}"}
+        replaced.append(message)
+    return replaced
+
+
+async def append_message_to_session_history(message: str, elements: List = None, model: str = None) -> List[Dict[str, str]]:
+    with span('history'):
+        # get current chat history from session storage
+        messages = cl.chat_context.to_openai()
+        # ensure chat history does not duplicate the new message
+        last_message = messages[-1]
+        if last_message['role'] == 'user' and last_message['content'] == message:
+            messages = messages[:-1]
+
+        if elements:
+            images = [file.path for file in elements if "image" in file.mime]
+            if images and IMAGE_PREPROCESS_ENABLED:
+                # send images at the model's input resolution instead of the original upload
+                images = await get_image_preprocessor().prepare(images, max_side=image_max_side(model))
+        else:
+            images = None
+
+        summarizer = get_summarizer(any_llm_model_name(model)) if SUMMARIZE_LONG_INPUTS and model else None
+        if summarizer:
+            messages = replace_summarized_messages(summarizer, messages)
+
+        # split message into chunks off the event loop; two chunks tell whether it is long
+        with span('tokenize'):
+            packed = iter_merged_sentences(iter_sentence_split(message))
+            chunks = await asyncio.to_thread(list, islice(packed, 2))
+        if summarizer and len(chunks) > 1:
+            # map-reduce the chunks into one summary instead of sending them all
+            chunks = [await summarize_long_message(summarizer, message)]
+        elif len(chunks) > 1:
+            with span('tokenize'):
+                chunks += await asyncio.to_thread(list, packed)
+        document_index = cl.user_session.get(DOCUMENT_INDEX)
+        if document_index and chunks:
+            # the question, usually at the end of the message, gets the relevant chunks of the uploaded documents
+            chunks[-1] = await add_document_context(document_index, chunks[-1])
+        for chunk_count, chunk in enumerate(chunks):
+            message = {"role": "user", "content": chunk}
+            # Add images to the first chunk
+            if chunk_count == 0 and images:
+                message["images"] = images
+            messages.append(message)
+        logger.info(f'{len(chunks)} user message chunks')
+
+        # keep the prompt within the model's context budget
+        if model:
+            with span('context_fit', model=model):
+                messages = get_session_context_window(model).fit(messages)
+        logger.debug(json.dumps(messages, indent=2))
 
-    return messages
+        return messages
 
 
 async def prompt_to_fill_template(command: str) -> str:
@@ -88,4 +277,5 @@ async def prompt_to_fill_template(command: str) -> str:
         if user_response:
             template_params[param] = user_response['output']
 
-    return render_template_with_vars(name=template, context=template_params)
+    with span('template_render'):
+        return render_template_with_vars(name=template, context=template_params)
@@ -1,27 +1,52 @@
+import os
+import tempfile
+import threading
 from pathlib import Path
-from typing import Any
+from typing import Any, Dict, Tuple
 
 import toml
 
+# Parsed files by path, with the modification time and size they were parsed at
+_configs: Dict[str, Tuple[Tuple[int, int], dict[str, Any]]] = {}
+_configs_lock = threading.Lock()
+
 
 def load_config(file: str) -> dict[str, Any]:
+    # Parsed once per change of the file; callers must not modify the returned settings
     toml_file = f'config/{file}'
-    if not Path(toml_file).exists():
+    try:
+        stat = os.stat(toml_file)
+    except FileNotFoundError:
         return {}
 
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _configs.get(toml_file)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+
     settings = toml.load(toml_file)
+    with _configs_lock:
+        _configs[toml_file] = (version, settings)
     return settings
 
 
-def dump_config(settings: dict[str, Any], file: str):
-    toml_file = f'config/{file}'
-
-    file_path = Path('config/settings.toml')
-    if not file_path.exists():
-        # Create the directory structure if it doesn't exist
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        # Create the file
-        file_path.touch()
-
-    with open(toml_file, 'w') as f:
-        toml.dump(settings, f)
+def write_toml_atomic(path: str | Path, settings: dict[str, Any]) -> None:
+    """
+    Write a TOML file so readers see either the old or the new content.
+
+    Args:
+        path: File to write; its directory is created if missing.
+        settings: Settings to write.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    descriptor, temporary = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+    try:
+        with os.fdopen(descriptor, 'w') as f:
+            toml.dump(settings, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        Path(temporary).unlink(missing_ok=True)
+        raise
@@ -0,0 +1,105 @@
+import hashlib
+import logging
+import os
+from typing import Any, Dict, List
+
+from token_utils import count_tokens
+
+# Default prompt token budget per model, see context_budgets in config/settings.toml
+CONTEXT_BUDGET = int(os.getenv('CONTEXT_BUDGET', '8192'))
+# Number of most recent messages that are never trimmed
+CONTEXT_KEEP_RECENT = int(os.getenv('CONTEXT_KEEP_RECENT', '4'))
+# Fraction of the budget the history is trimmed down to when it overflows
+CONTEXT_TRIM_TARGET = float(os.getenv('CONTEXT_TRIM_TARGET', '0.6'))
+# Approximate per-message overhead of the chat template
+MESSAGE_OVERHEAD_TOKENS = 4
+
+logger = logging.getLogger(__name__)
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    content = message.get('content') or ''
+    if isinstance(content, list):
+        content = ''.join(part.get('text', '') for part in content if isinstance(part, dict))
+    return f"{message.get('role', '')}\n{content}"
+
+
+class ContextWindow:
+    """
+    Keep the chat history of a session within a token budget.
+
+    Leading system messages and the most recent messages are always kept.
+    When the history overflows the budget, the oldest turns are cut in one
+    step down to CONTEXT_TRIM_TARGET of the budget and replaced by a short
+    note. The cut point is remembered, so later turns resend a byte-identical
+    prefix and Ollama can reuse its KV cache until the next overflow.
+
+    Args:
+        budget: Prompt token budget of the model.
+        keep_recent: Number of most recent messages that are never trimmed.
+        trim_target: Fraction of the budget to trim down to on overflow.
+    """
+
+    def __init__(self, budget: int = CONTEXT_BUDGET, keep_recent: int = CONTEXT_KEEP_RECENT,
+                 trim_target: float = CONTEXT_TRIM_TARGET) -> None:
+        self.budget = budget
+        self.keep_recent = keep_recent
+        self.trim_target = trim_target
+        self._token_counts: Dict[str, int] = {}
+        self._cut = 0
+
+    def count_message_tokens(self, messages: List[Dict[str, Any]]) -> List[int]:
+        texts = [_message_text(message) for message in messages]
+        keys = [hashlib.sha1(text.encode('utf-8')).hexdigest() for text in texts]
+        missing = {key: text for key, text in zip(keys, texts) if key not in self._token_counts}
+        if missing:
+            counts = count_tokens(list(missing.values()))
+            self._token_counts.update(zip(missing.keys(), counts))
+        return [self._token_counts[key] + MESSAGE_OVERHEAD_TOKENS for key in keys]
+
+    def fit(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Trim the chat history to the token budget.
+
+        Args:
+            messages: Full chat history in OpenAI format.
+
+        Returns:
+            List[Dict[str, Any]]: Pinned system messages, an omission note if
+            turns were cut, and the retained history.
+        """
+        pinned = 0
+        while pinned < len(messages) and messages[pinned].get('role') == 'system':
+            pinned += 1
+        system_messages, history = messages[:pinned], messages[pinned:]
+        if self._cut > len(history):
+            # History was replaced, e.g. a new chat or an edited message
+            self._cut = 0
+
+        token_counts = self.count_message_tokens(messages)
+        system_tokens = sum(token_counts[:pinned])
+        history_tokens = token_counts[pinned:]
+
+        if system_tokens + sum(history_tokens[self._cut:]) > self.budget:
+            target = self.budget * self.trim_target - system_tokens
+            last_cut = max(self._cut, len(history) - self.keep_recent)
+            cut = self._cut
+            retained_tokens = sum(history_tokens[cut:])
+            while cut < last_cut and retained_tokens > target:
+                retained_tokens -= history_tokens[cut]
+                cut += 1
+            # Start at a user message so tool results are not separated from their calls
+            while cut < last_cut and history[cut].get('role') != 'user':
+                cut += 1
+            logger.info(
+                f"Context window: omitting {cut} of {len(history)} messages to fit {self.budget} tokens")
+            self._cut = cut
+
+        if not self._cut:
+            return messages
+
+        note = {
+            "role": "system",
+            "content": f"[{self._cut} earlier messages of this conversation were omitted to fit the context window.]"
+        }
+        return system_messages + [note] + history[self._cut:]
@@ -0,0 +1,341 @@
+import asyncio
+import logging
+import os
+import shutil
+from dataclasses import dataclass
+from itertools import islice
+from pathlib import Path
+from typing import Awaitable, Callable, Iterator, List, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from metrics import inc_counter, span
+from ollama_pool import OllamaNode, OllamaPool, get_ollama_pool, is_connection_error
+from scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, get_request_scheduler
+from text_utils import iter_merged_sentences, iter_stream_sentences
+
+# Index uploaded documents and add the chunks relevant to a question to the prompt
+RAG_ENABLED = os.getenv('RAG_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Ollama model computing the embeddings
+RAG_EMBEDDING_MODEL = os.getenv('RAG_EMBEDDING_MODEL', 'nomic-embed-text')
+# Token budget of an indexed chunk
+RAG_CHUNK_TOKENS = int(os.getenv('RAG_CHUNK_TOKENS', '512'))
+# Chunks embedded by one request
+RAG_EMBED_BATCH = int(os.getenv('RAG_EMBED_BATCH', '32'))
+# Seconds an embedding request may take
+RAG_EMBED_TIMEOUT = float(os.getenv('RAG_EMBED_TIMEOUT', '120'))
+# Chunks added to a question
+RAG_TOP_K = int(os.getenv('RAG_TOP_K', '5'))
+# Minimum cosine similarity of a chunk to the question, below it the question is sent as is
+RAG_MIN_SCORE = float(os.getenv('RAG_MIN_SCORE', '0.35'))
+# Template in data/templates that receives the question and the chunks
+RAG_TEMPLATE = os.getenv('RAG_TEMPLATE', 'RAG Q&A')
+# Directory of the per-session index files, removed when the chat ends
+RAG_INDEX_DIR = os.getenv('RAG_INDEX_DIR', 'data/indexes')
+
+# Characters read from a text document at a time
+READ_BLOCK_CHARS = 1 << 20
+# Rows allocated in the vector file when the first chunk is added
+INITIAL_CAPACITY = 1024
+TEXT_MIME_TYPES = {
+    'application/json', 'application/xml', 'application/x-yaml', 'application/yaml', 'application/toml',
+    'application/javascript', 'application/x-sh', 'application/sql', 'application/x-ndjson'
+}
+TEXT_SUFFIXES = {
+    '.txt', '.md', '.rst', '.csv', '.tsv', '.json', '.jsonl', '.xml', '.html', '.htm', '.yml', '.yaml',
+    '.toml', '.ini', '.log', '.py', '.js', '.ts', '.java', '.c', '.cpp', '.h', '.go', '.rs', '.sql', '.sh'
+}
+
+logger = logging.getLogger(__name__)
+
+# Called with the number of chunks indexed so far
+IndexProgressCallback = Callable[[int], Awaitable[None]]
+
+
+def iter_document_text(path: str, mime: str = '') -> Iterator[str]:
+    """
+    Read the text of a document in blocks.
+
+    PDF documents need the optional pypdf package and are read page by page.
+
+    Args:
+        path: File path.
+        mime: MIME type reported by the upload.
+
+    Yields:
+        str: Consecutive blocks of the document's text.
+
+    Raises:
+        ValueError: If the document type is not supported.
+    """
+    suffix = Path(path).suffix.lower()
+    if mime == 'application/pdf' or suffix == '.pdf':
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise ValueError("pypdf is not installed, PDF documents cannot be indexed")
+        for page in PdfReader(path).pages:
+            yield (page.extract_text() or '') + '\n'
+        return
+
+    if not (mime.startswith('text/') or mime in TEXT_MIME_TYPES or suffix in TEXT_SUFFIXES):
+        raise ValueError(f"Unsupported document type {mime or suffix}")
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        while block := f.read(READ_BLOCK_CHARS):
+            yield block
+
+
+def iter_document_chunks(path: str, mime: str = '', chunk_tokens: int = RAG_CHUNK_TOKENS) -> Iterator[str]:
+    # Sentence-packed chunks of a document, produced while it is read
+    chunks = iter_merged_sentences(iter_stream_sentences(iter_document_text(path, mime)), context_length=chunk_tokens)
+    return (chunk for chunk in chunks if chunk.strip())
+
+
+@dataclass
+class SearchHit:
+    text: str
+    source: str
+    score: float
+
+
+class VectorIndex:
+    """
+    Memory-mapped matrix of unit-length embeddings and the chunks they belong to.
+
+    Vectors are float32 rows of vectors.f32 in the index directory, a file
+    that doubles in size when it is full, so the vectors of large documents
+    stay on disk. Chunk texts are appended to chunks.txt and read back by
+    offset. Cosine similarity of a query to every chunk is a single
+    matrix-vector product over the memory map.
+
+    Args:
+        directory: Directory of the index files, created if missing.
+    """
+
+    def __init__(self, directory: str | Path) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.dimensions = 0
+        self.count = 0
+        self.sources: List[str] = []
+        self._capacity = 0
+        self._vectors: Optional[np.memmap] = None
+        self._vectors_path = self.directory / 'vectors.f32'
+        self._vectors_path.unlink(missing_ok=True)
+        self._texts = open(self.directory / 'chunks.txt', 'w+b')
+        # Start, length and source of each chunk text
+        self._offsets: List[Tuple[int, int, int]] = []
+
+    def _grow(self, rows: int) -> None:
+        needed = self.count + rows
+        if needed <= self._capacity:
+            return
+        capacity = max(INITIAL_CAPACITY, self._capacity * 2, needed)
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        with open(self._vectors_path, 'ab') as f:
+            f.truncate(capacity * self.dimensions * np.dtype(np.float32).itemsize)
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r+', shape=(capacity, self.dimensions))
+        self._capacity = capacity
+
+    def add(self, vectors: np.ndarray, texts: List[str], source: str) -> None:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) != len(texts):
+            raise ValueError(f"{len(vectors)} vectors for {len(texts)} chunks")
+        if not texts:
+            return
+        if not self.dimensions:
+            self.dimensions = vectors.shape[1]
+        elif vectors.shape[1] != self.dimensions:
+            raise ValueError(f"Vectors have {vectors.shape[1]} dimensions, the index {self.dimensions}")
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        self._grow(len(texts))
+        self._vectors[self.count:self.count + len(texts)] = vectors / norms
+
+        if not self.sources or self.sources[-1] != source:
+            self.sources.append(source)
+        self._texts.seek(0, os.SEEK_END)
+        for text in texts:
+            data = text.encode('utf-8')
+            self._offsets.append((self._texts.tell(), len(data), len(self.sources) - 1))
+            self._texts.write(data)
+        self._texts.flush()
+        self.count += len(texts)
+
+    def text(self, row: int) -> str:
+        # Positional read, searches run in a worker thread while chunks may be appended
+        start, length, _ = self._offsets[row]
+        return os.pread(self._texts.fileno(), length, start).decode('utf-8')
+
+    def search(self, query: np.ndarray, top_k: int = RAG_TOP_K, min_score: float = -1.0) -> List[SearchHit]:
+        """
+        Find the chunks most similar to a query.
+
+        Args:
+            query: Embedding of the query.
+            top_k: Maximum number of chunks.
+            min_score: Minimum cosine similarity of a returned chunk.
+
+        Returns:
+            List[SearchHit]: Chunks by decreasing similarity.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if not self.count or top_k <= 0 or norm == 0:
+            return []
+        scores = self._vectors[:self.count] @ (query / norm)
+        k = min(top_k, self.count)
+        rows = np.argpartition(-scores, k - 1)[:k]
+        rows = rows[np.argsort(-scores[rows])]
+        return [SearchHit(self.text(row), self.sources[self._offsets[row][2]], float(scores[row]))
+                for row in rows if scores[row] >= min_score]
+
+    def close(self) -> None:
+        if self._vectors is not None:
+            self._vectors.flush()
+            self._vectors = None
+        self._texts.close()
+
+    def delete(self) -> None:
+        self.close()
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+class OllamaEmbedder:
+    """
+    Batch embeddings from Ollama's /api/embed endpoint.
+
+    Requests go to a node of the Ollama pool and hold a scheduler slot of the
+    embedding model, moving to another node if their node cannot be reached.
+
+    Args:
+        model: Ollama embedding model.
+        pool: Ollama nodes, defaults to the process-wide pool.
+        timeout: Seconds a request may take.
+    """
+
+    def __init__(self, model: str = RAG_EMBEDDING_MODEL, pool: Optional[OllamaPool] = None,
+                 timeout: float = RAG_EMBED_TIMEOUT) -> None:
+        self.model = model
+        self._pool = pool
+        self.timeout = timeout
+
+    @property
+    def pool(self) -> OllamaPool:
+        return self._pool or get_ollama_pool()
+
+    async def embed(self, texts: List[str], session: str = '', priority: int = PRIORITY_BATCH) -> np.ndarray:
+        failed_nodes: List[OllamaNode] = []
+        while True:
+            node = self.pool.pick(self.model, exclude=failed_nodes)
+            try:
+                async with get_request_scheduler().slot(
+                    backend=node.url, model=self.model, session=session,
+                    priority=priority, prompt_chars=sum(len(text) for text in texts)
+                ):
+                    with self.pool.track(node, self.model), span('embed', model=self.model):
+                        async with httpx.AsyncClient(timeout=self.timeout) as client:
+                            response = await client.post(
+                                f'{node.url}/api/embed', json={'model': self.model, 'input': texts})
+                            response.raise_for_status()
+                return np.asarray(response.json()['embeddings'], dtype=np.float32)
+            except Exception as error:
+                if not is_connection_error(error):
+                    raise
+                self.pool.mark_failed(node, error)
+                failed_nodes.append(node)
+                if len(failed_nodes) >= len(self.pool.nodes):
+                    raise
+                logger.warning(f"Retrying embeddings on another Ollama node after {node.url} failed")
+
+
+class DocumentIndex:
+    """
+    Documents uploaded to a chat session, searchable by similarity to a question.
+
+    A document is read, split into sentence-packed chunks and embedded in
+    batches as it streams in: reading and chunking run in a worker thread
+    and prepare the next batch while the current one is embedded, so neither
+    the document nor its vectors have to fit in memory.
+
+    Args:
+        directory: Directory of the index files.
+        embedder: Embedding backend, defaults to Ollama with RAG_EMBEDDING_MODEL.
+        session: Session id used for fair queuing of the embedding requests.
+        chunk_tokens: Token budget of a chunk.
+        batch_size: Chunks embedded by one request.
+    """
+
+    def __init__(
+        self,
+        directory: str | Path,
+        embedder: Optional[OllamaEmbedder] = None,
+        session: str = '',
+        chunk_tokens: int = RAG_CHUNK_TOKENS,
+        batch_size: int = RAG_EMBED_BATCH
+    ) -> None:
+        self.index = VectorIndex(directory)
+        self.embedder = embedder or OllamaEmbedder()
+        self.session = session
+        self.chunk_tokens = chunk_tokens
+        self.batch_size = max(1, batch_size)
+        self.documents: List[str] = []
+
+    async def add_document(self, path: str, name: str, mime: str = '',
+                           on_progress: Optional[IndexProgressCallback] = None) -> int:
+        """
+        Index a document.
+
+        Args:
+            path: File path.
+            name: Name the document's chunks are attributed to.
+            mime: MIME type reported by the upload.
+            on_progress: Called after each embedded batch with the chunks indexed so far.
+
+        Returns:
+            int: Number of indexed chunks.
+
+        Raises:
+            ValueError: If the document type is not supported.
+        """
+        chunks = iter_document_chunks(path, mime, self.chunk_tokens)
+
+        def next_batch() -> List[str]:
+            return list(islice(chunks, self.batch_size))
+
+        count = 0
+        with span('document_index', model=self.embedder.model):
+            pending = asyncio.ensure_future(asyncio.to_thread(next_batch))
+            try:
+                while batch := await pending:
+                    pending = asyncio.ensure_future(asyncio.to_thread(next_batch))
+                    vectors = await self.embedder.embed(batch, session=self.session)
+                    self.index.add(vectors, batch, name)
+                    count += len(batch)
+                    if on_progress:
+                        await on_progress(count)
+            finally:
+                pending.cancel()
+
+        self.documents.append(name)
+        inc_counter('documents_indexed')
+        inc_counter('document_chunks', count)
+        logger.info(f"Indexed {count} chunks of {name}")
+        return count
+
+    async def search(self, query: str, top_k: int = RAG_TOP_K, min_score: float = RAG_MIN_SCORE) -> List[SearchHit]:
+        if not self.index.count:
+            return []
+        vector = (await self.embedder.embed([query], session=self.session, priority=PRIORITY_INTERACTIVE))[0]
+        return await asyncio.to_thread(self.index.search, vector, top_k, min_score)
+
+    def delete(self) -> None:
+        self.index.delete()
+
+
+def open_document_index(session: str) -> DocumentIndex:
+    return DocumentIndex(Path(RAG_INDEX_DIR) / session, session=session)
@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import load_config
+from metrics import inc_counter, span
+
+# Downscale, re-encode and strip metadata of uploaded images before they are sent to the model
+IMAGE_PREPROCESS_ENABLED = os.getenv('IMAGE_PREPROCESS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Default longest side in pixels, see image_max_side in config/settings.toml for per-model sizes
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', '1024'))
+# JPEG quality of re-encoded images
+IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', '85'))
+# Threads preparing images
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+# Directory of prepared images, named by the hash of their content and preparation
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', 'data/image_cache')
+
+SETTINGS_FILE = 'settings.toml'
+IMAGE_MAX_SIDE_SETTINGS = 'image_max_side'
+# Source files whose prepared path is remembered
+PREPARED_PATHS_LIMIT = 1024
+
+logger = logging.getLogger(__name__)
+
+
+def image_max_side(model: Optional[str]) -> int:
+    # Native input resolution of the model's vision encoder, larger images are downscaled by it anyway
+    sizes = load_config(SETTINGS_FILE).get(IMAGE_MAX_SIDE_SETTINGS, {})
+    return int(sizes.get(model, IMAGE_MAX_SIDE)) if model else IMAGE_MAX_SIDE
+
+
+def prepare_image(path: str, max_side: int = IMAGE_MAX_SIDE, quality: int = IMAGE_JPEG_QUALITY,
+                  cache_dir: str = IMAGE_CACHE_DIR) -> str:
+    """
+    Downscale an image to max_side, re-encode it and drop its metadata.
+
+    Photos are rotated by their EXIF orientation and stored as JPEG, images with
+    transparency as PNG. The result is stored under the hash of the original
+    bytes and the preparation settings, so the same upload is prepared once.
+    Needs the optional Pillow package; without it, or for files Pillow cannot
+    read, the original path is returned.
+
+    Args:
+        path: Path of the uploaded image.
+        max_side: Longest side of the prepared image in pixels.
+        quality: JPEG quality.
+        cache_dir: Directory of prepared images.
+
+    Returns:
+        str: Path of the prepared image.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        logger.warning("Pillow is not installed, images are sent unprepared")
+        return path
+
+    data = Path(path).read_bytes()
+    key = hashlib.sha256(data + f'\0{max_side}\0{quality}'.encode()).hexdigest()
+    for suffix in ('.jpg', '.png'):
+        cached = Path(cache_dir) / f'{key}{suffix}'
+        if cached.exists():
+            inc_counter('image_cache_hits')
+            return str(cached)
+
+    try:
+        with Image.open(path) as image:
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+            transparent = image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info)
+            image = image.convert('RGBA' if transparent else 'RGB')
+            # A new image carries no EXIF, ICC, XMP or text chunks of the original
+            clean = Image.new(image.mode, image.size)
+            clean.paste(image)
+    except (OSError, ValueError, Image.DecompressionBombError) as error:
+        logger.warning(f"Could not prepare image {path}: {error!r}")
+        return path
+
+    prepared = Path(cache_dir) / f'{key}{".png" if transparent else ".jpg"}'
+    temporary = None
+    try:
+        Path(cache_dir).mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file of its own first, so concurrent preparations of the same
+        # image never share one and a concurrent request never reads a partial image
+        descriptor, temporary = tempfile.mkstemp(dir=cache_dir, prefix=f'{key}.', suffix='.tmp')
+        os.close(descriptor)
+        if transparent:
+            clean.save(temporary, format='PNG', optimize=True)
+        else:
+            clean.save(temporary, format='JPEG', quality=quality, optimize=True)
+        os.replace(temporary, prepared)
+    except OSError as error:
+        logger.warning(f"Could not store prepared image {path}: {error!r}")
+        if temporary is not None:
+            Path(temporary).unlink(missing_ok=True)
+        return path
+    inc_counter('images_prepared')
+    logger.info(f"Prepared {path}: {len(data)} to {prepared.stat().st_size} bytes, {clean.size[0]}x{clean.size[1]}")
+    return str(prepared)
+
+
+class ImagePreprocessor:
+    """
+    Prepare uploaded images in a thread pool.
+
+    Decoding, resizing and encoding release the GIL in Pillow, so several
+    images are prepared in parallel without blocking the event loop. Prepared
+    paths are also remembered by source path, modification time and size, so
+    a file that was already prepared is not even read again.
+
+    Args:
+        workers: Number of threads.
+    """
+
+    def __init__(self, workers: int = IMAGE_WORKERS) -> None:
+        self.workers = max(1, workers)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._prepared: Dict[Tuple[str, int, int, int], str] = {}
+
+    async def prepare(self, paths: List[str], max_side: int = IMAGE_MAX_SIDE) -> List[str]:
+        """
+        Prepare images concurrently.
+
+        Args:
+            paths: Paths of the uploaded images.
+            max_side: Longest side of the prepared images in pixels.
+
+        Returns:
+            List[str]: Paths of the prepared images, in the order of paths.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image')
+        loop = asyncio.get_running_loop()
+
+        async def prepare_one(path: str) -> str:
+            stat = os.stat(path)
+            key = (path, stat.st_mtime_ns, stat.st_size, max_side)
+            prepared = self._prepared.get(key)
+            if prepared is None or not os.path.exists(prepared):
+                prepared = await loop.run_in_executor(self._executor, prepare_image, path, max_side)
+                self._prepared[key] = prepared
+                if len(self._prepared) > PREPARED_PATHS_LIMIT:
+                    del self._prepared[next(iter(self._prepared))]
+            return prepared
+
+        with span('image_prepare'):
+            return list(await asyncio.gather(*(prepare_one(path) for path in paths)))
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+_image_preprocessor: Optional[ImagePreprocessor] = None
+
+
+def get_image_preprocessor() -> ImagePreprocessor:
+    global _image_preprocessor
+    if _image_preprocessor is None:
+        _image_preprocessor = ImagePreprocessor()
+    return _image_preprocessor
@@ -1,18 +1,36 @@
+import asyncio
 import logging
 import os
 import time
-from typing import AsyncIterator, Dict, List
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 import chainlit as cl
 from dotenv import load_dotenv
-from any_llm import ProviderName, list_models
-from any_llm.types.completion import ChatCompletion, ChatCompletionChunk
+from any_llm import ProviderName, list_models_async
+from any_llm.types.completion import ChatCompletionChunk
 from pydantic import BaseModel
 
 from agent_helper import agent_runner
+from metrics import observe, span
+from ollama_pool import get_ollama_pool
+from stream_utils import MESSAGE, REASONING, THINKING, CoalescingStreamWriter, ThinkStreamParser
+from tool_registry import get_session_tool_registry
 
 logger = logging.getLogger(__name__)
 
 CLOUD_SERVICE_PREFIX = "☁️🔗 "
+AUTHOR_TRANSLATION = str.maketrans({'.': '_', ':': '#'})
+# Step name while streaming and verb of the final name, per thought segment kind
+THOUGHT_STEP_NAMES = {
+    REASONING: ("Reasoning", "Reasoned"),
+    THINKING: ("Thinking", "Thought"),
+}
+
+load_dotenv()
+
+# Seconds a discovered model list is served before it is refreshed in the background
+MODELS_CACHE_TTL = float(os.getenv('MODELS_CACHE_TTL', '60'))
+# Seconds to wait for a single provider's list_models() call
+MODELS_PROVIDER_TIMEOUT = float(os.getenv('MODELS_PROVIDER_TIMEOUT', '5'))
 
 
 class Model(BaseModel):
@@ -21,83 +39,228 @@ class Model(BaseModel):
     display: str
 
 
-def list_provider_models(
-    provider: ProviderName, api_key: str = None
+_provider_models: Dict[ProviderName, List[Model]] = {}
+_models_refreshed_at: Optional[float] = None
+_models_refresh_task: Optional[asyncio.Task] = None
+
+
+async def list_ollama_pool_models(timeout: float = MODELS_PROVIDER_TIMEOUT) -> List[Any]:
+    """
+    List the models of all Ollama pool nodes, merged by model id.
+
+    Args:
+        timeout: Seconds to wait for each node.
+
+    Returns:
+        List[Any]: Models available on at least one node.
+
+    Raises:
+        Exception: If no node can be reached within the timeout.
+    """
+    nodes = get_ollama_pool().nodes
+    results = await asyncio.gather(
+        *(asyncio.wait_for(list_models_async(provider=ProviderName.OLLAMA, api_base=node.url), timeout=timeout)
+          for node in nodes),
+        return_exceptions=True
+    )
+    merged: Dict[str, Any] = {}
+    for node, result in zip(nodes, results):
+        if isinstance(result, BaseException):
+            logger.warning(f"Ollama node {node.url} list_models() error: {result!r}")
+            continue
+        for model in result:
+            merged.setdefault(model.id, model)
+    if not merged and all(isinstance(result, BaseException) for result in results):
+        raise results[0]
+    return list(merged.values())
+
+
+async def query_provider_models(
+    provider: ProviderName, api_key: str = None, timeout: float = MODELS_PROVIDER_TIMEOUT
 ) -> List[Model]:
     """
-    List models for the specified provider.
+    Query models for the specified provider.
 
     Args:
         provider: ProviderName to query (can be local or remote).
         api_key: API key for the provider (may be unused depending on provider).
+        timeout: Seconds to wait for the provider before giving up.
 
     Returns:
-        List[Model]: List of models provided by the specified provider, or an empty list if there is a connection error.
+        List[Model]: List of models provided by the specified provider.
+
+    Raises:
+        Exception: If the provider cannot be reached within the timeout.
     """
     if provider == ProviderName.OLLAMA:
         prefix = ""
     else:
         prefix = f"{CLOUD_SERVICE_PREFIX}{provider.value}:"
 
-    try:
-        list_models_response = list_models(provider=provider, api_key=api_key)
-        if provider == ProviderName.COHERE:
-            models = sorted(
-                (
-                    model
-                    for model in list_models_response
-                    if not (model.id.startswith("embed") or model.id.startswith("rerank"))
-                ),
-                key=lambda model: model.id
-            )
-        else:
-            models = sorted(list_models_response, key=lambda model: model.id)
-
-        provider_models = [
-            Model(
-                name=model.id,
-                provider=provider,
-                display=prefix + model.id,
-            )
-            for model in models
-        ]
-        return provider_models
-    except Exception as error:
-        logger.error(f"{provider} list_models() error: {error}")
-        return []
-
-
-def get_available_models() -> List[Model]:
-    load_dotenv()
-    cloud_service_models: List[Model] = []
-    if os.getenv('CO_API_KEY'):
-        cloud_service_models += list_provider_models(
-            provider=ProviderName.COHERE)
+    if provider == ProviderName.OLLAMA:
+        list_models_response = await list_ollama_pool_models(timeout=timeout)
+    else:
+        list_models_response = await asyncio.wait_for(
+            list_models_async(provider=provider, api_key=api_key), timeout=timeout)
+    if provider == ProviderName.COHERE:
+        models = sorted(
+            (
+                model
+                for model in list_models_response
+                if not (model.id.startswith("embed") or model.id.startswith("rerank"))
+            ),
+            key=lambda model: model.id
+        )
+    else:
+        models = sorted(list_models_response, key=lambda model: model.id)
+
+    provider_models = [
+        Model(
+            name=model.id,
+            provider=provider,
+            display=prefix + model.id,
+        )
+        for model in models
+    ]
+    return provider_models
 
-    # Local Ollama models
-    return list_provider_models(provider=ProviderName.OLLAMA) + cloud_service_models
+
+def get_model_providers() -> List[ProviderName]:
+    # Local Ollama models first, then cloud services with configured API keys
+    providers = [ProviderName.OLLAMA]
+    if os.getenv('CO_API_KEY'):
+        providers.append(ProviderName.COHERE)
+    return providers
 
 
-async def send_llm_response(model: str, response: ChatCompletion) -> None:
+async def refresh_available_models(timeout: float = MODELS_PROVIDER_TIMEOUT) -> List[Model]:
     """
-    Send LLM assistant response to the Chainlit client.
+    Query all providers concurrently and update the process-wide model cache.
 
-    Args:
-        model (str): Name of the model (used as the message author).
-        response (ChatCompletion): The ChatCompletion object returned by the LLM.
+    A provider that fails or times out keeps the models from its last
+    successful refresh.
 
-    Side Effects:
-        Sends a message to the Chainlit UI with the content of the LLM's response.
+    Args:
+        timeout: Seconds to wait for each provider.
 
     Returns:
-        None
+        List[Model]: The refreshed list of available models.
     """
-    translation_table = str.maketrans({'.': '_', ':': '#'})
-    assistant_response = cl.Message(
-        content=response.choices[0].message.content,
-        author=model.translate(translation_table)
+    global _models_refreshed_at
+    providers = get_model_providers()
+    results = await asyncio.gather(
+        *(query_provider_models(provider=provider, timeout=timeout) for provider in providers),
+        return_exceptions=True
     )
-    await assistant_response.send()
+    for provider, result in zip(providers, results):
+        if isinstance(result, BaseException):
+            logger.error(f"{provider} list_models() error: {result!r}")
+        else:
+            _provider_models[provider] = result
+    _models_refreshed_at = time.monotonic()
+    return _cached_models(providers)
+
+
+def _cached_models(providers: List[ProviderName]) -> List[Model]:
+    return [model for provider in providers for model in _provider_models.get(provider, [])]
+
+
+def _schedule_models_refresh() -> asyncio.Task:
+    # Share a single in-flight refresh between all callers
+    global _models_refresh_task
+    if _models_refresh_task is None or _models_refresh_task.done():
+        _models_refresh_task = asyncio.create_task(refresh_available_models())
+    return _models_refresh_task
+
+
+async def get_available_models(max_age: float = MODELS_CACHE_TTL) -> List[Model]:
+    """
+    Return available models from the process-wide cache.
+
+    The first call waits for discovery. Later calls return the cached list
+    immediately and trigger a background refresh once it is older than max_age
+    (stale-while-revalidate).
+
+    Args:
+        max_age: Seconds after which the cached list is refreshed in the background.
+
+    Returns:
+        List[Model]: Models of all providers, local Ollama models first.
+    """
+    providers = get_model_providers()
+    models = _cached_models(providers)
+    if _models_refreshed_at is None or not models:
+        return await asyncio.shield(_schedule_models_refresh())
+
+    if time.monotonic() - _models_refreshed_at > max_age:
+        _schedule_models_refresh()
+    return models
+
+
+def model_author(model: str) -> str:
+    return model.translate(AUTHOR_TRANSLATION)
+
+
+def format_duration(elapsed_time: float) -> str:
+    minutes, seconds = map(round, divmod(elapsed_time, 60))
+    duration = f'{seconds} second{"s" if seconds != 1 else ""}'
+    if minutes > 0:
+        duration = f'{minutes} minute{"s" if minutes != 1 else ""} {duration}'
+    return duration
+
+
+class ThoughtStep:
+    """
+    Chainlit step that streams 'reasoning' or 'think' tokens and
+    is renamed with its duration when closed.
+    """
+
+    def __init__(self, kind: str) -> None:
+        self.kind = kind
+        self.step = cl.Step(name=THOUGHT_STEP_NAMES[kind][0], type="llm")
+        self.writer = CoalescingStreamWriter(self.step.stream_token)
+        self.start_time = time.time()
+
+    async def open(self) -> None:
+        self.start_time = time.time()
+        await self.step.__aenter__()
+
+    async def write(self, token: str) -> None:
+        await self.writer.write(token)
+
+    async def close(self) -> None:
+        await self.writer.close()
+        elapsed_time = time.time() - self.start_time
+        observe('thought', elapsed_time, kind=self.kind)
+        duration = format_duration(elapsed_time)
+        self.step.name = f'⚛️ {THOUGHT_STEP_NAMES[self.kind][1]} for {duration}'
+        await self.step.__aexit__(None, None, None)
+
+
+class QueueStatus:
+    """
+    Chainlit message showing the queue position of a request waiting
+    for a model slot, removed once the request is admitted.
+    """
+
+    def __init__(self, model: str) -> None:
+        self.model = model
+        self.message: Optional[cl.Message] = None
+
+    async def update(self, position: int) -> None:
+        if position == 0:
+            if self.message:
+                await self.message.remove()
+                self.message = None
+            return
+
+        content = f'⏳ Waiting for {self.model}: position {position} in queue'
+        if self.message is None:
+            self.message = cl.Message(content=content, author=model_author(self.model))
+            await self.message.send()
+        else:
+            self.message.content = content
+            await self.message.update()
 
 
 async def stream_llm_response(
@@ -115,95 +278,76 @@ async def stream_llm_response(
         model (str): Name of the model (used as the message author).
 
     Side Effects:
-        Streams tokens to the Chainlit UI in real time, sending regular and
-        'think' step outputs, and ends message on LLM stop.
+        Streams tokens to the Chainlit UI in real time, routing <think> content
+        and reasoning tokens to steps, and sends the message at the end of the stream.
 
     Returns:
         None
     """
-    translation_table = str.maketrans({'.': '_', ':': '#'})
-    assistant_response = cl.Message(
-        content='', author=model.translate(translation_table))
-    async for part in response:
-        choice = part.choices[0]
-        if choice.finish_reason == 'stop':
+    assistant_response = cl.Message(content='', author=model_author(model))
+    message_writer = CoalescingStreamWriter(assistant_response.stream_token)
+    parser = ThinkStreamParser()
+    thought_step: Optional[ThoughtStep] = None
+
+    async def route(segments: List[Tuple[str, str]]) -> None:
+        nonlocal thought_step
+        for kind, text in segments:
+            if kind == MESSAGE:
+                if thought_step:
+                    await thought_step.close()
+                    thought_step = None
+                await message_writer.write(text)
+            else:
+                if thought_step is None or thought_step.kind != kind:
+                    if thought_step:
+                        await thought_step.close()
+                    thought_step = ThoughtStep(kind)
+                    await thought_step.open()
+                await thought_step.write(text)
+
+    with span('stream_response', model=model):
+        try:
+            async for part in response:
+                if part.choices:
+                    await route(parser.feed(part.choices[0].delta))
+        except asyncio.CancelledError:
+            logger.info(f"Response of {model} stopped after {len(assistant_response.content)} characters")
+            raise
+        finally:
+            # Stop the model right away when the user stops the task, and keep the
+            # partial answer so it stays in the chat history
+            aclose = getattr(response, 'aclose', None)
+            if aclose:
+                await aclose()
+            await route(parser.flush())
+            if thought_step:
+                await thought_step.close()
+            await message_writer.close()
             await assistant_response.send()
-        elif choice.delta.reasoning:
-            # Handle reasoning tokens (for 'reasoning' steps)
-            start_time = time.time()
-            async with cl.Step(name="Reasoning", type="llm") as reasoning_step:
-                await reasoning_step.stream_token(choice.delta.reasoning.content)
-                async for reasoning_part in response:
-                    reasoning_choice = reasoning_part.choices[0]
-                    if reasoning_choice.delta.reasoning:
-                        reasoning_token = reasoning_choice.delta.reasoning.content
-                        await reasoning_step.stream_token(reasoning_token)
-                    else:
-                        # End of reasoning tokens
-                        elapsed_time = time.time() - start_time
-                        minutes, seconds = map(round, divmod(elapsed_time, 60))
-                        duration = f'{seconds} second{"s" if seconds != 1 else ""}'
-                        if minutes > 0:
-                            duration = f'{minutes} minute{"s" if minutes != 1 else ""} {duration}'
-                        reasoning_step.name = f'⚛️ Reasoned for {duration}'
-                        await reasoning_step.send()
-                        token = reasoning_choice.delta.content
-                        await assistant_response.stream_token(token)
-                        break
-        else:
-            token = choice.delta.content
-            match token:
-                case '<think>':
-                    # Start a 'think' step and stream tokens until '</think>' is reached
-                    start_time = time.time()
-                    async with cl.Step(name="Thinking", type="llm") as think_step:
-                        async for think_part in response:
-                            think_choice = think_part.choices[0]
-                            think_token = think_choice.delta.content
-                            if think_token == '</think>':
-                                elapsed_time = time.time() - start_time
-                                minutes, seconds = map(
-                                    round, divmod(elapsed_time, 60))
-                                duration = f'{seconds} second{"s" if seconds != 1 else ""}'
-                                if minutes > 0:
-                                    duration = f'{minutes} minute{"s" if minutes != 1 else ""} {duration}'
-                                think_step.name = f'⚛️ Thought for {duration}'
-                                await think_step.send()
-                                break
-                            else:
-                                await think_step.stream_token(think_token)
-                case _:
-                    await assistant_response.stream_token(token)
 
 
-async def chat_messages_send_response(model: str, messages: List[Dict[str, str]]) -> None:
+def any_llm_model_name(model: str) -> str:
+    # Map a model name shown in the chat settings to '<provider>:<model>'
     if CLOUD_SERVICE_PREFIX in model:
-        any_llm_model = model.split(CLOUD_SERVICE_PREFIX)[1]
-    else:
-        any_llm_model = f"{ProviderName.OLLAMA.value}:{model}"
+        return model.split(CLOUD_SERVICE_PREFIX)[1]
+    return f"{ProviderName.OLLAMA.value}:{model}"
+
+
+async def chat_messages_send_response(model: str, messages: List[Dict[str, str]]) -> None:
+    any_llm_model = any_llm_model_name(model)
 
     # Get tools from all MCP connections
-    mcp_tools = cl.user_session.get("mcp_tools", {})
-    all_tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": tool['name'],
-                "description": tool['description'],
-                "parameters":  tool['input_schema']
-            }
-        }
-        for connection_tools in mcp_tools.values() for tool in connection_tools
-    ]
+    all_tools = get_session_tool_registry().tools_payload()
 
-    response = await agent_runner(
+    queue_status = QueueStatus(model)
+    response = agent_runner(
         model=any_llm_model,
         messages=messages,
         tools=all_tools,
-        stream=True
+        on_queue=queue_status.update
     )
-
-    if isinstance(response, ChatCompletion):
-        await send_llm_response(model, response)
-    else:
+    try:
         await stream_llm_response(response, model)
+    finally:
+        # Remove the queue position of a request stopped while waiting
+        await queue_status.update(0)
@@ -0,0 +1,48 @@
+import os
+from typing import Any, Awaitable, Callable, Dict, List
+
+from python_exec import execute_python_code_async
+from tool_results import READ_TOOL_RESULT_TOOL, get_session_tool_result_store, read_tool_result, spill_enabled
+
+# Connection name under which in-process tools are registered next to MCP connections, reserved for them
+LOCAL_TOOLS_CONNECTION = '__local__'
+# Executing model-written code is opt-in
+PYTHON_EXEC_ENABLED = os.getenv('PYTHON_EXEC_ENABLED', '').lower() in ('1', 'true', 'yes')
+
+PYTHON_EXEC_TOOL = {
+    "name": "python_exec",
+    "description": "Execute Python code in an isolated worker process and return what it prints to standard output.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "code": {"type": "string", "description": "Python source code to execute"}
+        },
+        "required": ["code"]
+    },
+}
+
+
+async def _python_exec(arguments: Dict[str, Any]) -> str:
+    return await execute_python_code_async(arguments.get('code', ''))
+
+
+async def _read_tool_result(arguments: Dict[str, Any]) -> str:
+    return read_tool_result(get_session_tool_result_store(), arguments)
+
+
+LOCAL_TOOL_HANDLERS: Dict[str, Callable[[Dict[str, Any]], Awaitable[str]]] = {
+    PYTHON_EXEC_TOOL['name']: _python_exec,
+    READ_TOOL_RESULT_TOOL['name']: _read_tool_result,
+}
+
+
+def get_local_tools() -> List[Dict[str, Any]]:
+    # MCP-style tool schemas of the enabled local tools
+    tools = [PYTHON_EXEC_TOOL] if PYTHON_EXEC_ENABLED else []
+    if spill_enabled():
+        tools.append(READ_TOOL_RESULT_TOOL)
+    return tools
+
+
+async def call_local_tool(name: str, arguments: Dict[str, Any]) -> str:
+    return await LOCAL_TOOL_HANDLERS[name](arguments)
@@ -1,47 +1,66 @@
-from mcp.server.fastmcp import FastMCP
+import sys
 from pathlib import Path
-import re
-import yaml
-from typing import Any, Dict, Optional
-
-mcp = FastMCP("Prompt Server")
-
-# Load summarize.yml once and render prompts
-_SUMMARIZE_YAML_PATH = Path(__file__).resolve().parents[2] / "data" / "prompts" / "summarize.yml"
-_SUMMARIZE_SPEC: Dict[str, Any] = {}
-_TEMPLATE: str = ""
-_DEFAULTS: Dict[str, Any] = {}
-
-def _load_summarize_spec() -> None:
-    global _SUMMARIZE_SPEC, _TEMPLATE, _DEFAULTS
-    if _TEMPLATE:
-        return
-    with _SUMMARIZE_YAML_PATH.open("r", encoding="utf-8") as f:
-        spec = yaml.safe_load(f) or {}
-    _SUMMARIZE_SPEC = spec
-    _TEMPLATE = spec.get("template", "")
-    defaults: Dict[str, Any] = {}
-    for inp in spec.get("inputs", []):
-        if isinstance(inp, dict) and "default" in inp and "name" in inp:
-            defaults[inp["name"]] = inp["default"]
-    _DEFAULTS = defaults
-
-def _render_template(template: str, context: Dict[str, Any]) -> str:
-    def replacer(match: re.Match) -> str:
-        key = match.group(1).strip()
-        return str(context.get(key, match.group(0)))
-    return re.sub(r"{{\s*([^}]+)\s*}}", replacer, template)
-
-@mcp.prompt()
+from typing import Any, Dict, List, Optional
+
+from mcp.server.fastmcp import FastMCP
+from mcp.types import GetPromptResult, Prompt, PromptArgument, PromptMessage, TextContent
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from prompt_utils import PromptCatalog  # noqa: E402
+
+_DATA_DIR = Path(__file__).resolve().parents[2] / "data"
+
+
+class PromptServer(FastMCP):
+    """
+    MCP server offering every prompt of a PromptCatalog.
+
+    The YAML specs of data/prompts and the Jinja templates of data/templates
+    are compiled once at startup; files added, changed or removed later are
+    picked up by the catalog without restarting the server.
+    """
+
+    def __init__(self, name: str, catalog: PromptCatalog) -> None:
+        super().__init__(name)
+        self.catalog = catalog
+        self.catalog.refresh(force=True)
+
+    async def list_prompts(self) -> List[Prompt]:
+        return [
+            Prompt(
+                name=prompt.name,
+                title=prompt.title,
+                description=prompt.description,
+                arguments=[
+                    PromptArgument(name=prompt_input.name, description=prompt_input.description,
+                                   required=prompt_input.required)
+                    for prompt_input in prompt.inputs
+                ]
+            )
+            for prompt in self.catalog.prompts()
+        ]
+
+    async def get_prompt(self, name: str, arguments: Optional[Dict[str, Any]] = None) -> GetPromptResult:
+        prompt = self.catalog.get(name)
+        if prompt is None:
+            raise ValueError(f"Unknown prompt: {name}")
+        return GetPromptResult(
+            description=prompt.description,
+            messages=[PromptMessage(role="user", content=TextContent(type="text", text=prompt.render(arguments or {})))]
+        )
+
+
+mcp = PromptServer(
+    "Prompt Server",
+    PromptCatalog(prompts_dir=_DATA_DIR / "prompts", templates_dir=_DATA_DIR / "templates"))
+
+
 def summarize(text: str, bullets: Optional[int] = None) -> str:
     """
     Summarize the provided text into a set number of bullet points.
     """
-    _load_summarize_spec()
-    if bullets is None:
-        bullets = int(_DEFAULTS.get("bullets", 5))
-    context: Dict[str, Any] = {"text": text, "bullets": bullets}
-    return _render_template(_TEMPLATE, context)
+    return mcp.catalog.render("summarize", {"text": text, "bullets": bullets})
 
 
 if __name__ == "__main__":
@@ -0,0 +1,465 @@
+import asyncio
+import bisect
+import contextvars
+import cProfile
+import logging
+import os
+import secrets
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+# Exporter of spans and counters: '' keeps them in memory only, 'prometheus' or 'otlp'
+METRICS_SINK = os.getenv('METRICS_SINK', '').lower()
+# Port of the Prometheus text format endpoint served at /metrics
+METRICS_PROMETHEUS_PORT = int(os.getenv('METRICS_PROMETHEUS_PORT', '9464'))
+# Interface of the Prometheus endpoint, local only by default; e.g. 0.0.0.0 for a scraper on another host
+METRICS_PROMETHEUS_HOST = os.getenv('METRICS_PROMETHEUS_HOST', '127.0.0.1')
+# Base URL of the OTLP/HTTP collector receiving /v1/traces and /v1/metrics
+METRICS_OTLP_ENDPOINT = os.getenv('METRICS_OTLP_ENDPOINT', 'http://localhost:4318')
+# Seconds between two OTLP exports
+METRICS_EXPORT_INTERVAL = float(os.getenv('METRICS_EXPORT_INTERVAL', '5'))
+# Profiler run for each chat message: '' (off), 'cprofile' or 'pyinstrument'
+PROFILE_MESSAGES = os.getenv('PROFILE_MESSAGES', '').lower()
+# Directory receiving one profile file per profiled message
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'data/profiles')
+# Only keep profiles of messages that took at least this many seconds
+PROFILE_MIN_SECONDS = float(os.getenv('PROFILE_MIN_SECONDS', '0'))
+
+METRICS_PREFIX = 'chainlit_ollama_'
+SERVICE_NAME = 'chainlit-ollama'
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+logger = logging.getLogger(__name__)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+@dataclass
+class Span:
+    name: str
+    labels: Dict[str, Any]
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    duration: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def end_ns(self) -> int:
+        return self.start_ns + int(self.duration * 1e9)
+
+
+@dataclass
+class Histogram:
+    buckets: Tuple[float, ...] = LATENCY_BUCKETS
+    # Observations per bucket, the last entry counts values above the largest bucket
+    counts: List[int] = field(default_factory=lambda: [0] * (len(LATENCY_BUCKETS) + 1))
+    sum: float = 0.0
+    count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    In-process counters and latency histograms, keyed by name and labels.
+    """
+
+    def __init__(self) -> None:
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+        self.start_ns = time.time_ns()
+
+    def inc(self, name: str, value: float = 1.0, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = (name, _labels(labels))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+
+class MetricsSink:
+    """
+    Exporter of spans and registry contents. The base class discards spans.
+    """
+
+    async def start(self, registry: MetricsRegistry) -> None:
+        self.registry = registry
+
+    def export_span(self, span: Span) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _prometheus_labels(labels: Labels, extra: str = '') -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def render_prometheus(registry: MetricsRegistry) -> str:
+    """
+    Render the registry in the Prometheus text exposition format.
+
+    Args:
+        registry: Registry to render.
+
+    Returns:
+        str: Counters as '<name>_total' and histograms as '<name>' with buckets.
+    """
+    lines: List[str] = []
+    typed = set()
+    for (name, labels), value in sorted(registry.counters.items()):
+        metric = f'{METRICS_PREFIX}{name}_total'
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric}{_prometheus_labels(labels)} {value}')
+    for (name, labels), histogram in sorted(registry.histograms.items()):
+        metric = f'{METRICS_PREFIX}{name}'
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f'# TYPE {metric} histogram')
+        cumulative = 0
+        for bound, count in zip(histogram.buckets, histogram.counts):
+            cumulative += count
+            bucket_labels = _prometheus_labels(labels, f'le="{bound}"')
+            lines.append(f'{metric}_bucket{bucket_labels} {cumulative}')
+        bucket_labels = _prometheus_labels(labels, 'le="+Inf"')
+        lines.append(f'{metric}_bucket{bucket_labels} {histogram.count}')
+        lines.append(f'{metric}_sum{_prometheus_labels(labels)} {histogram.sum}')
+        lines.append(f'{metric}_count{_prometheus_labels(labels)} {histogram.count}')
+    return '\n'.join(lines) + '\n'
+
+
+class PrometheusSink(MetricsSink):
+    """
+    Serve the registry at http://<host>:<port>/metrics for a Prometheus scraper.
+
+    Args:
+        port: Port of the endpoint, 0 picks a free port.
+        host: Interface to listen on.
+    """
+
+    def __init__(self, port: int = METRICS_PROMETHEUS_PORT, host: str = METRICS_PROMETHEUS_HOST) -> None:
+        self.port = port
+        self.host = host
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, registry: MetricsRegistry) -> None:
+        await super().start(registry)
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Prometheus metrics served on port {self.port}")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request_line = await reader.readline()
+            while await reader.readline() not in (b'\r\n', b'\n', b''):
+                pass
+            parts = request_line.decode(errors='replace').split(' ')
+            if len(parts) > 1 and parts[1].split('?')[0] == '/metrics':
+                status, body = '200 OK', render_prometheus(self.registry).encode()
+            else:
+                status, body = '404 Not Found', b'not found\n'
+            writer.write(
+                f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+                f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def close(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+def _otlp_attributes(labels: Dict[str, Any] | Labels) -> List[Dict[str, Any]]:
+    items = labels.items() if isinstance(labels, dict) else labels
+    return [{"key": key, "value": {"stringValue": str(value)}} for key, value in items]
+
+
+def otlp_traces_payload(spans: List[Span]) -> Dict[str, Any]:
+    return {"resourceSpans": [{
+        "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+        "scopeSpans": [{
+            "scope": {"name": SERVICE_NAME},
+            "spans": [
+                {
+                    "traceId": span.trace_id,
+                    "spanId": span.span_id,
+                    **({"parentSpanId": span.parent_id} if span.parent_id else {}),
+                    "name": span.name,
+                    "kind": 1,
+                    "startTimeUnixNano": str(span.start_ns),
+                    "endTimeUnixNano": str(span.end_ns),
+                    "attributes": _otlp_attributes(span.labels),
+                    "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+                }
+                for span in spans
+            ],
+        }],
+    }]}
+
+
+def otlp_metrics_payload(registry: MetricsRegistry) -> Dict[str, Any]:
+    now = str(time.time_ns())
+    start = str(registry.start_ns)
+    metrics: Dict[str, Dict[str, Any]] = {}
+    for (name, labels), value in registry.counters.items():
+        metric = metrics.setdefault(name, {
+            "name": f'{METRICS_PREFIX}{name}',
+            "sum": {"aggregationTemporality": 2, "isMonotonic": True, "dataPoints": []}})
+        metric["sum"]["dataPoints"].append({
+            "attributes": _otlp_attributes(labels),
+            "startTimeUnixNano": start, "timeUnixNano": now, "asDouble": value})
+    for (name, labels), histogram in registry.histograms.items():
+        metric = metrics.setdefault(name, {
+            "name": f'{METRICS_PREFIX}{name}', "unit": "s",
+            "histogram": {"aggregationTemporality": 2, "dataPoints": []}})
+        metric["histogram"]["dataPoints"].append({
+            "attributes": _otlp_attributes(labels),
+            "startTimeUnixNano": start, "timeUnixNano": now,
+            "count": str(histogram.count), "sum": histogram.sum,
+            "bucketCounts": [str(count) for count in histogram.counts],
+            "explicitBounds": list(histogram.buckets)})
+    return {"resourceMetrics": [{
+        "resource": {"attributes": _otlp_attributes({"service.name": SERVICE_NAME})},
+        "scopeMetrics": [{"scope": {"name": SERVICE_NAME}, "metrics": list(metrics.values())}],
+    }]}
+
+
+class OTLPSink(MetricsSink):
+    """
+    Export spans and metrics to an OpenTelemetry collector over OTLP/HTTP JSON.
+
+    Spans are buffered and sent with the cumulative metrics every interval
+    seconds from a background task, so the request path never waits on the
+    collector. Failed exports are logged and dropped.
+
+    Args:
+        endpoint: Base URL of the collector.
+        interval: Seconds between exports.
+    """
+
+    def __init__(self, endpoint: str = METRICS_OTLP_ENDPOINT, interval: float = METRICS_EXPORT_INTERVAL) -> None:
+        self.endpoint = endpoint.rstrip('/')
+        self.interval = interval
+        self._spans: List[Span] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, registry: MetricsRegistry) -> None:
+        await super().start(registry)
+        self._task = asyncio.create_task(self._export_loop())
+
+    def export_span(self, span: Span) -> None:
+        self._spans.append(span)
+
+    async def export(self) -> None:
+        import httpx
+
+        spans, self._spans = self._spans, []
+        async with httpx.AsyncClient(timeout=self.interval) as client:
+            try:
+                if spans:
+                    (await client.post(f'{self.endpoint}/v1/traces', json=otlp_traces_payload(spans))).raise_for_status()
+                (await client.post(f'{self.endpoint}/v1/metrics',
+                                   json=otlp_metrics_payload(self.registry))).raise_for_status()
+            except httpx.HTTPError as error:
+                logger.warning(f"OTLP export to {self.endpoint} failed: {error!r}")
+
+    async def _export_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.export()
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.export()
+
+
+_registry = MetricsRegistry()
+_sink: MetricsSink = MetricsSink()
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('current_span', default=None)
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    return _registry
+
+
+def create_metrics_sink(name: str = METRICS_SINK) -> MetricsSink:
+    if name == 'prometheus':
+        return PrometheusSink()
+    if name == 'otlp':
+        return OTLPSink()
+    if name:
+        logger.warning(f"Unknown METRICS_SINK '{name}', metrics are kept in memory only")
+    return MetricsSink()
+
+
+async def start_metrics(sink: Optional[MetricsSink] = None) -> None:
+    """
+    Install and start the metrics sink.
+
+    Args:
+        sink: Sink to install, defaults to the one selected by METRICS_SINK.
+    """
+    global _sink
+    await _sink.close()
+    _sink = sink or create_metrics_sink()
+    await _sink.start(_registry)
+
+
+async def stop_metrics() -> None:
+    global _sink
+    await _sink.close()
+    _sink = MetricsSink()
+
+
+def inc_counter(name: str, value: float = 1.0, **labels: Any) -> None:
+    _registry.inc(name, value, **labels)
+
+
+def observe(name: str, seconds: float, **labels: Any) -> None:
+    _registry.observe(f'{name}_seconds', seconds, **labels)
+
+
+@contextmanager
+def span(name: str, **labels: Any) -> Iterator[Span]:
+    """
+    Time a block as a span nested in the current span.
+
+    The duration is recorded in the '<name>_seconds' histogram and the span is
+    handed to the sink. An exception, or an error set on the span by the
+    block, also counts towards '<name>_errors'.
+
+    Args:
+        name: Span and metric name.
+        **labels: Low-cardinality labels, e.g. model or tool name.
+
+    Yields:
+        Span: The running span.
+    """
+    parent = _current_span.get()
+    current = Span(
+        name=name,
+        labels=labels,
+        trace_id=parent.trace_id if parent else secrets.token_hex(16),
+        span_id=secrets.token_hex(8),
+        parent_id=parent.span_id if parent else None,
+        start_ns=time.time_ns()
+    )
+    token = _current_span.set(current)
+    start = time.perf_counter()
+    try:
+        yield current
+    except BaseException as error:
+        current.error = current.error or type(error).__name__
+        raise
+    finally:
+        current.duration = time.perf_counter() - start
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Exited in another context, e.g. an async generator closed by the garbage collector
+            pass
+        _registry.observe(f'{name}_seconds', current.duration, **labels)
+        if current.error:
+            _registry.inc(f'{name}_errors', **labels)
+        _sink.export_span(current)
+
+
+_profiling = False
+
+
+def _profile_path(name: str, suffix: str) -> Path:
+    directory = Path(PROFILE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)
+    return directory / f'{time.strftime("%Y%m%d-%H%M%S")}-{safe_name}{suffix}'
+
+
+@asynccontextmanager
+async def profile_message(name: str, mode: str = PROFILE_MESSAGES) -> AsyncIterator[Optional[Path]]:
+    """
+    Profile the handling of one chat message.
+
+    cProfile writes a .prof file for pstats or snakeviz, pyinstrument an .html
+    call tree. Both profile the whole event loop thread, so concurrent messages
+    of other sessions show up as well; while one message is profiled, others
+    are not. Profiles of messages faster than PROFILE_MIN_SECONDS are discarded.
+
+    Args:
+        name: Name of the profile file, e.g. the message id.
+        mode: '' (off), 'cprofile' or 'pyinstrument'.
+
+    Yields:
+        Optional[Path]: Path the profile will be written to, None if not profiled.
+    """
+    global _profiling
+    if not mode or _profiling:
+        yield None
+        return
+
+    if mode == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("pyinstrument is not installed, profiling with cProfile")
+            mode = 'cprofile'
+    if mode == 'pyinstrument':
+        profiler = Profiler(async_mode='enabled')
+        path = _profile_path(name, '.html')
+    else:
+        profiler = cProfile.Profile()
+        path = _profile_path(name, '.prof')
+
+    _profiling = True
+    start = time.perf_counter()
+    if mode == 'pyinstrument':
+        profiler.start()
+    else:
+        profiler.enable()
+    try:
+        yield path
+    finally:
+        if mode == 'pyinstrument':
+            profiler.stop()
+        else:
+            profiler.disable()
+        _profiling = False
+        elapsed = time.perf_counter() - start
+        if elapsed >= PROFILE_MIN_SECONDS:
+            if mode == 'pyinstrument':
+                await asyncio.to_thread(path.write_text, profiler.output_html(), encoding='utf-8')
+            else:
+                await asyncio.to_thread(profiler.dump_stats, str(path))
+            logger.info(f"Profile of {name} ({elapsed:.3f}s) written to {path}")
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+from contextlib import contextmanager
+from typing import Iterable, Iterator, Optional, Set
+
+import httpx
+
+from config import load_config
+
+OLLAMA_API_BASE = "http://localhost:11434"
+# Seconds between health and loaded-model checks of the Ollama nodes
+OLLAMA_HEALTH_INTERVAL = float(os.getenv('OLLAMA_HEALTH_INTERVAL', '10'))
+# Seconds a single health check may take
+OLLAMA_HEALTH_TIMEOUT = float(os.getenv('OLLAMA_HEALTH_TIMEOUT', '2'))
+
+SETTINGS_FILE = 'settings.toml'
+OLLAMA_SETTINGS = 'ollama'
+OLLAMA_PROVIDER_PREFIX = 'ollama:'
+
+logger = logging.getLogger(__name__)
+
+
+def ollama_model_name(model: str) -> Optional[str]:
+    # Model name as Ollama reports it, None for models of other providers
+    if model.startswith(OLLAMA_PROVIDER_PREFIX):
+        return model[len(OLLAMA_PROVIDER_PREFIX):]
+    return None
+
+
+def is_connection_error(error: BaseException) -> bool:
+    # Errors meaning the node could not be reached, so the request can move to another node
+    return isinstance(error, (ConnectionError, httpx.TransportError))
+
+
+def _listed(model: str, names: Set[str]) -> bool:
+    # Ollama adds the ':latest' tag to model names without one
+    return model in names or (':' not in model and f'{model}:latest' in names)
+
+
+class OllamaNode:
+    def __init__(self, url: str) -> None:
+        self.url = url.rstrip('/')
+        self.healthy = True
+        self.outstanding = 0
+        self.loaded_models: Set[str] = set()
+        # Models pulled on the node, None until its first successful check
+        self.available_models: Optional[Set[str]] = None
+
+    def has_model(self, model: str) -> bool:
+        if self.available_models is None:
+            return True
+        return _listed(model, self.available_models)
+
+    def is_loaded(self, model: str) -> bool:
+        return _listed(model, self.loaded_models)
+
+    def __repr__(self) -> str:
+        return f'OllamaNode({self.url!r}, healthy={self.healthy}, outstanding={self.outstanding})'
+
+
+class OllamaPool:
+    """
+    Set of Ollama nodes that model requests are balanced across.
+
+    A background task polls /api/ps and /api/tags on every node, which checks
+    its health and tells which models it has loaded and which it has pulled.
+    Requests only go to nodes that have the model, preferably a healthy one
+    that already has it loaded, to avoid cold loads, and among those to the
+    node with the fewest outstanding requests. A node that fails a request is
+    taken out of rotation until its next successful health check.
+
+    Args:
+        urls: API base URLs of the nodes.
+        health_interval: Seconds between health checks.
+        health_timeout: Seconds a single health check may take.
+    """
+
+    def __init__(
+        self,
+        urls: Iterable[str],
+        health_interval: float = OLLAMA_HEALTH_INTERVAL,
+        health_timeout: float = OLLAMA_HEALTH_TIMEOUT
+    ) -> None:
+        self.nodes = [OllamaNode(url) for url in urls] or [OllamaNode(OLLAMA_API_BASE)]
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._task: Optional[asyncio.Task] = None
+
+    def pick(self, model: Optional[str] = None, exclude: Iterable[OllamaNode] = ()) -> Optional[OllamaNode]:
+        """
+        Choose the node for a request.
+
+        Args:
+            model: Ollama model name; nodes without it are skipped, nodes that loaded it preferred.
+            exclude: Nodes that already failed this request.
+
+        Returns:
+            Optional[OllamaNode]: The chosen node, None if all nodes are excluded.
+        """
+        candidates = [node for node in self.nodes if node not in exclude]
+        if model:
+            # A node without the model would answer 404, which is not failed over.
+            # If no node lists it, e.g. it was pulled since the last check, try them all
+            candidates = [node for node in candidates if node.has_model(model)] or candidates
+        # With no healthy node left, try the others rather than failing right away
+        candidates = [node for node in candidates if node.healthy] or candidates
+        if not candidates:
+            return None
+        return min(candidates, key=lambda node: (not (model and node.is_loaded(model)), node.outstanding))
+
+    @contextmanager
+    def track(self, node: Optional[OllamaNode], model: Optional[str] = None) -> Iterator[None]:
+        # Count a request as outstanding on the node while it runs
+        if node is None:
+            yield
+            return
+        node.outstanding += 1
+        if model:
+            # Ollama loads the model for this request, prefer the node for the next one
+            node.loaded_models.add(model)
+        try:
+            yield
+        finally:
+            node.outstanding -= 1
+
+    def mark_failed(self, node: OllamaNode, error: BaseException) -> None:
+        if node.healthy:
+            logger.warning(f"Ollama node {node.url} failed: {error!r}")
+        node.healthy = False
+        node.loaded_models.clear()
+
+    async def check(self, node: OllamaNode, client: httpx.AsyncClient) -> None:
+        try:
+            responses = await asyncio.gather(
+                client.get(f'{node.url}/api/ps', timeout=self.health_timeout),
+                client.get(f'{node.url}/api/tags', timeout=self.health_timeout))
+            loaded, available = (
+                {model.get('name') or model.get('model') for model in response.raise_for_status().json().get('models', [])}
+                for response in responses)
+            node.loaded_models = loaded
+            node.available_models = available
+            if not node.healthy:
+                logger.info(f"Ollama node {node.url} is healthy again")
+            node.healthy = True
+        except (httpx.HTTPError, ValueError) as error:
+            self.mark_failed(node, error)
+
+    async def check_all(self) -> None:
+        async with httpx.AsyncClient() as client:
+            await asyncio.gather(*(self.check(node, client) for node in self.nodes))
+
+    async def start(self) -> None:
+        if self._task is None:
+            await self.check_all()
+            self._task = asyncio.create_task(self._check_loop())
+
+    async def _check_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check_all()
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+
+_ollama_pool: Optional[OllamaPool] = None
+
+
+def get_ollama_pool() -> OllamaPool:
+    global _ollama_pool
+    if _ollama_pool is None:
+        settings = load_config(SETTINGS_FILE).get(OLLAMA_SETTINGS, {})
+        _ollama_pool = OllamaPool(settings.get('nodes', [OLLAMA_API_BASE]))
+    return _ollama_pool
@@ -0,0 +1,217 @@
+import logging
+import os
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from jinja2 import Environment, Template, meta
+import yaml
+
+from template_utils import TEMPLATES_DIR, _file_version, parse_template_vars
+
+PROMPTS_DIR = 'data/prompts'
+# Seconds between checks of the prompt and template directories for changed files
+PROMPT_RELOAD_INTERVAL = float(os.getenv('PROMPT_RELOAD_INTERVAL', '1'))
+
+# Convert MCP prompt arguments, which are strings, to the type declared in the YAML inputs
+INPUT_TYPES: Dict[str, Callable[[Any], Any]] = {
+    'string': str,
+    'integer': int,
+    'number': float,
+    'boolean': lambda value: value if isinstance(value, bool) else str(value).lower() in ('1', 'true', 'yes')
+}
+
+logger = logging.getLogger(__name__)
+
+
+def prompt_name(template_name: str) -> str:
+    # Identifier of a template's prompt, e.g. "Summarize Content" -> "summarize_content"
+    return re.sub(r'\W+', '_', template_name).strip('_').lower()
+
+
+class PromptInput:
+    def __init__(self, name: str, description: str = '', required: bool = False,
+                 input_type: str = 'string', default: Any = None) -> None:
+        self.name = name
+        self.description = description
+        self.required = required
+        self.input_type = input_type
+        self.default = default
+
+    def convert(self, value: Any) -> Any:
+        return INPUT_TYPES.get(self.input_type, str)(value)
+
+
+class CompiledPrompt:
+    """
+    A prompt spec or template compiled to a Jinja template.
+
+    Args:
+        name: Prompt name.
+        title: Human-readable name.
+        description: What the prompt does.
+        inputs: Inputs with their types and defaults.
+        template: Compiled template.
+        extra_context: Function returning values every rendering gets, e.g. the date.
+    """
+
+    def __init__(self, name: str, title: str, description: str, inputs: List[PromptInput],
+                 template: Template, extra_context: Optional[Callable[[], Dict[str, Any]]] = None) -> None:
+        self.name = name
+        self.title = title
+        self.description = description
+        self.inputs = inputs
+        self.template = template
+        self.extra_context = extra_context
+        self._defaults = {prompt_input.name: prompt_input.default for prompt_input in inputs
+                          if prompt_input.default is not None}
+
+    def render(self, arguments: Dict[str, Any]) -> str:
+        """
+        Render the prompt.
+
+        Args:
+            arguments: Input values; missing inputs or None use their defaults,
+                values of undeclared inputs are passed to the template as they are.
+
+        Returns:
+            str: The rendered prompt.
+
+        Raises:
+            ValueError: If a required input is missing or a value has the wrong type.
+        """
+        context = dict(self.extra_context()) if self.extra_context else {}
+        context.update(self._defaults)
+        context.update({name: value for name, value in arguments.items() if value is not None})
+        for prompt_input in self.inputs:
+            value = arguments.get(prompt_input.name)
+            if value is not None:
+                context[prompt_input.name] = prompt_input.convert(value)
+            elif prompt_input.required and prompt_input.name not in context:
+                raise ValueError(f"Missing required argument {prompt_input.name} of prompt {self.name}")
+        return self.template.render(context).strip()
+
+
+def _template_context() -> Dict[str, Any]:
+    # Same extra value as render_template_with_vars()
+    return {'now': datetime.now().strftime("%A, %B %d, %Y")}
+
+
+class PromptCatalog:
+    """
+    Every YAML prompt spec of the prompts directory and Jinja template of the templates directory.
+
+    Each file is compiled once to a Jinja template. At most every
+    reload_interval seconds a lookup checks the directories, so added, changed
+    and removed files are picked up without a restart; unchanged files are not
+    compiled again.
+
+    Args:
+        prompts_dir: Directory of the YAML prompt specs.
+        templates_dir: Directory of the Jinja templates, None to leave them out.
+        reload_interval: Seconds between checks for changed files.
+    """
+
+    def __init__(self, prompts_dir: str | Path = PROMPTS_DIR, templates_dir: Optional[str | Path] = TEMPLATES_DIR,
+                 reload_interval: float = PROMPT_RELOAD_INTERVAL) -> None:
+        self.prompts_dir = Path(prompts_dir)
+        self.templates_dir = Path(templates_dir) if templates_dir else None
+        self.reload_interval = reload_interval
+        self.environment = Environment(keep_trailing_newline=True)
+        self._files: Dict[Path, Tuple[Tuple[int, int], CompiledPrompt]] = {}
+        self._prompts: Dict[str, CompiledPrompt] = {}
+        self._checked = float('-inf')
+
+    def _sources(self) -> List[Tuple[Path, Callable[[Path, str], CompiledPrompt]]]:
+        sources = [(path, self._compile_spec) for path in sorted(self.prompts_dir.glob('*.yml'))]
+        if self.templates_dir:
+            sources += [(path, self._compile_template) for path in sorted(self.templates_dir.glob('*.jinja'))]
+        return sources
+
+    def _compile_spec(self, path: Path, source: str) -> CompiledPrompt:
+        spec = yaml.safe_load(source) or {}
+        inputs = [
+            PromptInput(name=prompt_input['name'], description=prompt_input.get('description', ''),
+                        required=bool(prompt_input.get('required', False)),
+                        input_type=prompt_input.get('type', 'string'), default=prompt_input.get('default'))
+            for prompt_input in spec.get('inputs', []) if isinstance(prompt_input, dict) and 'name' in prompt_input
+        ]
+        return CompiledPrompt(
+            name=spec.get('id', path.stem), title=spec.get('name', path.stem),
+            description=spec.get('description', ''), inputs=inputs,
+            template=self.environment.from_string(spec.get('template', '')))
+
+    def _compile_template(self, path: Path, source: str) -> CompiledPrompt:
+        inputs = [PromptInput(name=name, description=str(question), required=True)
+                  for name, question in parse_template_vars(name=path.stem, template=source).items()]
+        # Only templates that show the date pay for formatting it on every rendering
+        uses_now = 'now' in meta.find_undeclared_variables(self.environment.parse(source))
+        return CompiledPrompt(
+            name=prompt_name(path.stem), title=path.stem, description=f'Template "{path.stem}"',
+            inputs=inputs, template=self.environment.from_string(source),
+            extra_context=_template_context if uses_now else None)
+
+    def refresh(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked < self.reload_interval:
+            return
+        self._checked = now
+
+        files: Dict[Path, Tuple[Tuple[int, int], CompiledPrompt]] = {}
+        for path, compile_file in self._sources():
+            try:
+                version = _file_version(path)
+                cached = self._files.get(path)
+                if cached is None or cached[0] != version:
+                    cached = (version, compile_file(path, path.read_text(encoding='utf-8')))
+                    logger.info(f"Compiled prompt {cached[1].name} from {path}")
+                files[path] = cached
+            except FileNotFoundError:
+                continue
+            except Exception as error:
+                # Keep serving the last good version of a file that fails to compile
+                logger.error(f"Failed to compile prompt {path}: {error!r}")
+                if path in self._files:
+                    files[path] = self._files[path]
+        self._files = files
+        self._prompts = {prompt.name: prompt for _, prompt in files.values()}
+
+    def prompts(self) -> List[CompiledPrompt]:
+        self.refresh()
+        return list(self._prompts.values())
+
+    def get(self, name: str) -> Optional[CompiledPrompt]:
+        self.refresh()
+        return self._prompts.get(name)
+
+    def render(self, name: str, arguments: Dict[str, Any]) -> str:
+        prompt = self.get(name)
+        if prompt is None:
+            raise ValueError(f"Unknown prompt: {name}")
+        return prompt.render(arguments)
+
+
+_prompt_catalog: Optional[PromptCatalog] = None
+
+
+def get_prompt_catalog() -> PromptCatalog:
+    global _prompt_catalog
+    if _prompt_catalog is None:
+        _prompt_catalog = PromptCatalog()
+    return _prompt_catalog
+
+
+def render_prompt(name: str, context: Dict[str, Any]) -> str:
+    """
+    Render a prompt of the prompts directory, e.g. summarize.
+
+    Args:
+        name: Prompt name, the id of a YAML spec or the identifier of a template.
+        context: Values of the prompt inputs; inputs left out or None use their defaults.
+
+    Returns:
+        str: The rendered prompt.
+    """
+    return get_prompt_catalog().render(name, context)
@@ -1,10 +1,43 @@
+import asyncio
 import io
+import logging
+import multiprocessing
+import os
 import sys
+from multiprocessing.connection import Connection
+from typing import List, Optional, Set
 
+# Number of pre-warmed worker processes
+PYTHON_EXEC_WORKERS = int(os.getenv('PYTHON_EXEC_WORKERS', '2'))
+# Seconds of wall-clock time a single execution may take
+PYTHON_EXEC_TIMEOUT = float(os.getenv('PYTHON_EXEC_TIMEOUT', '10'))
+# Address space limit of a worker process in MB (Unix only)
+PYTHON_EXEC_MEMORY_MB = int(os.getenv('PYTHON_EXEC_MEMORY_MB', '512'))
+# Maximum number of captured output characters returned per execution
+PYTHON_EXEC_OUTPUT_LIMIT = int(os.getenv('PYTHON_EXEC_OUTPUT_LIMIT', '65536'))
 
-def execute_python_code(code: str) -> str:
+logger = logging.getLogger(__name__)
+
+
+class LimitedStringIO(io.StringIO):
+    # String buffer that stops storing output after a number of characters
+    def __init__(self, limit: int) -> None:
+        super().__init__()
+        self.limit = limit
+        self.truncated = False
+
+    def write(self, text: str) -> int:
+        remaining = self.limit - self.tell()
+        if len(text) > remaining:
+            self.truncated = True
+            text = text[:max(remaining, 0)]
+        super().write(text)
+        return len(text)
+
+
+def execute_python_code(code: str, output_limit: int = PYTHON_EXEC_OUTPUT_LIMIT) -> str:
     # Create a string buffer to capture output
-    captured_output = io.StringIO()
+    captured_output = LimitedStringIO(limit=output_limit)
 
     # Save the original standard output
     original_stdout = sys.stdout
@@ -13,15 +46,180 @@ def execute_python_code(code: str) -> str:
         # Redirect standard output to the captured output
         sys.stdout = captured_output
 
-        # Execute the code
-        exec(code)
+        # Execute the code in a fresh namespace
+        exec(code, {'__name__': '__main__'})
 
-    except Exception as e:
+    except BaseException as e:
         # If any exception occurs, capture it as output
-        return f"Error: {str(e)}"
+        return f"Error: {str(e) or type(e).__name__}"
     finally:
         # Restore the original standard output
         sys.stdout = original_stdout
 
     # Return the captured output
-    return captured_output.getvalue()
+    output = captured_output.getvalue()
+    if captured_output.truncated:
+        output += f"\n... [output truncated after {output_limit} characters]"
+    return output
+
+
+def _worker_main(connection: Connection, memory_limit_mb: int, output_limit: int) -> None:
+    # Runs in a worker process: execute code received over the pipe, one snippet at a time
+    if memory_limit_mb > 0:
+        try:
+            import resource
+            limit = memory_limit_mb * 1024 * 1024
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ImportError, ValueError, OSError):
+            pass
+
+    while True:
+        try:
+            code = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        connection.send(execute_python_code(code, output_limit=output_limit))
+
+
+class _Worker:
+    def __init__(self, context: multiprocessing.context.BaseContext, memory_limit_mb: int, output_limit: int) -> None:
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_connection, memory_limit_mb, output_limit),
+            daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.join(timeout=1)
+        self.connection.close()
+
+
+class PythonExecPool:
+    """
+    Pool of pre-warmed worker processes that execute Python code.
+
+    Each execution runs in a worker process with a wall-clock timeout, an
+    address space limit and capped captured output, so it neither blocks the
+    event loop nor mixes its output with other executions. A worker that times
+    out or dies is replaced, leaving the other workers warm.
+
+    Args:
+        workers: Number of worker processes.
+        timeout: Default seconds of wall-clock time per execution.
+        memory_limit_mb: Address space limit per worker in MB, 0 for none.
+        output_limit: Maximum number of captured output characters.
+    """
+
+    def __init__(
+        self,
+        workers: int = PYTHON_EXEC_WORKERS,
+        timeout: float = PYTHON_EXEC_TIMEOUT,
+        memory_limit_mb: int = PYTHON_EXEC_MEMORY_MB,
+        output_limit: int = PYTHON_EXEC_OUTPUT_LIMIT
+    ) -> None:
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.memory_limit_mb = memory_limit_mb
+        self.output_limit = output_limit
+        self._context = multiprocessing.get_context('spawn')
+        self._idle: Optional[asyncio.Queue] = None
+        self._all: List[_Worker] = []
+        self._restarts: Set[asyncio.Task] = set()
+
+    def _spawn(self) -> _Worker:
+        worker = _Worker(self._context, self.memory_limit_mb, self.output_limit)
+        self._all.append(worker)
+        return worker
+
+    def _restart(self, worker: _Worker) -> _Worker:
+        # Killing, joining and spawning block for up to seconds, so they run in a thread
+        worker.kill()
+        return _Worker(self._context, self.memory_limit_mb, self.output_limit)
+
+    def _replace(self, worker: _Worker) -> None:
+        # Restart a worker in the background; it rejoins the idle workers when it is ready
+        self._all.remove(worker)
+
+        async def restart() -> None:
+            replacement = await asyncio.to_thread(self._restart, worker)
+            if self._idle is None:
+                # Closed while restarting
+                replacement.kill()
+                return
+            self._all.append(replacement)
+            self._idle.put_nowait(replacement)
+
+        task = asyncio.create_task(restart())
+        self._restarts.add(task)
+        task.add_done_callback(self._restarts.discard)
+
+    async def start(self) -> None:
+        if self._idle is not None:
+            return
+        self._idle = asyncio.Queue()
+        workers = await asyncio.to_thread(lambda: [self._spawn() for _ in range(self.workers)])
+        for worker in workers:
+            self._idle.put_nowait(worker)
+
+    async def run(self, code: str, timeout: Optional[float] = None) -> str:
+        """
+        Execute code in a worker process.
+
+        Args:
+            code: Python source code.
+            timeout: Seconds of wall-clock time, defaults to the pool timeout.
+
+        Returns:
+            str: Captured standard output, or an 'Error: ...' message.
+        """
+        await self.start()
+        timeout = self.timeout if timeout is None else timeout
+        worker = await self._idle.get()
+        replace = False
+        try:
+            worker.connection.send(code)
+            if not await asyncio.to_thread(worker.connection.poll, timeout):
+                logger.warning(f"python_exec timed out after {timeout} seconds, restarting worker")
+                replace = True
+                return f"Error: execution timed out after {timeout} seconds"
+            return worker.connection.recv()
+        except (EOFError, OSError) as error:
+            logger.warning(f"python_exec worker exited: {error!r}, restarting worker")
+            replace = True
+            return "Error: execution worker exited unexpectedly"
+        except asyncio.CancelledError:
+            replace = True
+            raise
+        finally:
+            if self._idle is None:
+                # Closed while the code ran, e.g. at shutdown: stop the worker instead of returning it
+                await asyncio.to_thread(worker.kill)
+            elif replace:
+                self._replace(worker)
+            else:
+                self._idle.put_nowait(worker)
+
+    async def close(self) -> None:
+        self._idle = None
+        if self._restarts:
+            await asyncio.gather(*self._restarts, return_exceptions=True)
+        await asyncio.to_thread(lambda: [worker.kill() for worker in self._all])
+        self._all.clear()
+
+
+_python_exec_pool: Optional[PythonExecPool] = None
+
+
+def get_python_exec_pool() -> PythonExecPool:
+    global _python_exec_pool
+    if _python_exec_pool is None:
+        _python_exec_pool = PythonExecPool()
+    return _python_exec_pool
+
+
+async def execute_python_code_async(code: str, timeout: Optional[float] = None) -> str:
+    return await get_python_exec_pool().run(code, timeout=timeout)
@@ -0,0 +1,254 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import aclosing
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from any_llm.types.completion import ChatCompletion, ChatCompletionChunk
+
+from metrics import inc_counter
+
+# Cache model responses; only useful for deterministic prompts, so it is opt-in
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', '').lower() in ('1', 'true', 'yes')
+# Seconds a cached response is served
+RESPONSE_CACHE_TTL = float(os.getenv('RESPONSE_CACHE_TTL', '3600'))
+# Maximum number of cached responses
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '256'))
+# Maximum total size of cached responses in bytes
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv('RESPONSE_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+# SQLite file that keeps the cache across restarts, empty for an in-memory cache
+RESPONSE_CACHE_PATH = os.getenv('RESPONSE_CACHE_PATH', '')
+
+# Message fields that change the model's answer
+MESSAGE_KEY_FIELDS = ('role', 'content', 'name', 'images', 'tool_calls', 'tool_call_id')
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize_content(content: Any) -> Any:
+    if isinstance(content, str):
+        return content.replace('\r\n', '\n').strip()
+    return content
+
+
+def response_cache_key(model: str, messages: List[Dict[str, Any]],
+                       tools: Optional[List[Dict[str, Any]]] = None, stream: bool = True) -> str:
+    """
+    Hash a completion request.
+
+    Messages are reduced to the fields that affect the answer, with line
+    endings and surrounding whitespace of text content normalized.
+
+    Args:
+        model: Model name.
+        messages: Messages in OpenAI format.
+        tools: Tools offered to the model.
+        stream: Whether the response is streamed.
+
+    Returns:
+        str: Hex digest identifying the request.
+    """
+    normalized = [
+        {field: _normalize_content(message[field]) if field == 'content' else message[field]
+         for field in MESSAGE_KEY_FIELDS if message.get(field) is not None}
+        for message in messages
+    ]
+    payload = json.dumps(
+        {'model': model, 'messages': normalized, 'tools': tools or [], 'stream': stream},
+        sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryCacheBackend:
+    # LRU dictionary of (expiry time, value)
+    def __init__(self, max_entries: int, max_bytes: int) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: OrderedDict[str, Tuple[float, str]] = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.time():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, value: str, expires: float) -> None:
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires, value)
+        self._bytes += len(value)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: str) -> None:
+        _, value = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def close(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+
+class SQLiteCacheBackend:
+    # Cache table in a SQLite file, least recently used rows are evicted first
+    def __init__(self, path: str, max_entries: int, max_bytes: int) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, '
+                'expires REAL NOT NULL, used REAL NOT NULL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS responses_used ON responses (used)')
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                'SELECT value, expires FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._connection.execute('DELETE FROM responses WHERE key = ?', (key,))
+                return None
+            self._connection.execute('UPDATE responses SET used = ? WHERE key = ?', (now, key))
+            return row[0]
+
+    def put(self, key: str, value: str, expires: float) -> None:
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO responses (key, value, size, expires, used) VALUES (?, ?, ?, ?, ?)',
+                (key, value, len(value), expires, now))
+            self._connection.execute('DELETE FROM responses WHERE expires < ?', (now,))
+            count, size = self._connection.execute(
+                'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses').fetchone()
+            if count <= self.max_entries and size <= self.max_bytes:
+                return
+            for old_key, old_size in self._connection.execute(
+                    'SELECT key, size FROM responses ORDER BY used').fetchall():
+                if count <= self.max_entries and size <= self.max_bytes:
+                    break
+                self._connection.execute('DELETE FROM responses WHERE key = ?', (old_key,))
+                count -= 1
+                size -= old_size
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+class ResponseCache:
+    """
+    Cache of model responses keyed on model, normalized messages, tools and streaming.
+
+    Streamed responses are stored chunk by chunk once the stream has been read
+    to the end, and replayed as a stream of the same chunks, so consumers cannot
+    tell a cached response from a live one. Entries expire after ttl seconds
+    and the least recently used ones are evicted beyond the entry and size caps.
+
+    Args:
+        ttl: Seconds an entry is served.
+        max_entries: Maximum number of entries.
+        max_bytes: Maximum total size of the entries in bytes.
+        path: SQLite file to store entries in, None for memory.
+    """
+
+    def __init__(
+        self,
+        ttl: float = RESPONSE_CACHE_TTL,
+        max_entries: int = RESPONSE_CACHE_MAX_ENTRIES,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        path: Optional[str] = RESPONSE_CACHE_PATH or None
+    ) -> None:
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        if path:
+            self._backend = SQLiteCacheBackend(path, max_entries, max_bytes)
+        else:
+            self._backend = MemoryCacheBackend(max_entries, max_bytes)
+        self._blocking = bool(path)
+
+    async def _call(self, method: str, *args: Any) -> Any:
+        # SQLite calls run in a thread, memory lookups do not need one
+        function = getattr(self._backend, method)
+        if self._blocking:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    async def get(self, key: str) -> Optional[str]:
+        value = await self._call('get', key)
+        inc_counter('response_cache_hits' if value is not None else 'response_cache_misses')
+        return value
+
+    async def put(self, key: str, value: str) -> None:
+        if len(value) > self.max_bytes:
+            return
+        await self._call('put', key, value, time.time() + self.ttl)
+
+    async def replay(self, value: str, stream: bool) -> ChatCompletion | AsyncIterator[ChatCompletionChunk]:
+        data = json.loads(value)
+        if not stream:
+            return ChatCompletion.model_validate(data)
+        return self._replay_stream(data)
+
+    async def _replay_stream(self, chunks: List[Dict[str, Any]]) -> AsyncIterator[ChatCompletionChunk]:
+        for chunk in chunks:
+            yield ChatCompletionChunk.model_validate(chunk)
+
+    async def record(
+        self, key: str, response: ChatCompletion | AsyncIterator[ChatCompletionChunk], stream: bool
+    ) -> ChatCompletion | AsyncIterator[ChatCompletionChunk]:
+        """
+        Store a live response and return it for the caller to consume.
+
+        Args:
+            key: Key from response_cache_key().
+            response: Response returned by acompletion().
+            stream: Whether the response is a stream.
+
+        Returns:
+            The response; a stream is wrapped so it is stored once fully read.
+        """
+        if not stream:
+            await self.put(key, response.model_dump_json())
+            return response
+        return self._record_stream(key, response)
+
+    async def _record_stream(self, key: str,
+                             response: AsyncIterator[ChatCompletionChunk]) -> AsyncIterator[ChatCompletionChunk]:
+        chunks: List[Dict[str, Any]] = []
+        async with aclosing(response):
+            async for chunk in response:
+                chunks.append(chunk.model_dump(mode='json'))
+                yield chunk
+        # Only complete responses are stored, a stopped stream never reaches this point
+        await self.put(key, json.dumps(chunks))
+
+    async def close(self) -> None:
+        await self._call('close')
+
+
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    global _response_cache
+    if _response_cache is None and RESPONSE_CACHE_ENABLED:
+        _response_cache = ResponseCache()
+    return _response_cache
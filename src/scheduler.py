@@ -0,0 +1,201 @@
+import asyncio
+import itertools
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import load_config
+from metrics import inc_counter, observe
+from ollama_pool import ollama_model_name
+
+# Requests a single Ollama backend serves at the same time
+SCHEDULER_BACKEND_CONCURRENCY = int(os.getenv('SCHEDULER_BACKEND_CONCURRENCY', '4'))
+# Default requests a single model serves at the same time, see model_concurrency in config/settings.toml
+SCHEDULER_MODEL_CONCURRENCY = int(os.getenv('SCHEDULER_MODEL_CONCURRENCY', '2'))
+# Prompts longer than this many characters queue behind shorter ones of the same round
+SCHEDULER_LONG_PROMPT_CHARS = int(os.getenv('SCHEDULER_LONG_PROMPT_CHARS', '8000'))
+
+SETTINGS_FILE = 'settings.toml'
+MODEL_CONCURRENCY = 'model_concurrency'
+
+# Request classes, lower values are admitted first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 1
+
+logger = logging.getLogger(__name__)
+
+QueueCallback = Callable[[int], Awaitable[None]]
+
+
+def model_key(model: str) -> str:
+    # Requests name Ollama models with the any-llm 'ollama:' prefix, [model_concurrency] without it
+    return ollama_model_name(model) or model
+
+
+class _Waiter:
+    def __init__(self, backend: str, model: str, priority: int, tag: float, long_prompt: bool, seq: int) -> None:
+        self.backend = backend
+        self.model = model
+        self.priority = priority
+        self.tag = tag
+        self.long_prompt = long_prompt
+        self.seq = seq
+        self.position = 0
+        self.admitted = asyncio.get_running_loop().create_future()
+        self.changed = asyncio.Event()
+
+    def sort_key(self) -> Tuple[int, float, bool, int]:
+        return (self.priority, self.tag, self.long_prompt, self.seq)
+
+
+class RequestScheduler:
+    """
+    Admission control for model requests with per-backend and per-model limits.
+
+    Waiting requests are ordered by priority class, then by a per-session
+    virtual start tag (start-time fair queuing), so a session sending many
+    requests cannot starve the others, then short prompts before long ones.
+    A request whose model is at its limit does not block requests for other
+    models on the same backend.
+
+    Args:
+        backend_limit: Concurrent requests per backend.
+        model_limit: Default concurrent requests per model and backend.
+        model_limits: Per-model overrides of model_limit.
+    """
+
+    def __init__(
+        self,
+        backend_limit: int = SCHEDULER_BACKEND_CONCURRENCY,
+        model_limit: int = SCHEDULER_MODEL_CONCURRENCY,
+        model_limits: Optional[Dict[str, int]] = None
+    ) -> None:
+        self.backend_limit = max(1, backend_limit)
+        self.model_limit = max(1, model_limit)
+        self.model_limits = {model_key(name): limit for name, limit in (model_limits or {}).items()}
+        self._backend_active: Dict[str, int] = {}
+        self._model_active: Dict[Tuple[str, str], int] = {}
+        self._waiters: List[_Waiter] = []
+        self._session_tags: Dict[str, float] = {}
+        self._virtual_time = 0.0
+        self._seq = itertools.count()
+
+    def active(self, backend: str, model: Optional[str] = None) -> int:
+        if model is None:
+            return self._backend_active.get(backend, 0)
+        return self._model_active.get((backend, model_key(model)), 0)
+
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def _has_capacity(self, backend: str, model: str) -> bool:
+        return (self._backend_active.get(backend, 0) < self.backend_limit
+                and self._model_active.get((backend, model), 0) < max(1, self.model_limits.get(model, self.model_limit)))
+
+    def _acquire(self, backend: str, model: str) -> None:
+        self._backend_active[backend] = self._backend_active.get(backend, 0) + 1
+        self._model_active[(backend, model)] = self._model_active.get((backend, model), 0) + 1
+
+    def _release(self, backend: str, model: str) -> None:
+        self._backend_active[backend] -= 1
+        self._model_active[(backend, model)] -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        # Admit waiters in order while capacity allows, and renumber the rest per backend and model
+        self._waiters.sort(key=_Waiter.sort_key)
+        waiting: List[_Waiter] = []
+        positions: Dict[Tuple[str, str], int] = {}
+        for waiter in self._waiters:
+            if waiter.admitted.done():
+                continue
+            if self._has_capacity(waiter.backend, waiter.model):
+                self._acquire(waiter.backend, waiter.model)
+                self._virtual_time = max(self._virtual_time, waiter.tag)
+                waiter.admitted.set_result(None)
+                continue
+            key = (waiter.backend, waiter.model)
+            positions[key] = positions.get(key, 0) + 1
+            if waiter.position != positions[key]:
+                waiter.position = positions[key]
+                waiter.changed.set()
+            waiting.append(waiter)
+        self._waiters = waiting
+        # Tags at or below the virtual time no longer give a session an advantage
+        self._session_tags = {
+            session: tag for session, tag in self._session_tags.items() if tag > self._virtual_time}
+
+    @asynccontextmanager
+    async def slot(
+        self,
+        backend: str,
+        model: str,
+        session: str = '',
+        priority: int = PRIORITY_INTERACTIVE,
+        prompt_chars: int = 0,
+        on_queue: Optional[QueueCallback] = None
+    ) -> AsyncIterator[None]:
+        """
+        Wait for a free slot on the backend and model and hold it for the block.
+
+        Args:
+            backend: Backend the request is sent to, e.g. its API base URL.
+            model: Model name.
+            session: Session id used for fair queuing.
+            priority: PRIORITY_INTERACTIVE, PRIORITY_BATCH or another class.
+            prompt_chars: Prompt size, long prompts yield to short ones.
+            on_queue: Called with the 1-based queue position whenever it
+                changes while waiting, and with 0 once admitted after waiting.
+        """
+        wait_start = time.perf_counter()
+        key = model_key(model)
+        tag = max(self._virtual_time, self._session_tags.get(session, 0.0)) + 1
+        self._session_tags[session] = tag
+        waiter = _Waiter(backend, key, priority, tag,
+                         prompt_chars > SCHEDULER_LONG_PROMPT_CHARS, next(self._seq))
+        self._waiters.append(waiter)
+        self._dispatch()
+
+        queued = not waiter.admitted.done()
+        try:
+            while not waiter.admitted.done():
+                waiter.changed.clear()
+                if on_queue:
+                    await on_queue(waiter.position)
+                changed = asyncio.ensure_future(waiter.changed.wait())
+                try:
+                    await asyncio.wait([waiter.admitted, changed], return_when=asyncio.FIRST_COMPLETED)
+                finally:
+                    changed.cancel()
+            if queued and on_queue:
+                await on_queue(0)
+        except BaseException:
+            if waiter.admitted.done() and not waiter.admitted.cancelled():
+                self._release(backend, key)
+            else:
+                waiter.admitted.cancel()
+                self._dispatch()
+            raise
+
+        wait_time = time.perf_counter() - wait_start
+        observe('scheduler_wait', wait_time, model=model)
+        if queued:
+            inc_counter('scheduler_queued', model=model)
+            logger.info(f"Request for {model} on {backend} waited {wait_time:.3f}s in queue")
+        try:
+            yield
+        finally:
+            self._release(backend, key)
+
+
+_request_scheduler: Optional[RequestScheduler] = None
+
+
+def get_request_scheduler() -> RequestScheduler:
+    global _request_scheduler
+    if _request_scheduler is None:
+        model_limits = load_config(SETTINGS_FILE).get(MODEL_CONCURRENCY, {})
+        _request_scheduler = RequestScheduler(model_limits=model_limits)
+    return _request_scheduler
@@ -0,0 +1,204 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import toml
+
+from config import load_config, write_toml_atomic
+
+# Directory of the per-user settings files
+USER_SETTINGS_DIR = os.getenv('USER_SETTINGS_DIR', 'config/users')
+# Seconds without further changes before a user's settings are written
+USER_SETTINGS_WRITE_DELAY = float(os.getenv('USER_SETTINGS_WRITE_DELAY', '1'))
+
+SETTINGS_FILE = 'settings.toml'
+# User of sessions without authentication
+DEFAULT_USER = 'default'
+# Chat settings a user can change, with their types
+USER_SETTINGS_SCHEMA: Dict[str, type] = {
+    'model': str,
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _validated(settings: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    valid: Dict[str, Any] = {}
+    errors: List[str] = []
+    for key, value in settings.items():
+        expected = USER_SETTINGS_SCHEMA.get(key)
+        if expected is None:
+            errors.append(f"unknown setting {key}")
+        elif not isinstance(value, expected):
+            errors.append(f"{key} must be {expected.__name__}, not {type(value).__name__}")
+        else:
+            valid[key] = value
+    return valid, errors
+
+
+def validate_settings(settings: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Check chat settings against USER_SETTINGS_SCHEMA.
+
+    Args:
+        settings: Settings to check.
+
+    Returns:
+        Dict[str, Any]: The settings.
+
+    Raises:
+        ValueError: If a setting is unknown or has the wrong type.
+    """
+    valid, errors = _validated(settings)
+    if errors:
+        raise ValueError(f"Invalid settings: {', '.join(errors)}")
+    return valid
+
+
+def user_settings_path(user: str, settings_dir: str | Path = USER_SETTINGS_DIR) -> Path:
+    # Readable and collision-free file name for any user identifier, e.g. an email address
+    digest = hashlib.sha256(user.encode('utf-8')).hexdigest()[:12]
+    return Path(settings_dir) / f"{re.sub(r'[^A-Za-z0-9_.-]', '_', user)[:64]}-{digest}.toml"
+
+
+class UserSettingsStore:
+    """
+    Chat settings of each user, kept in memory and written to one file per user.
+
+    A user's file is read once, off the event loop, on first use. Changes
+    apply in memory at once and are written when the user made no further
+    changes for write_delay seconds, to a temporary file that replaces the
+    previous one, so a crash never leaves a partly written file. Settings a
+    user never changed fall back to the top-level values of
+    config/settings.toml.
+
+    Args:
+        settings_dir: Directory of the per-user settings files.
+        write_delay: Seconds without changes before settings are written.
+    """
+
+    def __init__(self, settings_dir: str | Path = USER_SETTINGS_DIR,
+                 write_delay: float = USER_SETTINGS_WRITE_DELAY) -> None:
+        self.settings_dir = Path(settings_dir)
+        self.write_delay = write_delay
+        self._settings: Dict[str, Dict[str, Any]] = {}
+        self._loading: Dict[str, asyncio.Future] = {}
+        # Version of each user's settings in memory and on disk; older snapshots are never written
+        self._versions: Dict[str, int] = {}
+        self._written: Dict[str, int] = {}
+        self._write_lock = threading.Lock()
+        self._due: Dict[str, float] = {}
+        self._writers: Dict[str, asyncio.Task] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._flushing = asyncio.Event()
+
+    def _load(self, user: str) -> Dict[str, Any]:
+        defaults, _ = _validated({key: value for key, value in load_config(SETTINGS_FILE).items()
+                                  if key in USER_SETTINGS_SCHEMA})
+        path = user_settings_path(user, self.settings_dir)
+        try:
+            saved, errors = _validated(toml.load(path))
+        except FileNotFoundError:
+            return defaults
+        except (OSError, toml.TomlDecodeError) as error:
+            logger.error(f"Could not read settings of {user} from {path}: {error!r}")
+            return defaults
+        for error in errors:
+            logger.warning(f"Ignored setting of {user} in {path}: {error}")
+        return {**defaults, **saved}
+
+    async def get(self, user: str) -> Dict[str, Any]:
+        """
+        Settings of a user.
+
+        Args:
+            user: User identifier.
+
+        Returns:
+            Dict[str, Any]: Copy of the user's settings.
+        """
+        settings = self._settings.get(user)
+        if settings is None:
+            # Sessions of the same user starting together read the file once
+            loading = self._loading.get(user)
+            if loading is None:
+                loading = self._loading[user] = asyncio.ensure_future(asyncio.to_thread(self._load, user))
+                loading.add_done_callback(lambda _: self._loading.pop(user, None))
+            loaded = await asyncio.shield(loading)
+            settings = self._settings.setdefault(user, loaded)
+        return dict(settings)
+
+    async def update(self, user: str, changes: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Change settings of a user and schedule writing them.
+
+        Args:
+            user: User identifier.
+            changes: Settings to change; others keep their values.
+
+        Returns:
+            Dict[str, Any]: Copy of the user's settings after the change.
+
+        Raises:
+            ValueError: If a setting is unknown or has the wrong type.
+        """
+        changes = validate_settings(changes)
+        settings = {**await self.get(user), **changes}
+        self._settings[user] = settings
+        self._versions[user] = self._versions.get(user, 0) + 1
+
+        loop = asyncio.get_running_loop()
+        self._due[user] = loop.time() + self.write_delay
+        if user not in self._writers:
+            task = asyncio.create_task(self._write_when_idle(user))
+            self._writers[user] = task
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return dict(settings)
+
+    async def _write_when_idle(self, user: str) -> None:
+        loop = asyncio.get_running_loop()
+        while not self._flushing.is_set() and (remaining := self._due[user] - loop.time()) > 0:
+            try:
+                await asyncio.wait_for(self._flushing.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+        del self._writers[user]
+        snapshot = (self._versions[user], dict(self._settings[user]))
+        try:
+            # A write that has started is finished even if the task is cancelled
+            await asyncio.shield(asyncio.to_thread(self._write, user, *snapshot))
+        except Exception as error:
+            logger.error(f"Could not write settings of {user}: {error!r}")
+
+    def _write(self, user: str, version: int, settings: Dict[str, Any]) -> None:
+        with self._write_lock:
+            if version <= self._written.get(user, 0):
+                return
+            write_toml_atomic(user_settings_path(user, self.settings_dir), settings)
+            self._written[user] = version
+        logger.info(f"Saved settings of {user}")
+
+    async def flush(self) -> None:
+        # Write pending changes now, e.g. at shutdown
+        self._flushing.set()
+        try:
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+        finally:
+            self._flushing.clear()
+
+
+_user_settings_store: Optional[UserSettingsStore] = None
+
+
+def get_user_settings_store() -> UserSettingsStore:
+    global _user_settings_store
+    if _user_settings_store is None:
+        _user_settings_store = UserSettingsStore()
+    return _user_settings_store
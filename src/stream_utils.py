@@ -0,0 +1,157 @@
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, List, Optional, Tuple
+
+# Seconds buffered tokens may wait before they are sent to the client
+STREAM_FLUSH_INTERVAL = float(os.getenv('STREAM_FLUSH_INTERVAL', '0.03'))
+# Number of buffered characters that triggers an immediate send
+STREAM_FLUSH_CHARS = int(os.getenv('STREAM_FLUSH_CHARS', '512'))
+
+
+class CoalescingStreamWriter:
+    """
+    Buffer streamed tokens and send them to a sink in batches.
+
+    Tokens are flushed once the oldest buffered token is flush_interval seconds
+    old or the buffer holds flush_chars characters, whichever comes first.
+    close() flushes the remainder immediately.
+
+    Args:
+        sink: Coroutine function that sends a batch of text, e.g. cl.Message.stream_token.
+        flush_interval: Seconds a token may wait in the buffer. 0 disables coalescing.
+        flush_chars: Buffer size in characters that triggers a flush.
+    """
+
+    def __init__(
+        self,
+        sink: Callable[[str], Awaitable[None]],
+        flush_interval: float = STREAM_FLUSH_INTERVAL,
+        flush_chars: int = STREAM_FLUSH_CHARS
+    ) -> None:
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
+        self._buffer: List[str] = []
+        self._buffered_chars = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def write(self, token: Optional[str]) -> None:
+        if not token:
+            return
+        self._buffer.append(token)
+        self._buffered_chars += len(token)
+        if self.flush_interval <= 0 or self._buffered_chars >= self.flush_chars:
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def flush(self) -> None:
+        if self._flush_task is not None and self._flush_task is not asyncio.current_task():
+            self._flush_task.cancel()
+        self._flush_task = None
+        if not self._buffer:
+            return
+
+        text = ''.join(self._buffer)
+        self._buffer.clear()
+        self._buffered_chars = 0
+        async with self._lock:
+            await self.sink(text)
+
+    async def close(self) -> None:
+        await self.flush()
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.flush_interval)
+        await self.flush()
+
+    async def __aenter__(self) -> 'CoalescingStreamWriter':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+THINK_START_TAG = '<think>'
+THINK_END_TAG = '</think>'
+
+# Kinds of segments produced by ThinkStreamParser
+MESSAGE = 'message'
+THINKING = 'thinking'
+REASONING = 'reasoning'
+
+
+def _partial_tag_length(text: str, tag: str) -> int:
+    # Length of the longest suffix of text that is a proper prefix of tag
+    tail = text[-(len(tag) - 1):]
+    if '<' not in tail:
+        return 0
+    for length in range(len(tail), 0, -1):
+        if tag.startswith(tail[-length:]):
+            return length
+    return 0
+
+
+class ThinkStreamParser:
+    """
+    Incrementally split streamed deltas into message, thinking and reasoning segments.
+
+    Content between <think> and </think> becomes THINKING, delta.reasoning becomes
+    REASONING and everything else MESSAGE. Tags may be split across chunks: a
+    chunk ending in a possible tag prefix is held back until the next chunk
+    decides it. Whenever a tag switches the kind, an empty segment of the new
+    kind is emitted so consumers can open or close their sinks right away.
+    """
+
+    def __init__(self) -> None:
+        self.thinking = False
+        self._pending = ''
+
+    @property
+    def kind(self) -> str:
+        return THINKING if self.thinking else MESSAGE
+
+    def feed(self, delta: Any) -> List[Tuple[str, str]]:
+        """
+        Parse one ChoiceDelta.
+
+        Args:
+            delta: Delta of a ChatCompletionChunk choice.
+
+        Returns:
+            List[Tuple[str, str]]: (kind, text) segments in stream order.
+        """
+        segments: List[Tuple[str, str]] = []
+        reasoning = getattr(delta, 'reasoning', None)
+        if reasoning and reasoning.content:
+            segments.append((REASONING, reasoning.content))
+        if delta.content:
+            segments.extend(self.feed_content(delta.content))
+        return segments
+
+    def feed_content(self, text: str) -> List[Tuple[str, str]]:
+        segments: List[Tuple[str, str]] = []
+        text = self._pending + text
+        self._pending = ''
+        while text:
+            tag = THINK_END_TAG if self.thinking else THINK_START_TAG
+            index = text.find(tag)
+            if index >= 0:
+                if index:
+                    segments.append((self.kind, text[:index]))
+                self.thinking = not self.thinking
+                segments.append((self.kind, ''))
+                text = text[index + len(tag):]
+            else:
+                keep = _partial_tag_length(text, tag)
+                if keep < len(text):
+                    segments.append((self.kind, text[:len(text) - keep]))
+                self._pending = text[len(text) - keep:]
+                break
+        return segments
+
+    def flush(self) -> List[Tuple[str, str]]:
+        # Release text held back as a possible tag prefix at the end of the stream
+        pending, self._pending = self._pending, ''
+        return [(self.kind, pending)] if pending else []
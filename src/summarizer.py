@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from agent_helper import complete_text
+from metrics import inc_counter, span
+from prompt_utils import render_prompt
+from text_utils import iter_merged_sentences, iter_sentence_split
+
+# Summarize user messages longer than one history chunk instead of sending every chunk to the model
+SUMMARIZE_LONG_INPUTS = os.getenv('SUMMARIZE_LONG_INPUTS', '').lower() in ('1', 'true', 'yes')
+# Token budget of the text summarized by one request
+SUMMARIZE_CHUNK_TOKENS = int(os.getenv('SUMMARIZE_CHUNK_TOKENS', '4096'))
+# Bullet points of each summary
+SUMMARIZE_BULLETS = int(os.getenv('SUMMARIZE_BULLETS', '5'))
+# Partial summaries combined by one reduce request
+SUMMARIZE_REDUCE_FANIN = int(os.getenv('SUMMARIZE_REDUCE_FANIN', '8'))
+# Summaries kept in memory, keyed by a hash of the summarized text
+SUMMARIZE_CACHE_ENTRIES = int(os.getenv('SUMMARIZE_CACHE_ENTRIES', '1024'))
+
+SUMMARIZE_PROMPT = 'summarize'
+
+logger = logging.getLogger(__name__)
+
+CompleteFunction = Callable[[List[Dict[str, str]]], Awaitable[str]]
+# Called with the stage name, the finished and the total requests of the stage
+ProgressCallback = Callable[[str, int, int], Awaitable[None]]
+
+
+def summary_cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f'{model}\0{text}'.encode('utf-8')).hexdigest()
+
+
+class Summarizer:
+    """
+    Map-reduce summarization of texts longer than the model's context.
+
+    The text is split into chunks of whole sentences, each chunk is summarized
+    with the summarize prompt of data/prompts concurrently (map), and the
+    partial summaries are combined fan_in at a time until one summary remains
+    (reduce). Summaries are cached by a hash of the summarized text, so a chunk
+    that was already summarized, e.g. the unchanged part of an edited paste,
+    costs no request, and concurrent requests for the same text share one call.
+
+    Args:
+        model: Model name, part of the cache key.
+        complete: Coroutine function returning the model's answer to a list of messages.
+        chunk_tokens: Token budget of a chunk.
+        bullets: Bullet points of each summary.
+        fan_in: Partial summaries combined by one reduce request.
+        cache_entries: Maximum number of cached summaries.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        complete: CompleteFunction,
+        chunk_tokens: int = SUMMARIZE_CHUNK_TOKENS,
+        bullets: int = SUMMARIZE_BULLETS,
+        fan_in: int = SUMMARIZE_REDUCE_FANIN,
+        cache_entries: int = SUMMARIZE_CACHE_ENTRIES
+    ) -> None:
+        self.model = model
+        self.complete = complete
+        self.chunk_tokens = chunk_tokens
+        self.bullets = bullets
+        self.fan_in = max(2, fan_in)
+        self.cache_entries = cache_entries
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    def chunks(self, text: str) -> List[str]:
+        return list(iter_merged_sentences(iter_sentence_split(text), context_length=self.chunk_tokens))
+
+    def cached(self, text: str) -> Optional[str]:
+        key = summary_cache_key(self.model, text)
+        summary = self._cache.get(key)
+        if summary is not None:
+            self._cache.move_to_end(key)
+        return summary
+
+    def _store(self, text: str, summary: str) -> None:
+        self._cache[summary_cache_key(self.model, text)] = summary
+        while len(self._cache) > self.cache_entries:
+            self._cache.popitem(last=False)
+
+    async def summarize_chunk(self, text: str) -> str:
+        key = summary_cache_key(self.model, text)
+        while True:
+            summary = self.cached(text)
+            if summary is not None:
+                inc_counter('summary_cache_hits', model=self.model)
+                return summary
+
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # The session summarizing the chunk was stopped, not this one: summarize it here
+                if not pending.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        pending = self._pending[key] = asyncio.get_running_loop().create_future()
+        try:
+            with span('summarize_chunk', model=self.model):
+                prompt = render_prompt(SUMMARIZE_PROMPT, {'text': text, 'bullets': self.bullets})
+                summary = (await self.complete([{'role': 'user', 'content': prompt}])).strip()
+            self._store(text, summary)
+            pending.set_result(summary)
+            return summary
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as error:
+            pending.set_exception(error)
+            # Waiters see the error, nobody else has to retrieve it
+            pending.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    async def _summarize_all(self, stage: str, texts: List[str],
+                             on_progress: Optional[ProgressCallback]) -> List[str]:
+        done = 0
+
+        async def summarize_one(text: str) -> str:
+            nonlocal done
+            summary = await self.summarize_chunk(text)
+            done += 1
+            if on_progress:
+                await on_progress(stage, done, len(texts))
+            return summary
+
+        tasks = [asyncio.ensure_future(summarize_one(text)) for text in texts]
+        try:
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            # A failed request cancels the rest of the stage
+            for task in tasks:
+                task.cancel()
+            raise
+
+    async def summarize(self, text: str, on_progress: Optional[ProgressCallback] = None) -> str:
+        """
+        Summarize a text of any length.
+
+        Args:
+            text: Text to summarize.
+            on_progress: Called after each finished request with the stage
+                ('map', then 'reduce 1', 'reduce 2', ...), the finished and
+                the total requests of the stage.
+
+        Returns:
+            str: The summary.
+        """
+        summary = self.cached(text)
+        if summary is not None:
+            inc_counter('summary_cache_hits', model=self.model)
+            return summary
+
+        with span('summarize', model=self.model):
+            # Tokenizing a long text takes a while, keep it off the event loop
+            chunks = await asyncio.to_thread(self.chunks, text)
+            summaries = await self._summarize_all('map', chunks, on_progress)
+            level = 0
+            while len(summaries) > 1:
+                level += 1
+                groups = ['\n\n'.join(summaries[start:start + self.fan_in])
+                          for start in range(0, len(summaries), self.fan_in)]
+                summaries = await self._summarize_all(f'reduce {level}', groups, on_progress)
+        logger.info(f"Summarized {len(chunks)} chunks with {level} reduce levels")
+        summary = summaries[0] if summaries else ''
+        self._store(text, summary)
+        return summary
+
+
+_summarizers: Dict[str, Summarizer] = {}
+
+
+def get_summarizer(model: str) -> Summarizer:
+    # One summarizer and summary cache per model, requests go through the scheduler as batch work
+    summarizer = _summarizers.get(model)
+    if summarizer is None:
+        async def complete(messages: List[Dict[str, str]]) -> str:
+            return await complete_text(model, messages)
+        summarizer = _summarizers[model] = Summarizer(model, complete)
+    return summarizer
@@ -2,7 +2,7 @@ from datetime import datetime
 import logging
 import re
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 
 from jinja2 import Environment, FileSystemLoader
 import toml
@@ -12,10 +12,66 @@ TEMPLATES_DIR = 'data/templates'
 logger = logging.getLogger(__name__)
 
 
+def _file_version(path: Path) -> Tuple[int, int]:
+    stat = path.stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class TemplateStore:
+    """
+    Cache of compiled templates, their parameters and the template list.
+
+    Templates are compiled once by a shared Jinja environment that recompiles a
+    template when its file changes. Parameters, Markdown templates and the
+    template list are cached by file and directory modification time and size,
+    so edits in the templates directory show up without a restart.
+    """
+
+    def __init__(self, templates_dir: str = TEMPLATES_DIR) -> None:
+        self.templates_dir = templates_dir
+        self.environment = Environment(
+            loader=FileSystemLoader(searchpath=templates_dir), auto_reload=True)
+        self._names: Optional[Tuple[Tuple[int, int], List[str]]] = None
+        self._vars: Dict[str, Tuple[Tuple[int, int], Dict[str, str]]] = {}
+        self._texts: Dict[str, Tuple[Tuple[int, int], str]] = {}
+
+    def list_templates(self) -> List[str]:
+        templates_folder = Path(self.templates_dir)
+        version = _file_version(templates_folder)
+        if self._names is None or self._names[0] != version:
+            jinja_file_names = [file.stem for file in sorted(templates_folder.glob('*.jinja'))]
+            self._names = (version, jinja_file_names)
+        return list(self._names[1])
+
+    def template_vars(self, name: str) -> Dict[str, str]:
+        file_name = get_template_file_name(name=name, path=self.templates_dir)
+        version = _file_version(Path(file_name))
+        cached = self._vars.get(file_name)
+        if cached is None or cached[0] != version:
+            with open(file_name, "r") as f:
+                cached = (version, parse_template_vars(name=name, template=f.read()))
+            self._vars[file_name] = cached
+        return dict(cached[1])
+
+    def text(self, file_name: str) -> str:
+        version = _file_version(Path(file_name))
+        cached = self._texts.get(file_name)
+        if cached is None or cached[0] != version:
+            with open(file_name, "r") as f:
+                cached = (version, f.read())
+            self._texts[file_name] = cached
+        return cached[1]
+
+    def render(self, name: str, context: Dict[str, str]) -> str:
+        template = self.environment.get_template(get_template_file_name(name=name, path=None))
+        return template.render(context)
+
+
+_template_store = TemplateStore()
+
+
 def list_templates() -> List[str]:
-    templates_folder = Path(TEMPLATES_DIR)
-    jinja_file_names = [file.stem for file in sorted(templates_folder.glob('*.jinja'))]
-    return jinja_file_names
+    return _template_store.list_templates()
 
 
 def get_template_file_name(name: str, path: str = TEMPLATES_DIR) -> str:
@@ -29,8 +85,10 @@ def get_template_content(name: str) -> str:
 
 
 def extract_template_vars(name: str) -> Dict[str, str]:
-    template = get_template_content(name)
+    return _template_store.template_vars(name)
+
 
+def parse_template_vars(name: str, template: str) -> Dict[str, str]:
     # Regular expression to extract the TOML parameters
     pattern = r'\{#(.*?)#\}'
     match = re.search(pattern, template, re.DOTALL)
@@ -45,7 +103,7 @@ def extract_template_vars(name: str) -> Dict[str, str]:
             logger.error(f"Failed to parse TOML in template: {name}")
             raise e
     else:
-        {}
+        return {}
 
 
 def extract_template_name(command: str) -> str:
@@ -61,8 +119,14 @@ def extract_template_name(command: str) -> str:
 
 def render_template_with_vars(name: str, context: Dict[str, str]) -> str:
     # Render the template with the context variables
-    env = Environment(loader=FileSystemLoader(searchpath=TEMPLATES_DIR))
-    template = env.get_template(get_template_file_name(name=name, path=None))
     context['now'] = datetime.now().strftime("%A, %B %d, %Y")
-    output = template.render(context)
+    output = _template_store.render(name=name, context=context)
+    return output.strip()
+
+
+def render_text_template(name: str, values: Dict[str, str], path: str = TEMPLATES_DIR) -> str:
+    # Fill the {placeholder} strings of a Markdown template such as "RAG Q&A"
+    output = _template_store.text(f'{path}/{name}.md')
+    for placeholder, value in values.items():
+        output = output.replace(f'{{{placeholder}}}', value)
     return output.strip()
@@ -1,32 +1,130 @@
 import re
+from itertools import islice
+from typing import Iterable, Iterator
 
-import tiktoken
+from token_utils import DEFAULT_ENCODING, count_tokens, get_encoding
+
+SENTENCE_BOUNDARY = re.compile('(?<=[.!?。！？])\\s+')
+# Number of sentences counted per count_tokens() call while packing
+SENTENCE_BATCH_SIZE = 256
+# Longer sentences, e.g. text without punctuation such as a CSV file, are split at line ends
+SENTENCE_MAX_CHARS = 4096
 
 
 def sentence_split(text: str) -> list[str]:
-    single_sentence_list = re.split('(?<=[.!?。！？])\\s+', text)
-    return single_sentence_list
+    # Sentences keep the whitespace that follows them, so joining them gives back the text
+    return list(iter_sentence_split(text))
+
+
+def split_long_sentence(sentence: str, max_chars: int = SENTENCE_MAX_CHARS) -> list[str]:
+    # Lines of a sentence longer than max_chars, lines longer than that are cut every max_chars
+    if len(sentence) <= max_chars:
+        return [sentence]
+    return [line[start:start + max_chars]
+            for line in sentence.splitlines(keepends=True)
+            for start in range(0, len(line), max_chars)]
+
+
+def iter_sentence_split(text: str) -> Iterator[str]:
+    # Lazy variant of sentence_split() that yields sentences as they are found
+    start = 0
+    for match in SENTENCE_BOUNDARY.finditer(text):
+        yield from split_long_sentence(text[start:match.end()])
+        start = match.end()
+    if start < len(text):
+        yield from split_long_sentence(text[start:])
+
+
+def iter_stream_sentences(blocks: Iterable[str]) -> Iterator[str]:
+    # Sentences of text read in blocks, e.g. a file, without holding the whole text
+    pending = ''
+    for block in blocks:
+        pending += block
+        # A boundary at the end of the block may continue in the next one
+        last_boundary = None
+        for boundary in SENTENCE_BOUNDARY.finditer(pending):
+            if boundary.end() < len(pending):
+                last_boundary = boundary
+        if last_boundary is not None:
+            yield from iter_sentence_split(pending[:last_boundary.end()])
+            pending = pending[last_boundary.end():]
+        if len(pending) > SENTENCE_MAX_CHARS:
+            # No sentence ends in sight: emit whole lines, so pending and its rescans stay short
+            *lines, pending = split_long_sentence(pending)
+            yield from lines
+    if pending:
+        yield pending
 
 
-def merge_sentences(single_sentence_list: list[str], context_length: int = 4096, encoding_name: str = 'o200k_base') -> list[str]:
-    merged_sentence_list = []
+def _cut_at_tokens(text: str, max_tokens: int, encoding_name: str) -> list[tuple[str, int]]:
+    # Pieces of text with max_tokens tokens each and their token counts, cut between characters
+    encoding = get_encoding(encoding_name)
+    tokens = encoding.encode_ordinary(text)
+    _, offsets = encoding.decode_with_offsets(tokens)
+    starts = list(range(0, len(tokens), max_tokens))
+    cuts = [offsets[start] for start in starts] + [len(text)]
+    token_ends = starts[1:] + [len(tokens)]
+    return [(text[cut:next_cut], token_end - start)
+            for cut, next_cut, start, token_end in zip(cuts, cuts[1:], starts, token_ends)
+            if next_cut > cut]
 
-    encoding = tiktoken.get_encoding(encoding_name)
 
-    current_merged_sentence = None
-    for sentence in single_sentence_list:
-        chunk = current_merged_sentence + sentence if current_merged_sentence else sentence
-        tokens = encoding.encode(chunk)
-        if len(tokens) < context_length:
-            current_merged_sentence = chunk
+def split_to_budget(text: str, max_tokens: int, encoding_name: str = DEFAULT_ENCODING) -> list[tuple[str, int]]:
+    # Lines of text and their token counts, lines longer than max_tokens are cut at token boundaries
+    max_tokens = max(1, max_tokens)
+    lines = text.splitlines(keepends=True)
+    pieces: list[tuple[str, int]] = []
+    for line, line_tokens in zip(lines, count_tokens(lines, encoding_name=encoding_name)):
+        if line_tokens > max_tokens:
+            pieces.extend(_cut_at_tokens(line, max_tokens, encoding_name))
         else:
-            merged_sentence_list.append(current_merged_sentence)
-            current_merged_sentence = None
+            pieces.append((line, line_tokens))
+    return pieces
+
+
+def iter_merged_sentences(single_sentences: Iterable[str], context_length: int = 4096, encoding_name: str = DEFAULT_ENCODING) -> Iterator[str]:
+    """
+    Incrementally pack sentences into chunks that stay below the token budget.
+
+    Every sentence is encoded once, and again only if it has to be split, and
+    its token count is added to the running total of the current chunk, so
+    packing is linear in the input size.
+    Sentences are counted in batches of SENTENCE_BATCH_SIZE and chunks are yielded
+    as soon as the next sentence would overflow them, which lets callers start
+    consuming chunks before the whole input has been tokenized.
+
+    Args:
+        single_sentences: Iterable of sentences, e.g. from iter_sentence_split().
+        context_length: Token budget of a single chunk.
+        encoding_name: tiktoken encoding used to count tokens.
+
+    Yields:
+        str: Merged chunks. A sentence that exceeds the budget on its own is
+        packed line by line, and a line that still exceeds it is cut at token
+        boundaries.
+    """
+    sentences = (sentence for sentence in single_sentences if sentence)
+
+    current_sentences: list[str] = []
+    current_tokens = 0
+    while batch := list(islice(sentences, SENTENCE_BATCH_SIZE)):
+        for sentence, sentence_tokens in zip(batch, count_tokens(batch, encoding_name=encoding_name)):
+            pieces = [(sentence, sentence_tokens)] if sentence_tokens < context_length else split_to_budget(
+                sentence, context_length - 1, encoding_name=encoding_name)
+            for piece, piece_tokens in pieces:
+                if current_sentences and current_tokens + piece_tokens >= context_length:
+                    yield ''.join(current_sentences)
+                    current_sentences = []
+                    current_tokens = 0
+                current_sentences.append(piece)
+                current_tokens += piece_tokens
+
+    if current_sentences:
+        yield ''.join(current_sentences)
 
-    if current_merged_sentence:
-        merged_sentence_list.append(current_merged_sentence)
 
-    return merged_sentence_list
+def merge_sentences(single_sentence_list: list[str], context_length: int = 4096, encoding_name: str = DEFAULT_ENCODING) -> list[str]:
+    return list(iter_merged_sentences(single_sentence_list, context_length=context_length, encoding_name=encoding_name))
 
 
 def extract_parameter_strings(template: str) -> list[str]:
@@ -0,0 +1,98 @@
+import logging
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Sequence
+
+import tiktoken
+
+DEFAULT_ENCODING = 'o200k_base'
+# Local copy of tiktoken's BPE files so encodings load without network access.
+# Populate it once on a connected machine with `python src/token_utils.py`, see README.md.
+TIKTOKEN_CACHE_DIR = os.getenv('TIKTOKEN_CACHE_DIR', str(Path(__file__).resolve().parents[1] / 'data' / 'tiktoken'))
+# Inputs with at least this many characters are encoded in worker threads
+BATCH_ENCODE_MIN_CHARS = 16_384
+BATCH_ENCODE_THREADS = min(8, os.cpu_count() or 1)
+
+logger = logging.getLogger(__name__)
+
+_encodings: Dict[str, tiktoken.Encoding] = {}
+_encodings_lock = threading.Lock()
+
+
+def use_tiktoken_cache(cache_dir: str = TIKTOKEN_CACHE_DIR) -> bool:
+    # Point tiktoken at the vendored files; it reads TIKTOKEN_CACHE_DIR whenever it loads an encoding
+    if cache_dir and Path(cache_dir).is_dir():
+        os.environ['TIKTOKEN_CACHE_DIR'] = str(Path(cache_dir).resolve())
+        return True
+    return False
+
+
+# Any encoding loaded in this process, not only the preloaded ones, comes from the vendored files
+use_tiktoken_cache()
+
+
+def preload_encodings(encoding_names: Iterable[str] = (DEFAULT_ENCODING,), cache_dir: str = TIKTOKEN_CACHE_DIR) -> None:
+    """
+    Load tiktoken encodings into the process-wide registry.
+
+    Meant to run once at application startup so the first user message does
+    not pay for loading (or downloading) the BPE ranks.
+
+    Args:
+        encoding_names: Names of the encodings to load.
+        cache_dir: Directory with vendored tiktoken cache files. Used when it exists.
+    """
+    if not use_tiktoken_cache(cache_dir):
+        logger.warning(
+            f"tiktoken cache directory '{cache_dir}' not found, encodings may be downloaded")
+
+    for encoding_name in encoding_names:
+        try:
+            get_encoding(encoding_name)
+            logger.info(f"Loaded tiktoken encoding {encoding_name}")
+        except Exception as error:
+            logger.error(f"Failed to load tiktoken encoding {encoding_name}: {error}")
+
+
+def get_encoding(encoding_name: str = DEFAULT_ENCODING) -> tiktoken.Encoding:
+    encoding = _encodings.get(encoding_name)
+    if encoding is None:
+        with _encodings_lock:
+            encoding = _encodings.get(encoding_name)
+            if encoding is None:
+                encoding = tiktoken.get_encoding(encoding_name)
+                _encodings[encoding_name] = encoding
+    return encoding
+
+
+def count_tokens(texts: Sequence[str], encoding_name: str = DEFAULT_ENCODING) -> List[int]:
+    """
+    Count tokens of each text.
+
+    Large inputs are encoded with tiktoken's batched encoder across worker threads.
+
+    Args:
+        texts: Texts to count.
+        encoding_name: tiktoken encoding used to count tokens.
+
+    Returns:
+        List[int]: Token count of each text, in input order.
+    """
+    encoding = get_encoding(encoding_name)
+    if len(texts) > 1 and sum(map(len, texts)) >= BATCH_ENCODE_MIN_CHARS:
+        encoded_texts = encoding.encode_ordinary_batch(
+            list(texts), num_threads=BATCH_ENCODE_THREADS)
+        return [len(tokens) for tokens in encoded_texts]
+
+    return [len(encoding.encode_ordinary(text)) for text in texts]
+
+
+if __name__ == '__main__':
+    # Download the encodings into TIKTOKEN_CACHE_DIR, e.g. before copying the project to an air-gapped machine
+    Path(TIKTOKEN_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+    use_tiktoken_cache()
+    for encoding_name in sys.argv[1:] or [DEFAULT_ENCODING]:
+        tiktoken.get_encoding(encoding_name)
+        print(f"Saved {encoding_name} to {TIKTOKEN_CACHE_DIR}")
@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, NamedTuple, Optional, Tuple
+
+import chainlit as cl
+
+from config import load_config
+from metrics import inc_counter
+
+# Reuse results of MCP tools listed in tool_cache of config/settings.toml; opt-in because only read-only tools may be cached
+TOOL_CACHE_ENABLED = os.getenv('TOOL_CACHE_ENABLED', '').lower() in ('1', 'true', 'yes')
+# Default seconds a tool result is reused
+TOOL_CACHE_TTL = float(os.getenv('TOOL_CACHE_TTL', '300'))
+# Default scope of cached results: session, or process to share them between all users
+TOOL_CACHE_SCOPE = os.getenv('TOOL_CACHE_SCOPE', 'session')
+# Maximum number of cached results per cache
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv('TOOL_CACHE_MAX_ENTRIES', '256'))
+
+SETTINGS_FILE = 'settings.toml'
+TOOL_CACHE_SETTINGS = 'tool_cache'
+TOOL_CACHE = 'tool_cache'
+SCOPES = ('session', 'process')
+
+logger = logging.getLogger(__name__)
+
+
+class ToolCachePolicy(NamedTuple):
+    ttl: float
+    scope: str
+
+
+def tool_cache_policy(tool_name: str) -> Optional[ToolCachePolicy]:
+    """
+    Caching settings of a tool, None for tools that are not cached.
+
+    Only tools listed in config/settings.toml are cached, with their TTL in
+    seconds or a table of TTL and scope:
+
+        [tool_cache]
+        "search" = 600
+        "fetch" = { ttl = 3600, scope = "process" }
+        "browser_snapshot" = true
+
+    Args:
+        tool_name: Exposed tool name.
+
+    Returns:
+        Optional[ToolCachePolicy]: TTL and scope, None if the tool is not cached.
+    """
+    if not TOOL_CACHE_ENABLED:
+        return None
+    setting = load_config(SETTINGS_FILE).get(TOOL_CACHE_SETTINGS, {}).get(tool_name)
+    if setting is None or setting is False:
+        return None
+    if setting is True:
+        setting = {}
+    elif not isinstance(setting, dict):
+        setting = {'ttl': setting}
+    scope = setting.get('scope', TOOL_CACHE_SCOPE)
+    if scope not in SCOPES:
+        logger.warning(f"Unknown tool cache scope {scope!r} for {tool_name}, using session")
+        scope = 'session'
+    return ToolCachePolicy(float(setting.get('ttl', TOOL_CACHE_TTL)), scope)
+
+
+def tool_cache_key(connection: str, tool_name: str, arguments: Dict[str, Any]) -> str:
+    # Arguments are serialized with sorted keys, so the order the model wrote them in does not matter
+    payload = json.dumps([connection, tool_name, arguments], sort_keys=True, separators=(',', ':'),
+                         ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _cacheable(result: Any) -> bool:
+    # Errors are retried on the next call
+    return not getattr(result, 'isError', False)
+
+
+class ToolCallCache:
+    """
+    LRU cache of tool results with a TTL per entry.
+
+    Identical calls running at the same time are collapsed: the first one
+    calls the tool and the others wait for its result. If that call is
+    cancelled, a waiting call makes the request itself.
+
+    Args:
+        max_entries: Maximum number of cached results.
+    """
+
+    def __init__(self, max_entries: int = TOOL_CACHE_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, Tuple[float, Any]] = OrderedDict()
+        self._pending: Dict[str, asyncio.Future] = {}
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: str, result: Any, ttl: float) -> None:
+        self._entries[key] = (time.monotonic() + ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def call(self, key: str, ttl: float, call_tool: Callable[[], Awaitable[Any]], tool_name: str = '') -> Any:
+        """
+        Return the cached result of a tool call, or call the tool once.
+
+        Args:
+            key: Key of the call, see tool_cache_key().
+            ttl: Seconds the result is reused.
+            call_tool: Function making the call.
+            tool_name: Tool name for metrics.
+
+        Returns:
+            Any: The tool result.
+        """
+        while True:
+            result = self.get(key)
+            if result is not None:
+                inc_counter('tool_cache_hits', tool=tool_name)
+                return result
+
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            try:
+                inc_counter('tool_cache_joined', tool=tool_name)
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # Only the call being waited for was cancelled, not this one: try again
+                if not pending.cancelled() or asyncio.current_task().cancelling():
+                    raise
+
+        inc_counter('tool_cache_misses', tool=tool_name)
+        pending = self._pending[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await call_tool()
+            if _cacheable(result):
+                self.put(key, result, ttl)
+            pending.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as error:
+            pending.set_exception(error)
+            # Waiters see the error, nobody else has to retrieve it
+            pending.exception()
+            raise
+        finally:
+            del self._pending[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+_process_tool_cache: Optional[ToolCallCache] = None
+
+
+def get_tool_cache(scope: str) -> ToolCallCache:
+    # Cache of the current session, or the one shared by all sessions of the process
+    global _process_tool_cache
+    if scope == 'process':
+        if _process_tool_cache is None:
+            _process_tool_cache = ToolCallCache()
+        return _process_tool_cache
+    cache = cl.user_session.get(TOOL_CACHE)
+    if cache is None:
+        cache = ToolCallCache()
+        cl.user_session.set(TOOL_CACHE, cache)
+    return cache
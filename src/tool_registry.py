@@ -0,0 +1,93 @@
+import re
+from typing import Any, Dict, List, NamedTuple, Optional
+
+import chainlit as cl
+
+TOOL_REGISTRY = 'tool_registry'
+
+
+class RegisteredTool(NamedTuple):
+    connection: str
+    name: str
+    schema: Dict[str, Any]
+
+
+def _function_name(name: str) -> str:
+    # OpenAI function names allow letters, digits, '_' and '-' only
+    return re.sub(r'[^a-zA-Z0-9_-]', '_', name)[:64]
+
+
+class ToolRegistry:
+    """
+    Index of the tools offered by the MCP connections of one session.
+
+    Tools are looked up by their exposed function name, and the OpenAI tools
+    payload is built once per change of connections. When several connections
+    offer a tool with the same name, the connection that sorts first keeps the
+    plain name and the others are exposed as '<connection>__<tool>'.
+    """
+
+    def __init__(self) -> None:
+        self._connection_tools: Dict[str, List[Dict[str, Any]]] = {}
+        self._tools: Dict[str, RegisteredTool] = {}
+        self._payload: Optional[List[Dict[str, Any]]] = None
+
+    def add_connection(self, connection: str, tools: List[Dict[str, Any]]) -> None:
+        self._connection_tools[connection] = tools
+        self._rebuild()
+
+    def remove_connection(self, connection: str) -> None:
+        if self._connection_tools.pop(connection, None) is not None:
+            self._rebuild()
+
+    def get(self, name: str) -> Optional[RegisteredTool]:
+        return self._tools.get(name)
+
+    def connections(self) -> List[str]:
+        return sorted(self._connection_tools)
+
+    def tools_payload(self) -> List[Dict[str, Any]]:
+        """
+        Return the tools of all connections in OpenAI function format.
+
+        Returns:
+            List[Dict[str, Any]]: Cached payload, rebuilt only when connections change.
+        """
+        if self._payload is None:
+            self._payload = [
+                {
+                    "type": "function",
+                    "function": {
+                        "name": exposed_name,
+                        "description": tool.schema['description'],
+                        "parameters": tool.schema['input_schema']
+                    }
+                }
+                for exposed_name, tool in self._tools.items()
+            ]
+        return self._payload
+
+    def _rebuild(self) -> None:
+        tools: Dict[str, RegisteredTool] = {}
+        for connection in sorted(self._connection_tools):
+            for schema in self._connection_tools[connection]:
+                exposed_name = _function_name(schema['name'])
+                if exposed_name in tools:
+                    exposed_name = _function_name(f"{connection}__{schema['name']}")
+                suffix = 2
+                base_name = exposed_name
+                while exposed_name in tools:
+                    exposed_name = f"{base_name[:61]}_{suffix}"
+                    suffix += 1
+                tools[exposed_name] = RegisteredTool(
+                    connection=connection, name=schema['name'], schema=schema)
+        self._tools = tools
+        self._payload = None
+
+
+def get_session_tool_registry() -> ToolRegistry:
+    registry = cl.user_session.get(TOOL_REGISTRY)
+    if registry is None:
+        registry = ToolRegistry()
+        cl.user_session.set(TOOL_REGISTRY, registry)
+    return registry
@@ -0,0 +1,333 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from html.parser import HTMLParser
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import chainlit as cl
+
+from config import load_config
+from metrics import inc_counter
+from token_utils import get_encoding
+
+# Token budget of a single tool result in the messages sent to the model
+TOOL_RESULT_MAX_TOKENS = int(os.getenv('TOOL_RESULT_MAX_TOKENS', '2048'))
+# Strategy for results over budget: prune, truncate, spill or none; see tool_results in config/settings.toml
+TOOL_RESULT_STRATEGY = os.getenv('TOOL_RESULT_STRATEGY', 'prune')
+# Bytes of spilled tool results kept per session
+TOOL_RESULT_STORE_BYTES = int(os.getenv('TOOL_RESULT_STORE_BYTES', str(16 * 1024 * 1024)))
+
+SETTINGS_FILE = 'settings.toml'
+TOOL_RESULT_SETTINGS = 'tool_results'
+TOOL_RESULT_STORE = 'tool_result_store'
+STRATEGIES = ('prune', 'truncate', 'spill', 'none')
+
+# Structural pruning: items kept of long lists, characters kept of long strings, in tightening rounds
+JSON_PRUNE_ROUNDS = ((20, 1000), (8, 300), (3, 120), (1, 60))
+JSON_MAX_DEPTH = 8
+# Elements whose content is dropped from HTML, and attributes that are kept
+HTML_DROPPED_ELEMENTS = {'script', 'style', 'svg', 'noscript', 'template', 'iframe', 'canvas', 'head'}
+HTML_KEPT_ATTRIBUTES = {'href', 'src', 'alt', 'title', 'name', 'id', 'role', 'aria-label', 'type', 'value'}
+HTML_VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'source', 'track', 'wbr'}
+# Characters read_tool_result returns at most per call
+READ_MAX_CHARS = TOOL_RESULT_MAX_TOKENS * 3
+# Part of the budget given to the start of a truncated result, the rest goes to its end
+TRUNCATE_HEAD_SHARE = 2 / 3
+# Tokens reserved for the notes added to compacted results
+NOTE_TOKENS = 64
+
+logger = logging.getLogger(__name__)
+
+
+READ_TOOL_RESULT_TOOL = {
+    "name": "read_tool_result",
+    "description": "Read part of a large tool result that was stored under a handle instead of being returned in full.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "handle": {"type": "string", "description": "Handle of the stored result, e.g. result_0123456789abcdef"},
+            "offset": {"type": "integer", "description": "Character offset to start reading at", "default": 0},
+            "length": {"type": "integer", "description": "Number of characters to read", "default": READ_MAX_CHARS}
+        },
+        "required": ["handle"]
+    },
+}
+
+
+class ToolResultPolicy(NamedTuple):
+    strategy: str
+    max_tokens: int
+
+
+def tool_result_policy(tool_name: str) -> ToolResultPolicy:
+    """
+    Compaction settings of a tool.
+
+    config/settings.toml can override the strategy, or strategy and budget, per tool:
+
+        [tool_results]
+        "browser_snapshot" = { strategy = "spill", max_tokens = 1024 }
+        "python_exec" = "truncate"
+
+    Args:
+        tool_name: Exposed tool name.
+
+    Returns:
+        ToolResultPolicy: Strategy and token budget.
+    """
+    if tool_name == READ_TOOL_RESULT_TOOL['name']:
+        # Pages of spilled results are already bounded, compacting them again would spill them again
+        return ToolResultPolicy('none', TOOL_RESULT_MAX_TOKENS)
+    setting = load_config(SETTINGS_FILE).get(TOOL_RESULT_SETTINGS, {}).get(tool_name)
+    if isinstance(setting, str):
+        setting = {'strategy': setting}
+    setting = setting or {}
+    strategy = setting.get('strategy', TOOL_RESULT_STRATEGY)
+    if strategy not in STRATEGIES:
+        logger.warning(f"Unknown tool result strategy {strategy!r} for {tool_name}, using truncate")
+        strategy = 'truncate'
+    return ToolResultPolicy(strategy, int(setting.get('max_tokens', TOOL_RESULT_MAX_TOKENS)))
+
+
+def spill_enabled() -> bool:
+    # Whether any tool spills its results, so the model needs read_tool_result
+    settings = load_config(SETTINGS_FILE).get(TOOL_RESULT_SETTINGS, {}).values()
+    return TOOL_RESULT_STRATEGY == 'spill' or any(
+        setting == 'spill' or (isinstance(setting, dict) and setting.get('strategy') == 'spill') for setting in settings)
+
+
+def tool_result_text(result: Any) -> str:
+    # Text of a local tool result or an MCP CallToolResult
+    if isinstance(result, str):
+        return result
+    content = getattr(result, 'content', None)
+    if content is None:
+        return str(result)
+    parts = [item.text if getattr(item, 'type', None) == 'text' else f"[{getattr(item, 'type', 'binary')} content]"
+             for item in content]
+    structured = getattr(result, 'structuredContent', None)
+    if structured and not any(getattr(item, 'type', None) == 'text' for item in content):
+        parts.append(json.dumps(structured, ensure_ascii=False))
+    text = '\n'.join(parts)
+    return json.dumps({"error": text}) if getattr(result, 'isError', False) else text
+
+
+def count_text_tokens(text: str) -> int:
+    return len(get_encoding().encode_ordinary(text))
+
+
+def truncate_middle(text: str, max_tokens: int) -> str:
+    """
+    Keep the start and the end of a text within a token budget.
+
+    Args:
+        text: Text to truncate.
+        max_tokens: Token budget, including the omission note.
+
+    Returns:
+        str: The text, or its head and tail around a note of the omitted tokens.
+    """
+    encoding = get_encoding()
+    tokens = encoding.encode_ordinary(text)
+    if len(tokens) <= max_tokens:
+        return text
+    kept = max(0, max_tokens - NOTE_TOKENS)
+    head = int(kept * TRUNCATE_HEAD_SHARE)
+    tail = kept - head
+    omitted = len(tokens) - head - tail
+    return (encoding.decode(tokens[:head])
+            + f"\n[... {omitted} tokens omitted ...]\n"
+            + (encoding.decode(tokens[-tail:]) if tail else ''))
+
+
+def _prune_json_value(value: Any, list_items: int, string_chars: int, depth: int = 0) -> Any:
+    if isinstance(value, str):
+        return value if len(value) <= string_chars else f"{value[:string_chars]}... ({len(value)} chars)"
+    if isinstance(value, list):
+        if depth >= JSON_MAX_DEPTH:
+            return f"[{len(value)} items]"
+        pruned = [_prune_json_value(item, list_items, string_chars, depth + 1) for item in value[:list_items]]
+        if len(value) > list_items:
+            pruned.append(f"... {len(value) - list_items} more items")
+        return pruned
+    if isinstance(value, dict):
+        if depth >= JSON_MAX_DEPTH:
+            return f"{{{len(value)} keys}}"
+        return {key: _prune_json_value(item, list_items, string_chars, depth + 1) for key, item in value.items()}
+    return value
+
+
+class _HTMLPruner(HTMLParser):
+    # Rebuild HTML without scripts, styles, comments and presentational attributes
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._dropped_depth = 0
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if tag in HTML_DROPPED_ELEMENTS:
+            if tag not in HTML_VOID_ELEMENTS:
+                self._dropped_depth += 1
+            return
+        if self._dropped_depth:
+            return
+        kept = ''.join(f' {name}="{value}"' for name, value in attrs
+                       if name in HTML_KEPT_ATTRIBUTES and value and not value.startswith('data:'))
+        self.parts.append(f'<{tag}{kept}>')
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag in HTML_DROPPED_ELEMENTS:
+            self._dropped_depth = max(0, self._dropped_depth - 1)
+        elif not self._dropped_depth and tag not in HTML_VOID_ELEMENTS:
+            self.parts.append(f'</{tag}>')
+
+    def handle_data(self, data: str) -> None:
+        if not self._dropped_depth and data.strip():
+            self.parts.append(' '.join(data.split()))
+
+
+def prune_structure(text: str, max_tokens: int) -> str:
+    """
+    Shrink JSON, HTML or plain text without cutting it off.
+
+    JSON is re-serialized compactly with long lists and strings shortened,
+    tightening until it fits the budget. HTML loses scripts, styles, comments
+    and attributes other than links, labels and ids. Other text loses
+    repeated blank lines and trailing spaces.
+
+    Args:
+        text: Tool result text.
+        max_tokens: Token budget.
+
+    Returns:
+        str: The pruned text, which may still exceed the budget.
+    """
+    stripped = text.strip()
+    if stripped[:1] in ('{', '['):
+        try:
+            value = json.loads(stripped)
+        except ValueError:
+            value = None
+        if value is not None:
+            pruned = json.dumps(value, ensure_ascii=False, separators=(',', ':'))
+            for list_items, string_chars in JSON_PRUNE_ROUNDS:
+                if count_text_tokens(pruned) <= max_tokens:
+                    break
+                pruned = json.dumps(_prune_json_value(value, list_items, string_chars),
+                                    ensure_ascii=False, separators=(',', ':'))
+            return pruned
+    if stripped[:1] == '<' and re.search(r'<(html|body|div|p|a|span|table|ul|!doctype)\b', stripped[:2000], re.IGNORECASE):
+        pruner = _HTMLPruner()
+        pruner.feed(stripped)
+        pruner.close()
+        return ''.join(pruner.parts)
+    return re.sub(r'\n\s*\n+', '\n\n', re.sub(r'[ \t]+\n', '\n', stripped))
+
+
+class ToolResultStore:
+    """
+    Full tool results that were too large for the prompt, readable by handle.
+
+    Handles are derived from the content, so the same result is stored once.
+    The least recently stored results are dropped beyond max_bytes.
+
+    Args:
+        max_bytes: Maximum total size of the stored results.
+    """
+
+    def __init__(self, max_bytes: int = TOOL_RESULT_STORE_BYTES) -> None:
+        self.max_bytes = max_bytes
+        self._results: OrderedDict[str, str] = OrderedDict()
+        self._bytes = 0
+
+    def put(self, text: str) -> str:
+        handle = 'result_' + hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+        if handle in self._results:
+            self._results.move_to_end(handle)
+            return handle
+        self._results[handle] = text
+        self._bytes += len(text)
+        while len(self._results) > 1 and self._bytes > self.max_bytes:
+            _, dropped = self._results.popitem(last=False)
+            self._bytes -= len(dropped)
+        return handle
+
+    def get(self, handle: str) -> Optional[str]:
+        return self._results.get(handle)
+
+
+def get_session_tool_result_store() -> ToolResultStore:
+    store = cl.user_session.get(TOOL_RESULT_STORE)
+    if store is None:
+        store = ToolResultStore()
+        cl.user_session.set(TOOL_RESULT_STORE, store)
+    return store
+
+
+def compact_tool_result(tool_name: str, text: str, policy: ToolResultPolicy,
+                        store: Optional[ToolResultStore] = None) -> str:
+    """
+    Bring a tool result within its token budget.
+
+    - prune: prune_structure(), then head and tail truncation if still too large
+    - truncate: head and tail truncation
+    - spill: store the full result and send a pruned preview with its handle,
+      which the read_tool_result tool reads back in pages
+    - none: send the result as is
+
+    Args:
+        tool_name: Exposed tool name, for logging and metrics.
+        text: Tool result text.
+        policy: Strategy and token budget.
+        store: Store of spilled results, required for spill.
+
+    Returns:
+        str: The result to put into the tool message.
+    """
+    # A token covers at least one byte, so short results skip tokenizing
+    if policy.strategy == 'none' or len(text.encode('utf-8')) <= policy.max_tokens:
+        return text
+    tokens = count_text_tokens(text)
+    if tokens <= policy.max_tokens:
+        return text
+
+    if policy.strategy == 'spill' and store is not None:
+        handle = store.put(text)
+        note = (f"\n[Full result of {tokens} tokens ({len(text)} characters) stored as {handle}. "
+                f"Call read_tool_result with this handle and a character offset to read it.]")
+        preview_tokens = max(0, policy.max_tokens - count_text_tokens(note))
+        compacted = truncate_middle(prune_structure(text, preview_tokens), preview_tokens) + note
+    elif policy.strategy == 'prune' or policy.strategy == 'spill':
+        compacted = truncate_middle(prune_structure(text, policy.max_tokens), policy.max_tokens)
+    else:
+        compacted = truncate_middle(text, policy.max_tokens)
+
+    compacted_tokens = count_text_tokens(compacted)
+    inc_counter('tool_results_compacted', tool=tool_name, strategy=policy.strategy)
+    inc_counter('tool_result_tokens_saved', tokens - compacted_tokens, tool=tool_name)
+    logger.info(f"Compacted {tool_name} result from {tokens} to {compacted_tokens} tokens with {policy.strategy}")
+    return compacted
+
+
+def read_tool_result(store: ToolResultStore, arguments: Dict[str, Any]) -> str:
+    """
+    Read a page of a spilled tool result.
+
+    Args:
+        store: Store of the session's spilled results.
+        arguments: handle, and optionally the character offset and length.
+
+    Returns:
+        str: The page with its position in the result, or an error.
+    """
+    text = store.get(str(arguments.get('handle', '')))
+    if text is None:
+        return json.dumps({"error": f"No stored tool result {arguments.get('handle')}"})
+    offset = max(0, int(arguments.get('offset') or 0))
+    length = min(READ_MAX_CHARS, max(1, int(arguments.get('length') or READ_MAX_CHARS)))
+    end = min(len(text), offset + length)
+    return f"[Characters {offset}-{end} of {len(text)}]\n{text[offset:end]}"
+
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from metrics import observe, span
+from ollama_pool import OLLAMA_PROVIDER_PREFIX, OllamaNode, OllamaPool, get_ollama_pool
+from scheduler import PRIORITY_BATCH, get_request_scheduler
+
+# Preload the selected model when a chat starts or the model is changed
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+# Ollama keep_alive of models without recent activity (Ollama's own default)
+WARMUP_KEEP_ALIVE_IDLE = os.getenv('WARMUP_KEEP_ALIVE_IDLE', '5m')
+# Ollama keep_alive of models used by a session within the activity window
+WARMUP_KEEP_ALIVE_ACTIVE = os.getenv('WARMUP_KEEP_ALIVE_ACTIVE', '30m')
+# Seconds a message keeps its session counted as active for the model
+WARMUP_ACTIVITY_WINDOW = float(os.getenv('WARMUP_ACTIVITY_WINDOW', '900'))
+# Seconds a preload may take, large models can take minutes to load
+WARMUP_TIMEOUT = float(os.getenv('WARMUP_TIMEOUT', '300'))
+
+logger = logging.getLogger(__name__)
+
+
+class WarmupManager:
+    """
+    Preload Ollama models and keep them loaded while sessions use them.
+
+    A preload is an empty /api/generate request, which makes Ollama load the
+    model without generating. Chat requests reset a model's keep_alive to
+    Ollama's default, so after each message of an active session the keep_alive
+    is raised again to WARMUP_KEEP_ALIVE_ACTIVE; without recent activity Ollama
+    unloads the model after its default idle time. Requests for the same node
+    and model share one in-flight task and wait for a batch slot of the
+    request scheduler, behind interactive requests.
+
+    Args:
+        pool: Ollama nodes to warm, defaults to the process-wide pool.
+        keep_alive_idle: keep_alive without recent activity.
+        keep_alive_active: keep_alive while sessions are active.
+        activity_window: Seconds a message keeps its session active.
+    """
+
+    def __init__(
+        self,
+        pool: Optional[OllamaPool] = None,
+        keep_alive_idle: str = WARMUP_KEEP_ALIVE_IDLE,
+        keep_alive_active: str = WARMUP_KEEP_ALIVE_ACTIVE,
+        activity_window: float = WARMUP_ACTIVITY_WINDOW
+    ) -> None:
+        self._pool = pool
+        self.keep_alive_idle = keep_alive_idle
+        self.keep_alive_active = keep_alive_active
+        self.activity_window = activity_window
+        self._activity: Dict[str, Dict[str, float]] = {}
+        self._tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    @property
+    def pool(self) -> OllamaPool:
+        return self._pool or get_ollama_pool()
+
+    def note_activity(self, model: str, session: str) -> None:
+        self._activity.setdefault(model, {})[session] = time.monotonic()
+
+    def active_sessions(self, model: str) -> int:
+        sessions = self._activity.get(model, {})
+        cutoff = time.monotonic() - self.activity_window
+        for session in [session for session, last in sessions.items() if last < cutoff]:
+            del sessions[session]
+        return len(sessions)
+
+    def keep_alive(self, model: str) -> str:
+        return self.keep_alive_active if self.active_sessions(model) else self.keep_alive_idle
+
+    def warm(self, model: str, session: str = '') -> Optional[asyncio.Task]:
+        """
+        Load a model in the background.
+
+        Args:
+            model: Ollama model name.
+            session: Session that selected the model, counted as activity.
+
+        Returns:
+            Optional[asyncio.Task]: The preload task, None if no node is available.
+        """
+        self.note_activity(model, session)
+        node = self.pool.pick(model)
+        if node is None:
+            return None
+        return self._schedule(node, model, session)
+
+    def touch(self, model: str, session: str = '') -> List[asyncio.Task]:
+        """
+        Record a message and extend the keep_alive on the nodes that have the model loaded.
+
+        Args:
+            model: Ollama model name.
+            session: Session that sent the message.
+
+        Returns:
+            List[asyncio.Task]: keep_alive refresh tasks, empty while the model is idle.
+        """
+        self.note_activity(model, session)
+        if self.keep_alive(model) == self.keep_alive_idle:
+            return []
+        return [self._schedule(node, model, session) for node in self.pool.nodes
+                if node.healthy and node.is_loaded(model)]
+
+    def _schedule(self, node: OllamaNode, model: str, session: str) -> asyncio.Task:
+        key = (node.url, model)
+        task = self._tasks.get(key)
+        if task is None or task.done():
+            task = self._tasks[key] = asyncio.create_task(self._load(node, model, session))
+        return task
+
+    async def _load(self, node: OllamaNode, model: str, session: str) -> None:
+        try:
+            # Same backend and model key as chat requests, so per-model limits cover warm-ups
+            async with get_request_scheduler().slot(
+                backend=node.url, model=f'{OLLAMA_PROVIDER_PREFIX}{model}',
+                session=session, priority=PRIORITY_BATCH
+            ):
+                keep_alive = self.keep_alive(model)
+                cold = not node.is_loaded(model)
+                with span('model_warmup', model=model):
+                    async with httpx.AsyncClient(timeout=WARMUP_TIMEOUT) as client:
+                        response = await client.post(
+                            f'{node.url}/api/generate', json={'model': model, 'keep_alive': keep_alive})
+                        response.raise_for_status()
+                        load_seconds = response.json().get('load_duration', 0) / 1e9
+                        node.loaded_models.add(model)
+        except (httpx.HTTPError, ValueError) as error:
+            logger.warning(f"Warm-up of {model} on {node.url} failed: {error!r}")
+            return
+
+        if cold:
+            observe('model_load', load_seconds, model=model)
+            logger.info(f"Preloaded {model} on {node.url} in {load_seconds:.3f}s, keep_alive {keep_alive}")
+        else:
+            logger.debug(f"Extended keep_alive of {model} on {node.url} to {keep_alive}")
+
+    async def close(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+
+_warmup_manager: Optional[WarmupManager] = None
+
+
+def get_warmup_manager() -> WarmupManager:
+    global _warmup_manager
+    if _warmup_manager is None:
+        _warmup_manager = WarmupManager()
+    return _warmup_manager
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import tiktoken
+import tiktoken.registry
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / 'src'))
+
+from token_utils import DEFAULT_ENCODING  # noqa: E402
+
+ENDOFTEXT = '<|endoftext|>'
+
+
+def _offline_encoding(name: str) -> tiktoken.Encoding:
+    # One token per byte: token counts differ from o200k_base, the code paths using them do not
+    return tiktoken.Encoding(
+        name=name, pat_str=r"""\S+|\s+""",
+        mergeable_ranks={bytes([byte]): byte for byte in range(256)},
+        special_tokens={ENDOFTEXT: 256})
+
+
+try:
+    # Read from data/tiktoken, see token_utils.TIKTOKEN_CACHE_DIR, or downloaded
+    tiktoken.get_encoding(DEFAULT_ENCODING)
+except Exception as error:
+    print(f"Using a byte-level stand-in for {DEFAULT_ENCODING}: {error!r}", file=sys.stderr)
+    tiktoken.registry.ENCODINGS[DEFAULT_ENCODING] = _offline_encoding(DEFAULT_ENCODING)
@@ -1,7 +1,29 @@
-import pytest
+import asyncio
+import json
 
-from agent_helper import llm_completion
+import httpx
+import pytest
 from any_llm import ProviderName
+from any_llm.types.completion import ChatCompletion, ChatCompletionChunk, ChatCompletionMessageFunctionToolCall
+from chainlit.context import init_http_context
+
+import agent_helper
+from agent_helper import accumulate_tool_call_deltas, agent_runner, build_tool_calls, call_tools, llm_completion
+from local_tools import LOCAL_TOOL_HANDLERS, LOCAL_TOOLS_CONNECTION
+from ollama_pool import OLLAMA_API_BASE
+from scheduler import RequestScheduler
+from tool_registry import get_session_tool_registry
+
+
+def ollama_has_model(model: str) -> bool:
+    try:
+        response = httpx.get(f'{OLLAMA_API_BASE}/api/tags', timeout=1)
+        return any(entry.get('name') == model for entry in response.json().get('models', []))
+    except (httpx.HTTPError, ValueError):
+        return False
+
+
+requires_gpt_oss = pytest.mark.skipif(not ollama_has_model('gpt-oss:20b'), reason='needs Ollama with gpt-oss:20b')
 
 
 @pytest.mark.asyncio
@@ -94,3 +116,240 @@ async def test_llm_completion_live_tool_use_stream_gpt_oss_20b():
     assert len(chunks) > 0, "Should receive at least one chunk"
     assert tool_calls, "Should include a tool call in streamed output"
     assert tool_calls[0].function.name == 'get_stock_price', "Wrong function name"
+
+
+@requires_gpt_oss
+@pytest.mark.asyncio
+async def test_agent_runner_live_stream_gpt_oss_20b():
+    model = f"{ProviderName.OLLAMA}:gpt-oss:20b"
+    messages = [{"role": "user", "content": "hello"}]
+
+    chunks = [chunk async for chunk in agent_runner(model=model, messages=messages)]
+
+    assert len(chunks) > 0, "Should receive at least one chunk"
+    assert chunks[-1].choices[0].finish_reason == 'stop', "Last chunk should finish the response"
+
+
+def _chunk(content):
+    return ChatCompletionChunk.model_validate({
+        'id': '1', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'm',
+        'choices': [{'index': 0, 'delta': {'content': content}, 'finish_reason': None}]})
+
+
+@pytest.mark.asyncio
+async def test_agent_runner_close_ends_model_stream_and_frees_slot(monkeypatch):
+    closed = asyncio.Event()
+
+    async def fake_llm_completion(model, messages, tools=None, api_base=None, stream=True):
+        async def stream_chunks():
+            try:
+                for index in range(1000):
+                    yield _chunk(f'token {index}')
+                    await asyncio.sleep(0)
+            finally:
+                closed.set()
+        return stream_chunks()
+
+    monkeypatch.setattr(agent_helper, 'llm_completion', fake_llm_completion)
+    scheduler = RequestScheduler()
+    monkeypatch.setattr(agent_helper, 'get_request_scheduler', lambda: scheduler)
+
+    runner = agent_runner('ollama:m', [{'role': 'user', 'content': 'hello'}], api_base='http://node')
+    first = await runner.__anext__()
+    assert first.choices[0].delta.content == 'token 0'
+    assert scheduler.active('http://node') == 1
+
+    await runner.aclose()
+    assert closed.is_set()
+    assert scheduler.active('http://node') == 0
+
+
+@pytest.mark.asyncio
+async def test_call_tools_cancellation_cancels_running_tools(monkeypatch):
+    init_http_context()
+    started = asyncio.Event()
+    cancelled = asyncio.Event()
+
+    async def slow_tool(arguments):
+        started.set()
+        try:
+            await asyncio.sleep(60)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+        return 'done'
+
+    monkeypatch.setitem(LOCAL_TOOL_HANDLERS, 'slow_tool', slow_tool)
+    get_session_tool_registry().add_connection(LOCAL_TOOLS_CONNECTION, [
+        {'name': 'slow_tool', 'description': 'Sleeps', 'input_schema': {'type': 'object'}}])
+    tool_call = ChatCompletionMessageFunctionToolCall.model_validate({
+        'id': 'call_1', 'type': 'function', 'function': {'name': 'slow_tool', 'arguments': '{}'}})
+
+    task = asyncio.create_task(call_tools([tool_call]))
+    await asyncio.wait_for(started.wait(), timeout=5)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert cancelled.is_set()
+
+
+def make_tool_call(call_id: str, name: str, arguments: str) -> ChatCompletionMessageFunctionToolCall:
+    return ChatCompletionMessageFunctionToolCall.model_validate({
+        'id': call_id, 'type': 'function', 'function': {'name': name, 'arguments': arguments}})
+
+
+def register_local_tools(monkeypatch, **handlers) -> None:
+    for name, handler in handlers.items():
+        monkeypatch.setitem(LOCAL_TOOL_HANDLERS, name, handler)
+    get_session_tool_registry().add_connection(LOCAL_TOOLS_CONNECTION, [
+        {'name': name, 'description': name, 'input_schema': {'type': 'object'}} for name in handlers])
+
+
+@pytest.mark.asyncio
+async def test_call_tools_keeps_call_order(monkeypatch):
+    init_http_context()
+
+    async def echo(arguments):
+        # Later calls finish first
+        await asyncio.sleep(0.01 * (3 - arguments['n']))
+        return f"result {arguments['n']}"
+
+    register_local_tools(monkeypatch, echo=echo)
+    results = await call_tools([make_tool_call(f'call_{n}', 'echo', f'{{"n": {n}}}') for n in range(3)])
+    assert [result['tool_call_id'] for result in results] == ['call_0', 'call_1', 'call_2']
+    assert [result['content'] for result in results] == ['result 0', 'result 1', 'result 2']
+
+
+@pytest.mark.asyncio
+async def test_call_tools_limits_concurrency(monkeypatch):
+    init_http_context()
+    agent_helper.cl.user_session.set('tool_concurrency', 2)
+    running = []
+    peak = []
+
+    async def busy(arguments):
+        running.append(1)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.pop()
+        return 'done'
+
+    register_local_tools(monkeypatch, busy=busy)
+    results = await call_tools([make_tool_call(f'call_{n}', 'busy', '{}') for n in range(6)])
+    assert [result['content'] for result in results] == ['done'] * 6
+    assert max(peak) == 2
+
+
+@pytest.mark.asyncio
+async def test_call_tools_reports_timeouts_and_bad_arguments_per_call(monkeypatch):
+    init_http_context()
+
+    async def slow(arguments):
+        await asyncio.sleep(60)
+
+    async def fast(arguments):
+        return 'fast result'
+
+    register_local_tools(monkeypatch, slow=slow, fast=fast)
+    results = await call_tools([
+        make_tool_call('call_slow', 'slow', '{}'),
+        make_tool_call('call_bad', 'fast', '{"a": '),
+        make_tool_call('call_fast', 'fast', '{}'),
+    ], timeout=0.05)
+
+    assert 'timed out after 0.05 seconds' in json.loads(results[0]['content'])['error']
+    assert json.loads(results[1]['content'])['error'].startswith('Invalid arguments for tool fast')
+    assert results[2]['content'] == 'fast result'
+
+
+def _tool_call_chunk(index, call_id=None, name=None, arguments=None):
+    function = {key: value for key, value in (('name', name), ('arguments', arguments)) if value is not None}
+    tool_call = {'index': index, 'function': function}
+    if call_id:
+        tool_call.update(id=call_id, type='function')
+    return ChatCompletionChunk.model_validate({
+        'id': '1', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'm',
+        'choices': [{'index': 0, 'delta': {'tool_calls': [tool_call]}, 'finish_reason': None}]})
+
+
+def _finish_chunk(reason):
+    return ChatCompletionChunk.model_validate({
+        'id': '1', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'm',
+        'choices': [{'index': 0, 'delta': {}, 'finish_reason': reason}]})
+
+
+def _assemble(chunks):
+    tool_calls, indexes = {}, {}
+    for chunk in chunks:
+        accumulate_tool_call_deltas(tool_calls, chunk.choices[0].delta.tool_calls, indexes)
+    return [(call.id, call.function.name, call.function.arguments) for call in build_tool_calls(tool_calls)]
+
+
+def test_tool_call_deltas_are_assembled_per_index():
+    assert _assemble([
+        _tool_call_chunk(0, 'call_a', 'search', '{"query": '),
+        _tool_call_chunk(1, 'call_b', 'fetch', '{"url": "x"}'),
+        _tool_call_chunk(0, arguments='"ollama"}'),
+    ]) == [('call_a', 'search', '{"query": "ollama"}'), ('call_b', 'fetch', '{"url": "x"}')]
+
+
+def test_reused_delta_index_continues_the_new_tool_call():
+    assert _assemble([
+        _tool_call_chunk(0, 'call_a', 'search', '{"query": '),
+        _tool_call_chunk(0, arguments='"a"}'),
+        _tool_call_chunk(0, 'call_b', 'fetch', '{"url": '),
+        _tool_call_chunk(0, arguments='"b"}'),
+    ]) == [('call_a', 'search', '{"query": "a"}'), ('call_b', 'fetch', '{"url": "b"}')]
+
+
+@pytest.mark.asyncio
+async def test_agent_runner_runs_tools_and_answers_offline(monkeypatch):
+    init_http_context()
+
+    async def lookup(arguments):
+        return f"price of {arguments['ticker']} is 42"
+
+    register_local_tools(monkeypatch, lookup=lookup)
+    requests = []
+
+    async def fake_llm_completion(model, messages, tools=None, api_base=None, stream=True):
+        requests.append((list(messages), tools))
+
+        async def stream_chunks():
+            if len(requests) == 1:
+                yield _tool_call_chunk(0, 'call_1', 'lookup', '{"ticker": ')
+                yield _tool_call_chunk(0, arguments='"ACME"}')
+                yield _finish_chunk('tool_calls')
+            else:
+                yield _chunk('ACME costs 42')
+                yield _finish_chunk('stop')
+        return stream_chunks()
+
+    monkeypatch.setattr(agent_helper, 'llm_completion', fake_llm_completion)
+    tools = get_session_tool_registry().tools_payload()
+    messages = [{'role': 'user', 'content': 'price of ACME?'}]
+
+    chunks = [chunk async for chunk in agent_runner('ollama:m', messages, tools=tools, api_base='http://node')]
+
+    assert [chunk.choices[0].delta.content for chunk in chunks] == ['ACME costs 42', None]
+    assert chunks[-1].choices[0].finish_reason == 'stop'
+    assert len(requests) == 2
+    assert messages[1]['tool_calls'][0]['function'] == {'name': 'lookup', 'arguments': '{"ticker": "ACME"}'}
+    assert messages[2] == {'role': 'tool', 'tool_call_id': 'call_1', 'name': 'lookup', 'content': 'price of ACME is 42'}
+
+
+@pytest.mark.asyncio
+async def test_final_turn_without_tools_sends_no_tools(monkeypatch):
+    sent = []
+
+    async def fake_acompletion(**kwargs):
+        sent.append(kwargs)
+        return ChatCompletion.model_validate({
+            'id': '1', 'object': 'chat.completion', 'created': 0, 'model': 'm',
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': 'done'}, 'finish_reason': 'stop'}]})
+
+    monkeypatch.setattr(agent_helper, 'acompletion', fake_acompletion)
+    response = await llm_completion(model='ollama:m', messages=[{'role': 'user', 'content': 'hi'}],
+                                    tools=None, api_base='http://node', stream=False)
+    assert response.choices[0].message.content == 'done'
+    assert sent[0]['tools'] is None
@@ -0,0 +1,136 @@
+import asyncio
+from types import SimpleNamespace
+
+import chainlit as cl
+import pytest
+from chainlit.context import init_http_context
+from chainlit.user_session import user_sessions
+
+import app_helper
+from app_helper import LONG_INPUT_SUMMARY, append_message_to_session_history, end_session_after_disconnect
+
+
+async def running_task() -> asyncio.Task:
+    task = asyncio.create_task(asyncio.sleep(60))
+    await asyncio.sleep(0)
+    return task
+
+
+@pytest.mark.asyncio
+async def test_closed_tab_stops_the_answer_at_once():
+    session = SimpleNamespace(id='s', socket_id='sock1', to_clear=True, current_task=await running_task())
+    end_session_after_disconnect(session, grace=60)
+    await asyncio.sleep(0)
+    assert session.current_task.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_answer_survives_a_reconnect_within_the_grace_period():
+    session = SimpleNamespace(id='s', socket_id='sock1', to_clear=False, current_task=await running_task())
+    end_session_after_disconnect(session, grace=0.05)
+    session.socket_id = 'sock2'
+    await asyncio.sleep(0.1)
+    assert not session.current_task.done()
+    session.current_task.cancel()
+
+
+@pytest.mark.asyncio
+async def test_answer_is_stopped_when_the_session_does_not_reconnect():
+    session = SimpleNamespace(id='s', socket_id='sock1', to_clear=False, current_task=await running_task())
+    end_session_after_disconnect(session, grace=0.05)
+    await asyncio.sleep(0)
+    assert not session.current_task.done()
+    await asyncio.sleep(0.1)
+    assert session.current_task.cancelled()
+
+
+class FakeDocumentIndex:
+    deleted = False
+
+    def delete(self) -> None:
+        self.deleted = True
+
+
+@pytest.mark.asyncio
+async def test_documents_are_removed_only_when_the_session_ends(monkeypatch):
+    documents = FakeDocumentIndex()
+    monkeypatch.setitem(user_sessions, 's', {app_helper.DOCUMENT_INDEX: documents})
+    session = SimpleNamespace(id='s', socket_id='sock1', to_clear=False, current_task=None)
+
+    end_session_after_disconnect(session, grace=0.05)
+    session.socket_id = 'sock2'
+    await asyncio.sleep(0.1)
+    assert not documents.deleted
+
+    end_session_after_disconnect(session, grace=0.05)
+    await asyncio.sleep(0.1)
+    assert documents.deleted
+    assert app_helper.DOCUMENT_INDEX not in user_sessions['s']
+
+
+@pytest.mark.asyncio
+async def test_documents_of_a_closed_tab_are_removed_after_its_task_stops(monkeypatch):
+    documents = FakeDocumentIndex()
+    monkeypatch.setitem(user_sessions, 's', {app_helper.DOCUMENT_INDEX: documents})
+    session = SimpleNamespace(id='s', socket_id='sock1', to_clear=True, current_task=await running_task())
+
+    end_session_after_disconnect(session)
+    # Chainlit drops the user session right after on_chat_end
+    user_sessions.pop('s')
+    assert not documents.deleted
+    await asyncio.wait([session.current_task])
+    assert session.current_task.cancelled() and documents.deleted
+
+
+@pytest.fixture
+def packed_chunks(monkeypatch):
+    # Chunks of a long message, recording how many were packed
+    packed = []
+
+    def iter_merged_sentences(sentences):
+        for index in range(5):
+            packed.append(index)
+            yield f'chunk {index}. '
+
+    monkeypatch.setattr(app_helper, 'iter_merged_sentences', iter_merged_sentences)
+    monkeypatch.setattr(cl.chat_context, 'to_openai', lambda: [{'role': 'user', 'content': 'long'}])
+    return packed
+
+
+@pytest.mark.asyncio
+async def test_long_message_is_sent_in_chunks_without_summarizer(packed_chunks):
+    init_http_context()
+    messages = await append_message_to_session_history('long')
+    assert [message['content'] for message in messages] == [f'chunk {index}. ' for index in range(5)]
+
+
+@pytest.mark.asyncio
+async def test_summarized_message_is_not_packed_beyond_two_chunks(packed_chunks, monkeypatch):
+    init_http_context()
+    summarizer = SimpleNamespace(cached=lambda content: None)
+
+    async def summarize_long_message(summarizer, message):
+        return f'{LONG_INPUT_SUMMARY}\n\nsummary'
+
+    monkeypatch.setattr(app_helper, 'SUMMARIZE_LONG_INPUTS', True)
+    monkeypatch.setattr(app_helper, 'get_summarizer', lambda model: summarizer)
+    monkeypatch.setattr(app_helper, 'summarize_long_message', summarize_long_message)
+    monkeypatch.setattr(app_helper, 'get_session_context_window', lambda model: SimpleNamespace(fit=list))
+
+    messages = await append_message_to_session_history('long', model='llama3')
+    assert messages == [{'role': 'user', 'content': f'{LONG_INPUT_SUMMARY}\n\nsummary'}]
+    assert packed_chunks == [0, 1]
+
+
+@pytest.mark.asyncio
+async def test_long_question_gets_document_context(packed_chunks, monkeypatch):
+    init_http_context()
+    cl.user_session.set(app_helper.DOCUMENT_INDEX, FakeDocumentIndex())
+
+    async def add_document_context(document_index, query):
+        return f'context for {query}'
+
+    monkeypatch.setattr(app_helper, 'add_document_context', add_document_context)
+
+    messages = await append_message_to_session_history('long')
+    assert [message['content'] for message in messages][-2:] == ['chunk 3. ', 'context for chunk 4. ']
@@ -0,0 +1,43 @@
+from context_window import ContextWindow
+
+
+def make_history(turns: int) -> list:
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"Question {turn}: " + "word " * 40})
+        messages.append({"role": "assistant", "content": f"Answer {turn}: " + "word " * 40})
+    return messages
+
+
+def test_fit_keeps_history_within_budget() -> None:
+    messages = make_history(3)
+    assert ContextWindow(budget=100_000).fit(messages) is messages
+
+
+def make_window(messages: list, budget_messages: int) -> ContextWindow:
+    # Budget that fits the system prompt and about budget_messages history messages
+    token_counts = ContextWindow().count_message_tokens(messages)
+    return ContextWindow(budget=token_counts[0] + max(token_counts) * budget_messages, keep_recent=2)
+
+
+def test_fit_trims_oldest_turns_and_pins_system_and_recent() -> None:
+    messages = make_history(20)
+    window = make_window(messages, budget_messages=8)
+    fitted = window.fit(messages)
+
+    assert fitted[0] == messages[0]
+    assert fitted[1]['role'] == 'system' and 'omitted' in fitted[1]['content']
+    assert fitted[2]['role'] == 'user'
+    assert fitted[-2:] == messages[-2:]
+    assert sum(window.count_message_tokens(fitted)) <= window.budget
+
+
+def test_fit_keeps_prefix_stable_until_next_overflow() -> None:
+    messages = make_history(20)
+    window = make_window(messages, budget_messages=8)
+    fitted = window.fit(messages)
+
+    messages.append({"role": "user", "content": "Short follow-up"})
+    refitted = window.fit(messages)
+    assert refitted[:len(fitted)] == fitted
+    assert refitted[-1] == messages[-1]
@@ -0,0 +1,121 @@
+import functools
+import json
+from typing import List
+
+import httpx
+import numpy as np
+import pytest
+
+import document_index
+from document_index import DocumentIndex, OllamaEmbedder, VectorIndex, iter_document_chunks
+from ollama_pool import OllamaPool
+from token_utils import get_encoding
+
+WORDS = ['tower', 'paris', 'river', 'bread', 'engine', 'orbit']
+
+
+class WordEmbedder:
+    # Counts the known words of each text, so texts sharing words are similar
+    model = 'test-embed'
+
+    def __init__(self) -> None:
+        self.batches: List[List[str]] = []
+
+    async def embed(self, texts: List[str], session: str = '', priority: int = 0) -> np.ndarray:
+        self.batches.append(texts)
+        return np.array([[text.lower().count(word) for word in WORDS] for text in texts], dtype=np.float32)
+
+
+def test_vector_index_returns_top_k_by_cosine_similarity(tmp_path) -> None:
+    index = VectorIndex(tmp_path / 'index')
+    index.add(np.array([[1, 0, 0], [0, 1, 0], [1, 1, 0]]), ['x', 'y', 'xy'], 'a.txt')
+    index.add(np.array([[0, 0, 3]]), ['z'], 'b.txt')
+
+    hits = index.search(np.array([2, 1, 0]), top_k=2)
+    assert [hit.text for hit in hits] == ['xy', 'x']
+    assert hits[0].score == pytest.approx(3 / np.sqrt(10))
+    assert index.search(np.array([0, 0, 1]), top_k=1)[0].source == 'b.txt'
+    assert index.search(np.array([0, 1, 0]), top_k=4, min_score=0.5)[-1].text == 'xy'
+
+
+def test_vector_index_grows_its_memory_map(tmp_path) -> None:
+    index = VectorIndex(tmp_path / 'index')
+    vectors = np.eye(8, dtype=np.float32)
+    for start in range(0, 3000, 8):
+        index.add(vectors, [f'chunk {start + row}' for row in range(8)], 'doc')
+
+    assert index.count == 3000
+    assert (tmp_path / 'index' / 'vectors.f32').stat().st_size >= 3000 * 8 * 4
+    hits = index.search(vectors[5], top_k=3)
+    assert all(hit.score == pytest.approx(1.0) for hit in hits)
+    assert all(int(hit.text.split()[1]) % 8 == 5 for hit in hits)
+
+    index.delete()
+    assert not (tmp_path / 'index').exists()
+
+
+def test_iter_document_chunks_rejects_binary_files(tmp_path) -> None:
+    path = tmp_path / 'image.bin'
+    path.write_bytes(b'\x00\x01')
+    with pytest.raises(ValueError):
+        list(iter_document_chunks(str(path), 'application/octet-stream'))
+
+
+def test_iter_document_chunks_splits_csv_without_punctuation(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(document_index, 'READ_BLOCK_CHARS', 4096)
+    path = tmp_path / 'table.csv'
+    text = ''.join(f'{i},tower {i},{i * 7}\n' for i in range(5000))
+    path.write_text(text)
+
+    chunks = list(iter_document_chunks(str(path), 'text/csv', chunk_tokens=256))
+
+    encoding = get_encoding()
+    assert len(chunks) > 10
+    assert all(len(encoding.encode_ordinary(chunk)) < 256 for chunk in chunks)
+    assert all(chunk.endswith('\n') for chunk in chunks)
+    assert ''.join(chunks) == text
+
+
+@pytest.mark.asyncio
+async def test_document_index_embeds_in_batches_and_finds_relevant_chunks(tmp_path) -> None:
+    path = tmp_path / 'notes.txt'
+    sentences = [f'The {WORDS[i % len(WORDS)]} note number {i} is here.' for i in range(60)]
+    path.write_text(' '.join(sentences))
+    embedder = WordEmbedder()
+    documents = DocumentIndex(tmp_path / 'index', embedder=embedder, chunk_tokens=16, batch_size=8)
+    progress: List[int] = []
+
+    async def on_progress(chunk_count: int) -> None:
+        progress.append(chunk_count)
+
+    count = await documents.add_document(str(path), 'notes.txt', 'text/plain', on_progress)
+
+    assert count == documents.index.count > 8
+    assert all(len(batch) <= 8 for batch in embedder.batches)
+    assert progress[-1] == count
+    hits = await documents.search('Where is the orbit?', top_k=3, min_score=0.5)
+    assert hits and all('orbit' in hit.text for hit in hits)
+    assert hits[0].source == 'notes.txt'
+
+
+@pytest.mark.asyncio
+async def test_ollama_embedder_moves_to_a_reachable_node(monkeypatch) -> None:
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == 'down':
+            raise httpx.ConnectError('refused', request=request)
+        body = json.loads(request.content)
+        requests.append((request.url.path, body))
+        return httpx.Response(200, json={'embeddings': [[len(text), 1.0] for text in body['input']]})
+
+    monkeypatch.setattr(document_index.httpx, 'AsyncClient', functools.partial(
+        httpx.AsyncClient, transport=httpx.MockTransport(handler)))
+    pool = OllamaPool(['http://down:11434', 'http://up:11434'])
+    embedder = OllamaEmbedder(model='nomic-embed-text', pool=pool)
+
+    vectors = await embedder.embed(['a', 'bcd'])
+
+    assert vectors.tolist() == [[1.0, 1.0], [3.0, 1.0]]
+    assert requests == [('/api/embed', {'model': 'nomic-embed-text', 'input': ['a', 'bcd']})]
+    assert not pool.nodes[0].healthy
@@ -0,0 +1,113 @@
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from image_utils import ImagePreprocessor, prepare_image
+
+
+def test_prepare_image_without_pillow_returns_the_upload(tmp_path, monkeypatch) -> None:
+    monkeypatch.setitem(sys.modules, 'PIL', None)
+    upload = tmp_path / 'photo.jpg'
+    upload.write_bytes(b'not decoded')
+    assert prepare_image(str(upload), cache_dir=str(tmp_path / 'cache')) == str(upload)
+
+
+def test_prepare_image_downscales_and_strips_metadata(tmp_path) -> None:
+    Image = pytest.importorskip('PIL.Image')
+    upload = tmp_path / 'photo.jpg'
+    exif = Image.Exif()
+    exif[0x010F] = 'Phone maker'
+    Image.new('RGB', (4000, 3000), 'red').save(upload, format='JPEG', exif=exif)
+
+    prepared = prepare_image(str(upload), max_side=512, cache_dir=str(tmp_path / 'cache'))
+
+    with Image.open(prepared) as image:
+        assert image.size == (512, 384)
+        assert not image.getexif()
+    assert prepare_image(str(upload), max_side=512, cache_dir=str(tmp_path / 'cache')) == prepared
+
+
+def test_prepare_image_keeps_transparency_as_png(tmp_path) -> None:
+    Image = pytest.importorskip('PIL.Image')
+    upload = tmp_path / 'logo.png'
+    Image.new('RGBA', (64, 64), (0, 0, 0, 0)).save(upload)
+
+    prepared = prepare_image(str(upload), max_side=512, cache_dir=str(tmp_path / 'cache'))
+
+    assert prepared.endswith('.png')
+    with Image.open(prepared) as image:
+        assert image.mode == 'RGBA'
+        assert image.size == (64, 64)
+
+
+def test_concurrent_preparations_of_one_image_do_not_collide(tmp_path, monkeypatch) -> None:
+    Image = pytest.importorskip('PIL.Image')
+    upload = tmp_path / 'photo.jpg'
+    Image.new('RGB', (2000, 1500), 'blue').save(upload, format='JPEG')
+    cache = tmp_path / 'cache'
+    # Both threads have written their file before either moves it in place
+    written = threading.Barrier(2, timeout=5)
+    replace = os.replace
+
+    def replace_after_both_wrote(source, destination) -> None:
+        written.wait()
+        replace(source, destination)
+
+    monkeypatch.setattr('image_utils.os.replace', replace_after_both_wrote)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        prepared = list(executor.map(lambda _: prepare_image(str(upload), max_side=256, cache_dir=str(cache)),
+                                     range(2)))
+
+    assert prepared[0] == prepared[1] != str(upload)
+    assert [entry.name for entry in cache.iterdir()] == [os.path.basename(prepared[0])]
+    with Image.open(prepared[0]) as image:
+        assert image.size == (256, 192)
+
+
+def test_prepare_image_falls_back_when_the_cache_cannot_be_written(tmp_path, monkeypatch) -> None:
+    Image = pytest.importorskip('PIL.Image')
+    upload = tmp_path / 'photo.jpg'
+    Image.new('RGB', (64, 64), 'red').save(upload, format='JPEG')
+    cache = tmp_path / 'cache'
+
+    def failing_replace(source, destination) -> None:
+        raise OSError(28, 'No space left on device')
+
+    monkeypatch.setattr('image_utils.os.replace', failing_replace)
+
+    assert prepare_image(str(upload), cache_dir=str(cache)) == str(upload)
+    assert not list(cache.iterdir())
+
+
+def test_prepare_image_falls_back_for_unreadable_files(tmp_path) -> None:
+    pytest.importorskip('PIL.Image')
+    upload = tmp_path / 'broken.jpg'
+    upload.write_bytes(b'not an image')
+    assert prepare_image(str(upload), cache_dir=str(tmp_path / 'cache')) == str(upload)
+
+
+@pytest.mark.asyncio
+async def test_preprocessor_prepares_each_file_once(tmp_path, monkeypatch) -> None:
+    calls = []
+
+    def fake_prepare(path: str, max_side: int) -> str:
+        calls.append((path, max_side))
+        return f'{path}.prepared'
+
+    monkeypatch.setattr('image_utils.prepare_image', fake_prepare)
+    uploads = []
+    for name in ('a.jpg', 'b.jpg'):
+        upload = tmp_path / name
+        upload.write_bytes(name.encode())
+        (tmp_path / f'{name}.prepared').write_bytes(b'')
+        uploads.append(str(upload))
+    preprocessor = ImagePreprocessor(workers=2)
+
+    assert await preprocessor.prepare(uploads, max_side=768) == [f'{upload}.prepared' for upload in uploads]
+    assert await preprocessor.prepare(uploads[:1], max_side=768) == [f'{uploads[0]}.prepared']
+    preprocessor.close()
+
+    assert sorted(calls) == [(upload, 768) for upload in uploads]
@@ -1,14 +1,118 @@
-from llm_service import get_available_models, Model
+import asyncio
+from types import SimpleNamespace
 
-def test_get_available_models_live_no_mock():
+import chainlit as cl
+import pytest
+from any_llm import ProviderName
+from any_llm.types.completion import ChatCompletionChunk
+from chainlit.context import init_http_context
+
+import llm_service
+from llm_service import Model, get_available_models, query_provider_models, refresh_available_models, stream_llm_response
+
+
+@pytest.fixture
+def empty_models_cache(monkeypatch):
+    monkeypatch.setattr(llm_service, '_provider_models', {})
+    monkeypatch.setattr(llm_service, '_models_refreshed_at', None)
+    monkeypatch.setattr(llm_service, '_models_refresh_task', None)
+    monkeypatch.setattr(llm_service, 'get_model_providers', lambda: [ProviderName.OLLAMA, ProviderName.COHERE])
+
+
+def fake_models(*names: str):
+    return [SimpleNamespace(id=name) for name in names]
+
+
+@pytest.mark.asyncio
+async def test_get_available_models_live_no_mock():
     """
     Live test (no mocks) for get_available_models(). This test queries the Ollama API
     and/or checks for available SERVICE_MODELS depending on environment. To pass, must return a list[Model].
     """
-    models = get_available_models()
+    models = await get_available_models()
     assert isinstance(models, list), "Result must be a list"
     for model in models:
         assert isinstance(model, Model), f"Each model must be of type Model, got {type(model)}"
         assert hasattr(model, "name")
         assert hasattr(model, "provider")
         assert hasattr(model, "display")
+
+
+@pytest.mark.asyncio
+async def test_stream_llm_response_keeps_partial_answer_when_stopped():
+    init_http_context()
+    closed = asyncio.Event()
+    streaming = asyncio.Event()
+
+    async def response():
+        try:
+            yield ChatCompletionChunk.model_validate({
+                'id': '1', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'm',
+                'choices': [{'index': 0, 'delta': {'content': 'partial answer'}, 'finish_reason': None}]})
+            streaming.set()
+            await asyncio.sleep(60)
+        finally:
+            closed.set()
+
+    task = asyncio.create_task(stream_llm_response(response(), 'm'))
+    await asyncio.wait_for(streaming.wait(), timeout=5)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert closed.is_set()
+    assert cl.chat_context.to_openai()[-1] == {'role': 'assistant', 'content': 'partial answer'}
+
+
+@pytest.mark.asyncio
+async def test_available_models_are_cached_and_refreshed_in_background(monkeypatch, empty_models_cache):
+    now = [100.0]
+    monkeypatch.setattr(llm_service.time, 'monotonic', lambda: now[0])
+    listed = [fake_models('llama3.2')]
+
+    async def list_ollama_pool_models(timeout):
+        return listed[-1]
+
+    async def list_models_async(provider, api_key=None):
+        return fake_models('command-r', 'embed-english')
+
+    monkeypatch.setattr(llm_service, 'list_ollama_pool_models', list_ollama_pool_models)
+    monkeypatch.setattr(llm_service, 'list_models_async', list_models_async)
+
+    models = await get_available_models(max_age=60)
+    assert [model.display for model in models] == ['llama3.2', '☁️🔗 cohere:command-r']
+
+    # Within the TTL the cache is served without querying providers
+    listed.append(fake_models('llama3.2', 'qwen3'))
+    now[0] += 30
+    assert await get_available_models(max_age=60) == models
+    assert llm_service._models_refresh_task.done()
+
+    # A stale list is returned at once while a refresh runs in the background
+    now[0] += 60
+    assert await get_available_models(max_age=60) == models
+    await llm_service._models_refresh_task
+    assert [model.name for model in await get_available_models(max_age=60)] == ['llama3.2', 'qwen3', 'command-r']
+
+
+@pytest.mark.asyncio
+async def test_slow_provider_times_out_and_keeps_its_last_models(monkeypatch, empty_models_cache):
+    slow = [False]
+
+    async def list_ollama_pool_models(timeout):
+        return fake_models('llama3.2')
+
+    async def list_models_async(provider, api_key=None):
+        if slow[0]:
+            await asyncio.sleep(60)
+        return fake_models('command-r')
+
+    monkeypatch.setattr(llm_service, 'list_ollama_pool_models', list_ollama_pool_models)
+    monkeypatch.setattr(llm_service, 'list_models_async', list_models_async)
+
+    assert [model.name for model in await refresh_available_models(timeout=0.05)] == ['llama3.2', 'command-r']
+
+    slow[0] = True
+    with pytest.raises(asyncio.TimeoutError):
+        await query_provider_models(ProviderName.COHERE, timeout=0.05)
+    assert [model.name for model in await asyncio.wait_for(refresh_available_models(timeout=0.05), timeout=5)] == ['llama3.2', 'command-r']
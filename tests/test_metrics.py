@@ -0,0 +1,143 @@
+import asyncio
+import json
+
+import pytest
+
+import metrics
+from metrics import (LATENCY_BUCKETS, MetricsRegistry, MetricsSink, OTLPSink, PrometheusSink, Span,
+                     get_metrics_registry, inc_counter, otlp_metrics_payload, otlp_traces_payload,
+                     profile_message, render_prometheus, span, start_metrics, stop_metrics)
+
+
+class RecordingSink(MetricsSink):
+    def __init__(self):
+        self.spans = []
+
+    def export_span(self, span: Span) -> None:
+        self.spans.append(span)
+
+
+@pytest.mark.asyncio
+async def test_span_records_histogram_nesting_and_errors():
+    sink = RecordingSink()
+    await start_metrics(sink)
+    registry = get_metrics_registry()
+    try:
+        with span('test_outer', model='m') as outer:
+            with span('test_inner'):
+                pass
+        with pytest.raises(ValueError):
+            with span('test_failing'):
+                raise ValueError('boom')
+    finally:
+        await stop_metrics()
+
+    inner, first, failing = sink.spans
+    assert first is outer
+    assert inner.parent_id == outer.span_id and inner.trace_id == outer.trace_id
+    assert outer.parent_id is None
+    assert failing.error == 'ValueError'
+    assert registry.histograms[('test_outer_seconds', (('model', 'm'),))].count >= 1
+    assert registry.counters[('test_failing_errors', ())] >= 1
+
+
+def test_span_decorates_functions():
+    @span('test_decorated')
+    def work(value):
+        return value * 2
+
+    before = get_metrics_registry().histograms.get(('test_decorated_seconds', ()))
+    before_count = before.count if before else 0
+    assert work(2) == 4
+    assert work(3) == 6
+    assert get_metrics_registry().histograms[('test_decorated_seconds', ())].count == before_count + 2
+
+
+def test_render_prometheus():
+    registry = MetricsRegistry()
+    registry.inc('requests', model='llama"3')
+    registry.inc('requests', 2, model='llama"3')
+    registry.observe('latency_seconds', 0.2)
+    registry.observe('latency_seconds', 500)
+
+    text = render_prometheus(registry)
+
+    assert '# TYPE chainlit_ollama_requests_total counter' in text
+    assert 'chainlit_ollama_requests_total{model="llama\\"3"} 3.0' in text
+    assert 'chainlit_ollama_latency_seconds_bucket{le="0.1"} 0' in text
+    assert 'chainlit_ollama_latency_seconds_bucket{le="0.25"} 1' in text
+    assert 'chainlit_ollama_latency_seconds_bucket{le="120.0"} 1' in text
+    assert 'chainlit_ollama_latency_seconds_bucket{le="+Inf"} 2' in text
+    assert 'chainlit_ollama_latency_seconds_count 2' in text
+
+
+@pytest.mark.asyncio
+async def test_prometheus_sink_serves_metrics():
+    inc_counter('test_scraped')
+    sink = PrometheusSink(port=0, host='127.0.0.1')
+    await start_metrics(sink)
+    try:
+        reader, writer = await asyncio.open_connection('127.0.0.1', sink.port)
+        writer.write(b'GET /metrics HTTP/1.1\r\nHost: localhost\r\n\r\n')
+        response = (await reader.read()).decode()
+        writer.close()
+    finally:
+        await stop_metrics()
+
+    assert response.startswith('HTTP/1.1 200 OK')
+    assert 'chainlit_ollama_test_scraped_total 1.0' in response
+
+
+def test_otlp_payloads():
+    registry = MetricsRegistry()
+    registry.inc('requests', tool='search')
+    registry.observe('latency_seconds', 0.2)
+    spans = [Span(name='message', labels={'model': 'm'}, trace_id='a' * 32, span_id='b' * 16,
+                  parent_id=None, start_ns=1_000, duration=0.5, error='ValueError')]
+
+    traces = otlp_traces_payload(spans)
+    otlp_span = traces['resourceSpans'][0]['scopeSpans'][0]['spans'][0]
+    assert otlp_span['endTimeUnixNano'] == str(1_000 + 500_000_000)
+    assert otlp_span['status']['code'] == 2
+    assert 'parentSpanId' not in otlp_span
+
+    metric_list = otlp_metrics_payload(registry)['resourceMetrics'][0]['scopeMetrics'][0]['metrics']
+    by_name = {metric['name']: metric for metric in metric_list}
+    assert by_name['chainlit_ollama_requests']['sum']['dataPoints'][0]['asDouble'] == 1.0
+    histogram = by_name['chainlit_ollama_latency_seconds']['histogram']['dataPoints'][0]
+    assert len(histogram['bucketCounts']) == len(LATENCY_BUCKETS) + 1
+    json.dumps(traces)
+
+
+@pytest.mark.asyncio
+async def test_otlp_sink_buffers_spans_until_export(monkeypatch):
+    exported = []
+    sink = OTLPSink(endpoint='http://collector.invalid', interval=3600)
+
+    async def fake_export():
+        exported.append(list(sink._spans))
+        sink._spans.clear()
+
+    monkeypatch.setattr(sink, 'export', fake_export)
+    await start_metrics(sink)
+    with span('test_buffered'):
+        pass
+    assert [s.name for s in sink._spans] == ['test_buffered']
+    await stop_metrics()
+    assert [s.name for s in exported[0]] == ['test_buffered']
+
+
+@pytest.mark.asyncio
+async def test_profile_message_writes_cprofile(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, 'PROFILE_DIR', str(tmp_path))
+
+    async with profile_message('msg-1', mode='cprofile') as path:
+        sum(range(1000))
+        # Profiles are not nested
+        async with profile_message('msg-2', mode='cprofile') as nested:
+            assert nested is None
+
+    assert path.exists() and path.suffix == '.prof'
+
+    async with profile_message('msg-3', mode='') as disabled:
+        assert disabled is None
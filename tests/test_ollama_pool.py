@@ -0,0 +1,117 @@
+import httpx
+import pytest
+from any_llm.types.completion import ChatCompletionChunk
+
+import agent_helper
+from ollama_pool import OllamaPool, ollama_model_name
+
+
+def test_pick_prefers_loaded_model_then_least_outstanding():
+    pool = OllamaPool(['http://a:11434', 'http://b:11434', 'http://c:11434'])
+    a, b, c = pool.nodes
+    b.loaded_models.add('llama3')
+    c.loaded_models.add('llama3')
+    b.outstanding = 2
+
+    assert pool.pick('llama3') is c
+    assert pool.pick('qwen3') is a
+    assert pool.pick('llama3', exclude=[c]) is b
+
+    with pool.track(a, 'qwen3'):
+        assert a.outstanding == 1
+        # The node loading the model is preferred for the next request
+        assert 'qwen3' in a.loaded_models
+    assert a.outstanding == 0
+
+
+def test_pick_skips_unhealthy_nodes_unless_none_is_left():
+    pool = OllamaPool(['http://a:11434', 'http://b:11434'])
+    a, b = pool.nodes
+    a.loaded_models.add('llama3')
+    pool.mark_failed(a, ConnectionError('down'))
+
+    assert not a.loaded_models
+    assert pool.pick('llama3') is b
+    pool.mark_failed(b, ConnectionError('down'))
+    assert pool.pick('llama3') in (a, b)
+    assert pool.pick('llama3', exclude=[a, b]) is None
+
+
+def test_pick_skips_nodes_without_the_model():
+    pool = OllamaPool(['http://a:11434', 'http://b:11434'])
+    a, b = pool.nodes
+    a.available_models = {'llama3:latest'}
+    b.available_models = {'llama3:latest', 'qwen3:8b'}
+    b.outstanding = 5
+
+    assert pool.pick('qwen3:8b') is b
+    assert pool.pick('llama3') is a
+    assert pool.pick('qwen3:8b', exclude=[b]) is a
+    # Pulled since the last check: no node lists it, so any node may try
+    assert pool.pick('gemma3') is a
+
+
+def test_pick_prefers_node_with_untagged_model_loaded_as_latest():
+    pool = OllamaPool(['http://a:11434', 'http://b:11434'])
+    a, b = pool.nodes
+    # /api/ps lists the tagged name, requests may use the bare one
+    b.loaded_models.add('llama3:latest')
+    b.outstanding = 2
+
+    assert b.is_loaded('llama3')
+    assert not b.is_loaded('llama3:8b')
+    assert pool.pick('llama3') is b
+
+
+@pytest.mark.asyncio
+async def test_check_reads_loaded_and_available_models_and_health():
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host == 'down':
+            raise httpx.ConnectError('refused', request=request)
+        if request.url.path == '/api/ps':
+            return httpx.Response(200, json={'models': [{'name': 'llama3:8b', 'model': 'llama3:8b'}]})
+        return httpx.Response(200, json={'models': [{'name': 'llama3:8b'}, {'name': 'qwen3:8b'}]})
+
+    pool = OllamaPool(['http://up:11434', 'http://down:11434'])
+    async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+        for node in pool.nodes:
+            await pool.check(node, client)
+
+    up, down = pool.nodes
+    assert up.healthy and up.loaded_models == {'llama3:8b'}
+    assert up.available_models == {'llama3:8b', 'qwen3:8b'}
+    assert not down.healthy
+    assert down.available_models is None
+
+
+def test_ollama_model_name():
+    assert ollama_model_name('ollama:gpt-oss:20b') == 'gpt-oss:20b'
+    assert ollama_model_name('cohere:command-r') is None
+
+
+@pytest.mark.asyncio
+async def test_agent_runner_fails_over_to_another_node(monkeypatch):
+    pool = OllamaPool(['http://a:11434', 'http://b:11434'])
+    monkeypatch.setattr(agent_helper, 'get_ollama_pool', lambda: pool)
+    calls = []
+
+    async def fake_llm_completion(model, messages, tools=None, api_base=None, stream=True):
+        calls.append(api_base)
+
+        async def stream_chunks():
+            if api_base == 'http://a:11434':
+                raise ConnectionError('Failed to connect to Ollama')
+            yield ChatCompletionChunk.model_validate({
+                'id': '1', 'object': 'chat.completion.chunk', 'created': 0, 'model': model,
+                'choices': [{'index': 0, 'delta': {'content': 'hi'}, 'finish_reason': None}]})
+        return stream_chunks()
+
+    monkeypatch.setattr(agent_helper, 'llm_completion', fake_llm_completion)
+
+    chunks = [chunk async for chunk in agent_helper.agent_runner(
+        'ollama:llama3', [{'role': 'user', 'content': 'hello'}])]
+
+    assert calls == ['http://a:11434', 'http://b:11434']
+    assert [chunk.choices[0].delta.content for chunk in chunks] == ['hi']
+    assert not pool.nodes[0].healthy
+    assert all(node.outstanding == 0 for node in pool.nodes)
@@ -0,0 +1,65 @@
+import re
+
+import pytest
+
+from prompt_utils import PromptCatalog, prompt_name, render_prompt
+
+
+def test_render_prompt_uses_input_defaults() -> None:
+    prompt = render_prompt('summarize', {'text': 'Some text.'})
+    assert 'into 5 concise bullet points' in prompt
+    assert prompt.endswith('Some text.')
+
+
+def test_catalog_serves_prompt_specs_and_templates() -> None:
+    catalog = PromptCatalog()
+    names = {prompt.name for prompt in catalog.prompts()}
+    assert {'summarize', 'summarize_content', 'programming_task'} <= names
+
+    summarize = catalog.get('summarize')
+    assert [(prompt_input.name, prompt_input.required) for prompt_input in summarize.inputs] == [
+        ('text', True), ('bullets', False)]
+    # MCP arguments arrive as strings and are converted to the declared type
+    assert 'into 3 concise' in catalog.render('summarize', {'text': 'x', 'bullets': '3'})
+    assert catalog.get('summarize_content').title == 'Summarize Content'
+
+
+def test_only_templates_using_now_get_the_date() -> None:
+    catalog = PromptCatalog()
+    assert catalog.get('summarize').extra_context is None
+    assert catalog.get('programming_task').extra_context is None
+
+    reasoning = catalog.get('chain_of_thought_reasoning')
+    assert reasoning.extra_context is not None
+    arguments = {prompt_input.name: 'x' for prompt_input in reasoning.inputs}
+    assert re.search(r'The current date is \w+day, ', reasoning.render(arguments))
+
+
+def test_catalog_rejects_missing_required_arguments() -> None:
+    catalog = PromptCatalog()
+    with pytest.raises(ValueError, match='code'):
+        catalog.render('programming_task', {'task': 'Sort a list'})
+    with pytest.raises(ValueError, match='Unknown prompt'):
+        catalog.render('missing', {})
+
+
+def test_catalog_reloads_changed_added_and_removed_files(tmp_path) -> None:
+    spec = tmp_path / 'greet.yml'
+    spec.write_text('template: "Hello {{ name }}"\n')
+    catalog = PromptCatalog(prompts_dir=tmp_path, templates_dir=None, reload_interval=0)
+    assert catalog.render('greet', {'name': 'Ada'}) == 'Hello Ada'
+    compiled = catalog.get('greet')
+    assert catalog.get('greet') is compiled
+
+    spec.write_text('template: "Goodbye, {{ name }}!"\n')
+    (tmp_path / 'other.yml').write_text('id: other\ntemplate: "Other"\n')
+    assert catalog.render('greet', {'name': 'Ada'}) == 'Goodbye, Ada!'
+    assert catalog.render('other', {}) == 'Other'
+
+    spec.unlink()
+    assert catalog.get('greet') is None
+
+
+def test_prompt_name() -> None:
+    assert prompt_name('Chain of Thought Reasoning') == 'chain_of_thought_reasoning'
+
@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+import pytest
+
+from python_exec import PythonExecPool, _Worker, execute_python_code
+
+
+def test_execute_python_code_captures_output() -> None:
+    assert execute_python_code('print(1 + 1)') == '2\n'
+    assert execute_python_code('raise ValueError("bad input")') == 'Error: bad input'
+
+
+def test_execute_python_code_limits_output() -> None:
+    output = execute_python_code('print("x" * 100)', output_limit=10)
+    assert output.startswith('x' * 10 + '\n...')
+
+
+@pytest.mark.asyncio
+async def test_pool_runs_concurrently_with_separate_output() -> None:
+    pool = PythonExecPool(workers=2, timeout=10)
+    try:
+        results = await asyncio.gather(
+            pool.run('import time\nfor i in range(3):\n    print("a", i)\n    time.sleep(0.05)'),
+            pool.run('import time\nfor i in range(3):\n    print("b", i)\n    time.sleep(0.05)'),
+        )
+        assert results == ['a 0\na 1\na 2\n', 'b 0\nb 1\nb 2\n']
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_pool_restarts_worker_after_timeout() -> None:
+    pool = PythonExecPool(workers=1, timeout=10)
+    try:
+        assert (await pool.run('while True: pass', timeout=0.5)).startswith('Error: execution timed out')
+        assert await pool.run('print("still working")') == 'still working\n'
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_worker_restart_does_not_block_event_loop(monkeypatch) -> None:
+    kill = _Worker.kill
+
+    def slow_kill(worker) -> None:
+        time.sleep(0.5)
+        kill(worker)
+
+    monkeypatch.setattr(_Worker, 'kill', slow_kill)
+    pool = PythonExecPool(workers=1, timeout=10)
+    gaps = []
+
+    async def heartbeat() -> None:
+        last = time.perf_counter()
+        while True:
+            await asyncio.sleep(0.01)
+            now = time.perf_counter()
+            gaps.append(now - last)
+            last = now
+
+    try:
+        await pool.start()
+        ticker = asyncio.create_task(heartbeat())
+        assert (await pool.run('while True: pass', timeout=0.2)).startswith('Error: execution timed out')
+        assert await pool.run('print("restarted")') == 'restarted\n'
+        ticker.cancel()
+        assert max(gaps) < 0.3
+    finally:
+        await pool.close()
+
+
+@pytest.mark.asyncio
+async def test_code_finishing_after_close_stops_its_worker(monkeypatch) -> None:
+    kill = _Worker.kill
+
+    def slow_kill(worker: _Worker) -> None:
+        # close() is still stopping workers when the running code finishes
+        time.sleep(0.5)
+        kill(worker)
+
+    monkeypatch.setattr(_Worker, 'kill', slow_kill)
+    pool = PythonExecPool(workers=1, timeout=10)
+    await pool.start()
+    running = asyncio.create_task(pool.run('import time\ntime.sleep(0.3)\nprint("done")'))
+    await asyncio.sleep(0.1)
+    worker = pool._all[0]
+
+    await pool.close()
+    assert await asyncio.wait_for(running, timeout=5) == 'done\n'
+    assert not worker.process.is_alive()
@@ -0,0 +1,112 @@
+import pytest
+from any_llm.types.completion import ChatCompletion, ChatCompletionChunk
+
+import agent_helper
+import response_cache
+from response_cache import MemoryCacheBackend, ResponseCache, SQLiteCacheBackend, response_cache_key
+
+
+def _chunk(content):
+    return ChatCompletionChunk.model_validate({
+        'id': '1', 'object': 'chat.completion.chunk', 'created': 0, 'model': 'm',
+        'choices': [{'index': 0, 'delta': {'content': content}, 'finish_reason': None}]})
+
+
+def test_key_normalizes_messages():
+    messages = [{'role': 'user', 'content': 'Summarize this\r\n'}]
+    same = [{'role': 'user', 'content': 'Summarize this', 'images': None, 'id': 'ignored'}]
+
+    assert response_cache_key('m', messages) == response_cache_key('m', same)
+    assert response_cache_key('m', messages) != response_cache_key('other', messages)
+    assert response_cache_key('m', messages) != response_cache_key('m', messages, stream=False)
+    assert response_cache_key('m', messages) != response_cache_key(
+        'm', messages, tools=[{'type': 'function', 'function': {'name': 'f'}}])
+
+
+def test_memory_backend_lru_size_cap_and_ttl(monkeypatch):
+    backend = MemoryCacheBackend(max_entries=2, max_bytes=10)
+    backend.put('a', 'aaa', expires=float('inf'))
+    backend.put('b', 'bbb', expires=float('inf'))
+    assert backend.get('a') == 'aaa'
+    backend.put('c', 'ccc', expires=float('inf'))
+    # b was least recently used
+    assert backend.get('b') is None and backend.get('a') == 'aaa'
+
+    backend.put('d', 'd' * 8, expires=float('inf'))
+    assert backend.get('a') is None and backend.get('c') is None and backend.get('d')
+
+    backend.put('e', 'e', expires=0)
+    assert backend.get('e') is None
+
+
+def test_sqlite_backend_persists_and_evicts(tmp_path):
+    path = str(tmp_path / 'cache' / 'responses.sqlite3')
+    backend = SQLiteCacheBackend(path, max_entries=2, max_bytes=100)
+    backend.put('a', 'aaa', expires=float('inf'))
+    backend.put('b', 'bbb', expires=float('inf'))
+    backend.put('old', 'x', expires=0)
+    backend.close()
+
+    reopened = SQLiteCacheBackend(path, max_entries=2, max_bytes=100)
+    assert reopened.get('a') == 'aaa'
+    assert reopened.get('old') is None
+    reopened.put('c', 'ccc', expires=float('inf'))
+    assert reopened.get('b') is None and reopened.get('a') == 'aaa' and reopened.get('c') == 'ccc'
+    reopened.close()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize('path', [None, 'sqlite'])
+async def test_llm_completion_replays_cached_stream(monkeypatch, tmp_path, path):
+    cache = ResponseCache(path=str(tmp_path / 'cache.sqlite3') if path else None)
+    monkeypatch.setattr(agent_helper, 'get_response_cache', lambda: cache)
+    calls = []
+
+    async def fake_acompletion(model, messages, tools, api_base, stream):
+        calls.append(stream)
+        if not stream:
+            return ChatCompletion.model_validate({
+                'id': '1', 'object': 'chat.completion', 'created': 0, 'model': model,
+                'choices': [{'index': 0, 'finish_reason': 'stop',
+                             'message': {'role': 'assistant', 'content': 'whole answer'}}]})
+
+        async def chunks():
+            for content in ['cached ', 'answer']:
+                yield _chunk(content)
+        return chunks()
+
+    monkeypatch.setattr(agent_helper, 'acompletion', fake_acompletion)
+    messages = [{'role': 'user', 'content': 'Summarize Content'}]
+
+    live = [chunk async for chunk in await agent_helper.llm_completion('m', messages)]
+    replayed = [chunk async for chunk in await agent_helper.llm_completion('m', messages)]
+    assert calls == [True]
+    assert [chunk.choices[0].delta.content for chunk in replayed] == ['cached ', 'answer']
+    assert replayed == live
+
+    first = await agent_helper.llm_completion('m', messages, stream=False)
+    second = await agent_helper.llm_completion('m', messages, stream=False)
+    assert calls == [True, False]
+    assert second.choices[0].message.content == first.choices[0].message.content == 'whole answer'
+    await cache.close()
+
+
+@pytest.mark.asyncio
+async def test_incomplete_stream_is_not_cached():
+    cache = ResponseCache()
+
+    async def chunks():
+        for content in ['one', 'two']:
+            yield _chunk(content)
+
+    stream = await cache.record('key', chunks(), stream=True)
+    async for _ in stream:
+        break
+    await stream.aclose()
+    assert await cache.get('key') is None
+
+
+def test_get_response_cache_is_opt_in(monkeypatch):
+    monkeypatch.setattr(response_cache, '_response_cache', None)
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_ENABLED', False)
+    assert response_cache.get_response_cache() is None
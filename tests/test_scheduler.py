@@ -0,0 +1,129 @@
+import asyncio
+
+import pytest
+import toml
+
+from scheduler import PRIORITY_BATCH, RequestScheduler
+
+
+async def hold(scheduler, order, name, release, **kwargs):
+    kwargs.setdefault('backend', 'b')
+    kwargs.setdefault('model', 'm')
+    async with scheduler.slot(**kwargs):
+        order.append(name)
+        await release.wait()
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_slot_limits_concurrency_per_model_and_backend():
+    scheduler = RequestScheduler(backend_limit=3, model_limit=2)
+    release = asyncio.Event()
+    order = []
+    tasks = [asyncio.create_task(hold(scheduler, order, f'm{i}', release)) for i in range(3)]
+    tasks.append(asyncio.create_task(hold(scheduler, order, 'other', release, model='n')))
+    tasks.append(asyncio.create_task(hold(scheduler, order, 'blocked', release, model='n')))
+    await settle()
+
+    # m2 waits for model m, 'other' is not blocked behind it, 'blocked' hits the backend limit
+    assert order == ['m0', 'm1', 'other']
+    assert scheduler.active('b') == 3
+    assert scheduler.queued() == 2
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert sorted(order) == ['blocked', 'm0', 'm1', 'm2', 'other']
+    assert scheduler.active('b') == 0 and scheduler.queued() == 0
+
+
+@pytest.mark.asyncio
+async def test_fair_queuing_across_sessions():
+    scheduler = RequestScheduler(backend_limit=1, model_limit=1)
+    release = asyncio.Event()
+    order = []
+    first = asyncio.create_task(hold(scheduler, order, 'a0', release, session='a'))
+    await settle()
+    tasks = [asyncio.create_task(hold(scheduler, order, f'a{i}', release, session='a')) for i in range(1, 4)]
+    await settle()
+    tasks.append(asyncio.create_task(hold(scheduler, order, 'b0', release, session='b')))
+    await settle()
+
+    release.set()
+    await asyncio.gather(first, *tasks)
+    # Session b's only request is served before session a's backlog
+    assert order.index('b0') < order.index('a2')
+
+
+@pytest.mark.asyncio
+async def test_priority_and_short_prompts_first():
+    scheduler = RequestScheduler(backend_limit=1, model_limit=1)
+    release = asyncio.Event()
+    order = []
+    first = asyncio.create_task(hold(scheduler, order, 'running', release))
+    await settle()
+    tasks = [
+        asyncio.create_task(hold(scheduler, order, 'batch', release, session='s1', priority=PRIORITY_BATCH)),
+        asyncio.create_task(hold(scheduler, order, 'long', release, session='s2', prompt_chars=10**6)),
+        asyncio.create_task(hold(scheduler, order, 'short', release, session='s3', prompt_chars=10)),
+    ]
+    await settle()
+
+    release.set()
+    await asyncio.gather(first, *tasks)
+    assert order == ['running', 'short', 'long', 'batch']
+
+
+@pytest.mark.asyncio
+async def test_queue_position_feedback_and_cancellation():
+    scheduler = RequestScheduler(backend_limit=1, model_limit=1)
+    release = asyncio.Event()
+    order = []
+    positions = {'w1': [], 'w2': []}
+
+    def recorder(name):
+        async def on_queue(position):
+            positions[name].append(position)
+        return on_queue
+
+    first = asyncio.create_task(hold(scheduler, order, 'running', release))
+    await settle()
+    w1 = asyncio.create_task(hold(scheduler, order, 'w1', release, session='s1', on_queue=recorder('w1')))
+    await settle()
+    w2 = asyncio.create_task(hold(scheduler, order, 'w2', release, session='s2', on_queue=recorder('w2')))
+    await settle()
+    assert positions == {'w1': [1], 'w2': [2]}
+
+    # A cancelled waiter leaves the queue and the next one moves up
+    w1.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await w1
+    await settle()
+    assert positions['w2'] == [2, 1]
+
+    release.set()
+    await asyncio.gather(first, w2)
+    assert positions['w2'] == [2, 1, 0]
+    assert order == ['running', 'w2']
+    assert scheduler.active('b') == 0 and scheduler.queued() == 0
+
+
+@pytest.mark.asyncio
+async def test_configured_model_limit_applies_to_prefixed_request_models():
+    # Same shape as the [model_concurrency] example in the README
+    settings = toml.loads('[model_concurrency]\n"gpt-oss:20b" = 1\n')
+    scheduler = RequestScheduler(model_limit=2, model_limits=settings['model_concurrency'])
+    release = asyncio.Event()
+    order = []
+    tasks = [asyncio.create_task(hold(scheduler, order, f'r{i}', release, model='ollama:gpt-oss:20b'))
+             for i in range(2)]
+    await settle()
+
+    assert order == ['r0']
+    assert scheduler.active('b', 'gpt-oss:20b') == scheduler.active('b', 'ollama:gpt-oss:20b') == 1
+    release.set()
+    await asyncio.gather(*tasks)
+    assert order == ['r0', 'r1']
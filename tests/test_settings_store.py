@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+import toml
+
+import settings_store
+from config import load_config
+from settings_store import UserSettingsStore, user_settings_path, validate_settings
+
+
+def test_validate_settings() -> None:
+    assert validate_settings({'model': 'ollama:llama3.2'}) == {'model': 'ollama:llama3.2'}
+    with pytest.raises(ValueError, match='unknown setting theme'):
+        validate_settings({'theme': 'dark'})
+    with pytest.raises(ValueError, match='model must be str'):
+        validate_settings({'model': 3})
+
+
+def test_user_settings_paths_are_distinct(tmp_path) -> None:
+    first = user_settings_path('a/b@example.com', tmp_path)
+    second = user_settings_path('a_b@example.com', tmp_path)
+    assert first.parent == tmp_path
+    assert first != second
+    assert first.name.startswith('a_b_example.com-')
+
+
+def test_load_config_is_cached_until_the_file_changes(tmp_path, monkeypatch) -> None:
+    monkeypatch.chdir(tmp_path)
+    assert load_config('settings.toml') == {}
+    (tmp_path / 'config').mkdir()
+    (tmp_path / 'config' / 'settings.toml').write_text('model = "first"\n')
+    settings = load_config('settings.toml')
+    assert settings == {'model': 'first'}
+    assert load_config('settings.toml') is settings
+
+    (tmp_path / 'config' / 'settings.toml').write_text('model = "second model"\n')
+    assert load_config('settings.toml') == {'model': 'second model'}
+
+
+@pytest.mark.asyncio
+async def test_settings_fall_back_to_global_settings(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(settings_store, 'load_config', lambda file: {'model': 'global', 'context_budgets': {}})
+    store = UserSettingsStore(settings_dir=tmp_path)
+    assert await store.get('alice') == {'model': 'global'}
+
+    user_settings_path('bob', tmp_path).write_text('model = "own"\nunknown = 1\n')
+    assert await store.get('bob') == {'model': 'own'}
+
+
+@pytest.mark.asyncio
+async def test_changes_are_written_once_after_the_last_change(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(settings_store, 'load_config', lambda file: {})
+    store = UserSettingsStore(settings_dir=tmp_path, write_delay=0.05)
+    writes = []
+    write = store._write
+    monkeypatch.setattr(store, '_write', lambda *args: (writes.append(args), write(*args)))
+
+    await store.update('alice', {'model': 'first'})
+    await asyncio.sleep(0.02)
+    assert await store.update('alice', {'model': 'second'}) == {'model': 'second'}
+    assert await store.get('alice') == {'model': 'second'}
+    assert not user_settings_path('alice', tmp_path).exists()
+
+    await asyncio.sleep(0.15)
+    assert len(writes) == 1
+    assert toml.load(user_settings_path('alice', tmp_path)) == {'model': 'second'}
+    assert list(tmp_path.glob('*.tmp')) == []
+
+
+@pytest.mark.asyncio
+async def test_flush_writes_pending_changes(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(settings_store, 'load_config', lambda file: {})
+    store = UserSettingsStore(settings_dir=tmp_path, write_delay=60)
+    await store.update('alice', {'model': 'a'})
+    await store.update('bob', {'model': 'b'})
+    await store.flush()
+    assert toml.load(user_settings_path('alice', tmp_path)) == {'model': 'a'}
+    assert toml.load(user_settings_path('bob', tmp_path)) == {'model': 'b'}
+
+    with pytest.raises(ValueError):
+        await store.update('alice', {'model': None})
+    assert await store.get('alice') == {'model': 'a'}
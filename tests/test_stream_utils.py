@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+
+from stream_utils import MESSAGE, REASONING, THINKING, CoalescingStreamWriter, ThinkStreamParser
+
+
+class RecordingSink:
+    def __init__(self) -> None:
+        self.batches = []
+
+    async def __call__(self, text: str) -> None:
+        self.batches.append(text)
+
+
+@pytest.mark.asyncio
+async def test_writer_coalesces_tokens_until_close() -> None:
+    sink = RecordingSink()
+    writer = CoalescingStreamWriter(sink, flush_interval=10, flush_chars=1000)
+    for token in ['Hello', ' ', 'world', None, '']:
+        await writer.write(token)
+    assert sink.batches == []
+
+    await writer.close()
+    assert sink.batches == ['Hello world']
+
+
+@pytest.mark.asyncio
+async def test_writer_flushes_on_size() -> None:
+    sink = RecordingSink()
+    writer = CoalescingStreamWriter(sink, flush_interval=10, flush_chars=4)
+    for token in ['ab', 'cd', 'e']:
+        await writer.write(token)
+    assert sink.batches == ['abcd']
+
+    await writer.close()
+    assert sink.batches == ['abcd', 'e']
+
+
+@pytest.mark.asyncio
+async def test_writer_flushes_on_interval() -> None:
+    sink = RecordingSink()
+    writer = CoalescingStreamWriter(sink, flush_interval=0.01, flush_chars=1000)
+    await writer.write('a')
+    await writer.write('b')
+    await asyncio.sleep(0.05)
+    assert sink.batches == ['ab']
+
+    await writer.write('c')
+    await writer.close()
+    assert sink.batches == ['ab', 'c']
+
+
+class Delta:
+    def __init__(self, content=None, reasoning=None) -> None:
+        self.content = content
+        self.reasoning = type('Reasoning', (), {'content': reasoning})() if reasoning else None
+
+
+def parse(chunks: list) -> list:
+    parser = ThinkStreamParser()
+    segments = []
+    for chunk in chunks:
+        segments += parser.feed(Delta(content=chunk))
+    segments += parser.flush()
+    merged = []
+    for kind, text in segments:
+        if merged and merged[-1][0] == kind:
+            merged[-1] = (kind, merged[-1][1] + text)
+        else:
+            merged.append((kind, text))
+    return merged
+
+
+@pytest.mark.parametrize("chunks", [
+    ['<think>', 'Let me see.', '</think>', 'Answer.'],
+    ['<think>Let me see.</think>Answer.'],
+    ['<th', 'ink>Let me', ' see.</', 'think', '>Answer.'],
+    ['<', 't', 'h', 'i', 'n', 'k', '>', 'Let me see.<', '/think>Ans', 'wer.'],
+])
+def test_parser_handles_split_tags(chunks: list) -> None:
+    assert parse(chunks) == [(THINKING, 'Let me see.'), (MESSAGE, 'Answer.')]
+
+
+def test_parser_keeps_non_tag_angle_brackets() -> None:
+    assert parse(['a <', 'b> c <th', 'is']) == [(MESSAGE, 'a <b> c <this')]
+    assert parse(['x <thi']) == [(MESSAGE, 'x <thi')]
+
+
+def test_parser_routes_reasoning_and_skips_empty_content() -> None:
+    parser = ThinkStreamParser()
+    assert parser.feed(Delta(reasoning='Hmm')) == [(REASONING, 'Hmm')]
+    assert parser.feed(Delta(content=None)) == []
+    assert parser.feed(Delta(content='Hi')) == [(MESSAGE, 'Hi')]
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+from typing import Dict, List, Tuple
+
+import pytest
+
+from summarizer import Summarizer
+
+TEXT = ''.join(f'Sentence number {i} is here. ' for i in range(100))
+
+
+def make_summarizer(fan_in: int = 2) -> Tuple[Summarizer, List[str]]:
+    prompts: List[str] = []
+
+    async def complete(messages: List[Dict[str, str]]) -> str:
+        prompts.append(messages[-1]['content'])
+        await asyncio.sleep(0)
+        return f'summary {len(prompts)}'
+
+    return Summarizer('test-model', complete, chunk_tokens=64, bullets=3, fan_in=fan_in), prompts
+
+
+@pytest.mark.asyncio
+async def test_summarize_maps_chunks_and_reduces_to_one_summary() -> None:
+    summarizer, prompts = make_summarizer(fan_in=2)
+    chunks = summarizer.chunks(TEXT)
+    assert len(chunks) > 4
+    progress: List[Tuple[str, int, int]] = []
+
+    async def on_progress(stage: str, done: int, total: int) -> None:
+        progress.append((stage, done, total))
+
+    summary = await summarizer.summarize(TEXT, on_progress=on_progress)
+
+    assert summary == f'summary {len(prompts)}'
+    assert all('3 concise bullet points' in prompt for prompt in prompts)
+    assert [entry for entry in progress if entry[0] == 'map'][-1] == ('map', len(chunks), len(chunks))
+    assert ('reduce 1', (len(chunks) + 1) // 2, (len(chunks) + 1) // 2) in progress
+    assert progress[-1][1:] == (1, 1)
+
+
+@pytest.mark.asyncio
+async def test_summarize_tokenizes_off_the_event_loop(monkeypatch: pytest.MonkeyPatch) -> None:
+    summarizer, _ = make_summarizer()
+    threads: List[threading.Thread] = []
+    chunks = summarizer.chunks
+
+    def recording_chunks(text: str) -> List[str]:
+        threads.append(threading.current_thread())
+        return chunks(text)
+
+    monkeypatch.setattr(summarizer, 'chunks', recording_chunks)
+    await summarizer.summarize(TEXT)
+
+    assert threads and threading.current_thread() not in threads
+
+
+@pytest.mark.asyncio
+async def test_summarize_reuses_cached_chunk_summaries() -> None:
+    summarizer, prompts = make_summarizer()
+    summary = await summarizer.summarize(TEXT)
+    calls = len(prompts)
+
+    assert await summarizer.summarize(TEXT) == summary
+    assert len(prompts) == calls
+    assert summarizer.cached(TEXT) == summary
+
+    # Only the chunks that changed are summarized again
+    await summarizer.summarize(TEXT + 'A new closing sentence.')
+    map_prompts = [prompt for prompt in prompts[calls:] if 'Sentence number' in prompt or 'A new' in prompt]
+    assert len(map_prompts) == 1
+    assert 'A new closing sentence.' in map_prompts[0]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_for_a_chunk_share_one_call() -> None:
+    summarizer, prompts = make_summarizer()
+    results = await asyncio.gather(*(summarizer.summarize_chunk('Same text.') for _ in range(3)))
+    assert results == ['summary 1'] * 3
+    assert len(prompts) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_request_is_not_cached() -> None:
+    async def fail(messages: List[Dict[str, str]]) -> str:
+        raise RuntimeError('model unavailable')
+
+    summarizer = Summarizer('test-model', fail, chunk_tokens=64)
+    with pytest.raises(RuntimeError):
+        await summarizer.summarize(TEXT)
+    assert summarizer.cached(TEXT) is None
+
+
+@pytest.mark.asyncio
+async def test_waiter_summarizes_when_the_owning_session_is_stopped() -> None:
+    started = asyncio.Event()
+    prompts: List[str] = []
+
+    async def complete(messages: List[Dict[str, str]]) -> str:
+        prompts.append(messages[-1]['content'])
+        if len(prompts) == 1:
+            started.set()
+            await asyncio.sleep(10)
+        return f'summary {len(prompts)}'
+
+    summarizer = Summarizer('test-model', complete, chunk_tokens=64)
+    first = asyncio.create_task(summarizer.summarize_chunk('Same text.'))
+    await started.wait()
+    second = asyncio.create_task(summarizer.summarize_chunk('Same text.'))
+    await asyncio.sleep(0)
+    first.cancel()
+
+    assert await second == 'summary 2'
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    assert summarizer.cached('Same text.') == 'summary 2'
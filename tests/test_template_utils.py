@@ -1,5 +1,5 @@
 import pytest
-from template_utils import TEMPLATES_DIR, extract_template_name, extract_template_vars, get_template_content, get_template_file_name, render_template_with_vars
+from template_utils import TEMPLATES_DIR, TemplateStore, extract_template_name, extract_template_vars, get_template_content, get_template_file_name, render_template_with_vars, render_text_template
 
 
 def test_get_template_file_name() -> None:
@@ -38,3 +38,47 @@ def test_render_template_with_vars() -> None:
     assert '{#' not in result
     assert '{{' not in result
     assert test_content in result
+
+
+def test_template_store_reloads_changed_templates(tmp_path) -> None:
+    template_file = tmp_path / 'Greeting.jinja'
+    template_file.write_text('{#\nname = "Your name"\n#}\nHello {{name}}!')
+    store = TemplateStore(templates_dir=str(tmp_path))
+
+    assert store.list_templates() == ['Greeting']
+    assert store.template_vars('Greeting') == {'name': 'Your name'}
+    assert store.render('Greeting', {'name': 'Ada'}).strip() == 'Hello Ada!'
+
+    template_file.write_text('{#\nname = "Your name"\ntitle = "Your title"\n#}\nHi {{title}} {{name}}!')
+    (tmp_path / 'Farewell.jinja').write_text('Bye!')
+
+    assert store.list_templates() == ['Farewell', 'Greeting']
+    assert store.template_vars('Greeting') == {'name': 'Your name', 'title': 'Your title'}
+    assert store.render('Greeting', {'name': 'Ada', 'title': 'Dr.'}).strip() == 'Hi Dr. Ada!'
+
+
+def test_render_text_template_fills_placeholders() -> None:
+    prompt = render_text_template('RAG Q&A', {
+        'user query string': 'When was it built?',
+        'information chunk pieces': 'It was built in 1889.'
+    })
+    assert '**User Query:** When was it built?' in prompt
+    assert 'It was built in 1889.' in prompt
+    assert '{' not in prompt
+
+
+def test_template_store_caches_markdown_templates_until_changed(tmp_path, monkeypatch) -> None:
+    template_file = tmp_path / 'Answer.md'
+    template_file.write_text('Q: {question}')
+    store = TemplateStore(templates_dir=str(tmp_path))
+    assert store.text(str(template_file)) == 'Q: {question}'
+
+    def read_again(*args, **kwargs):
+        raise AssertionError('unchanged template read again')
+
+    monkeypatch.setattr('builtins.open', read_again)
+    assert store.text(str(template_file)) == 'Q: {question}'
+    monkeypatch.undo()
+
+    template_file.write_text('Question: {question}')
+    assert store.text(str(template_file)) == 'Question: {question}'
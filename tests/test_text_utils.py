@@ -0,0 +1,81 @@
+from token_utils import get_encoding
+from text_utils import (SENTENCE_BATCH_SIZE, SENTENCE_MAX_CHARS, iter_merged_sentences, iter_sentence_split, iter_stream_sentences,
+                        merge_sentences, sentence_split)
+
+
+def test_iter_sentence_split_matches_sentence_split() -> None:
+    text = 'First sentence. Second one!  Third?\nFourth。第五！'
+    assert list(iter_sentence_split(text)) == sentence_split(text)
+
+
+def test_sentence_split_keeps_separators() -> None:
+    text = 'Hi. How are you?  Fine!\nThanks'
+    assert sentence_split(text) == ['Hi. ', 'How are you?  ', 'Fine!\n', 'Thanks']
+
+
+def test_merged_chunks_keep_spaces_between_sentences() -> None:
+    text = ' '.join(f'Sentence number {i} is here.' for i in range(200))
+    chunks = merge_sentences(sentence_split(text), context_length=64)
+    assert len(chunks) > 1
+    assert chunks[0].startswith('Sentence number 0 is here. Sentence number 1 is here.')
+    assert ''.join(chunks) == text
+
+
+def test_merge_sentences_keeps_every_sentence() -> None:
+    sentences = [f'Sentence number {i} is here. ' for i in range(200)]
+    chunks = merge_sentences(sentences, context_length=64)
+    assert len(chunks) > 1
+    assert ''.join(chunks) == ''.join(sentences)
+
+
+def test_merge_sentences_respects_context_length() -> None:
+    encoding = get_encoding()
+    sentences = [f'Sentence number {i} is here. ' for i in range(200)]
+    for chunk in merge_sentences(sentences, context_length=64):
+        assert len(encoding.encode_ordinary(chunk)) < 64
+
+
+def test_merge_sentences_cuts_oversized_sentence_to_the_budget() -> None:
+    encoding = get_encoding()
+    long_sentence = 'word ' * 100
+    chunks = merge_sentences(['Short one. ', long_sentence, 'Tail.'], context_length=32)
+    assert chunks[0] == 'Short one. '
+    assert len(chunks) > 3
+    assert all(len(encoding.encode_ordinary(chunk)) < 32 for chunk in chunks)
+    assert ''.join(chunks) == 'Short one. ' + long_sentence + 'Tail.'
+
+
+def test_iter_merged_sentences_is_lazy() -> None:
+    consumed = []
+
+    def sentences():
+        for i in range(SENTENCE_BATCH_SIZE * 4):
+            consumed.append(i)
+            yield f'Sentence number {i} is here. '
+
+    chunks = iter_merged_sentences(sentences(), context_length=64)
+    assert next(chunks)
+    assert len(consumed) <= SENTENCE_BATCH_SIZE
+
+
+def test_iter_stream_sentences_joins_sentences_across_blocks() -> None:
+    text = 'First sentence. Second one!  Third?\nFourth。第五！ Tail without end'
+    blocks = [text[i:i + 7] for i in range(0, len(text), 7)]
+    assert list(iter_stream_sentences(blocks)) == sentence_split(text)
+
+
+def test_text_without_punctuation_is_split_at_line_ends() -> None:
+    text = ''.join(f'{i},name {i},{i * 7}\n' for i in range(2000))
+    assert len(text) > SENTENCE_MAX_CHARS
+    blocks = [text[i:i + 1000] for i in range(0, len(text), 1000)]
+
+    for sentences in (sentence_split(text), list(iter_stream_sentences(blocks))):
+        assert ''.join(sentences) == text
+        assert max(map(len, sentences)) <= SENTENCE_MAX_CHARS
+        assert all(sentence.endswith('\n') for sentence in sentences)
+
+
+def test_line_without_breaks_is_cut_every_max_chars() -> None:
+    text = 'x' * (SENTENCE_MAX_CHARS * 2 + 10)
+    assert sentence_split(text) == [text[:SENTENCE_MAX_CHARS], text[SENTENCE_MAX_CHARS:-10], text[-10:]]
+    assert ''.join(iter_stream_sentences([text[:5000], text[5000:]])) == text
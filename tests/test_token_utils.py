@@ -0,0 +1,17 @@
+from token_utils import BATCH_ENCODE_MIN_CHARS, count_tokens, get_encoding
+
+
+def test_get_encoding_is_cached() -> None:
+    assert get_encoding() is get_encoding()
+
+
+def test_count_tokens() -> None:
+    texts = ['hello world', '', 'The quick brown fox jumps over the lazy dog.']
+    encoding = get_encoding()
+    assert count_tokens(texts) == [len(encoding.encode_ordinary(text)) for text in texts]
+
+
+def test_count_tokens_batched_matches_sequential() -> None:
+    texts = [f'Sentence number {i} is here. ' for i in range(BATCH_ENCODE_MIN_CHARS // 10)]
+    encoding = get_encoding()
+    assert count_tokens(texts) == [len(encoding.encode_ordinary(text)) for text in texts]
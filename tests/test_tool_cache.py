@@ -0,0 +1,118 @@
+import asyncio
+
+import pytest
+from mcp.types import CallToolResult, TextContent
+
+import tool_cache
+from tool_cache import ToolCachePolicy, ToolCallCache, tool_cache_key, tool_cache_policy
+
+
+def make_result(text: str, is_error: bool = False) -> CallToolResult:
+    return CallToolResult(content=[TextContent(type='text', text=text)], isError=is_error)
+
+
+def test_key_ignores_argument_order() -> None:
+    first = tool_cache_key('web', 'search', {'query': 'ollama', 'limit': 5})
+    assert first == tool_cache_key('web', 'search', {'limit': 5, 'query': 'ollama'})
+    assert first != tool_cache_key('other', 'search', {'query': 'ollama', 'limit': 5})
+    assert first != tool_cache_key('web', 'search', {'query': 'ollama', 'limit': 6})
+
+
+def test_policy_allowlist(monkeypatch) -> None:
+    monkeypatch.setattr(tool_cache, 'TOOL_CACHE_ENABLED', True)
+    monkeypatch.setattr(tool_cache, 'load_config', lambda file: {'tool_cache': {
+        'search': 600, 'fetch': {'ttl': 60, 'scope': 'process'}, 'snapshot': True, 'navigate': False}})
+    assert tool_cache_policy('search') == ToolCachePolicy(600.0, 'session')
+    assert tool_cache_policy('fetch') == ToolCachePolicy(60.0, 'process')
+    assert tool_cache_policy('snapshot') == ToolCachePolicy(tool_cache.TOOL_CACHE_TTL, 'session')
+    assert tool_cache_policy('navigate') is None
+    assert tool_cache_policy('click') is None
+
+    monkeypatch.setattr(tool_cache, 'TOOL_CACHE_ENABLED', False)
+    assert tool_cache_policy('search') is None
+
+
+@pytest.mark.asyncio
+async def test_results_are_reused_until_they_expire(monkeypatch) -> None:
+    now = [1000.0]
+    monkeypatch.setattr(tool_cache.time, 'monotonic', lambda: now[0])
+    cache = ToolCallCache()
+    calls = []
+
+    async def call_tool():
+        calls.append(1)
+        return make_result(f'result {len(calls)}')
+
+    assert (await cache.call('key', 60, call_tool)).content[0].text == 'result 1'
+    assert (await cache.call('key', 60, call_tool)).content[0].text == 'result 1'
+    now[0] += 61
+    assert (await cache.call('key', 60, call_tool)).content[0].text == 'result 2'
+    assert len(calls) == 2
+
+
+@pytest.mark.asyncio
+async def test_errors_are_not_cached() -> None:
+    cache = ToolCallCache()
+    calls = []
+
+    async def call_tool():
+        calls.append(1)
+        return make_result('failed', is_error=True)
+
+    await cache.call('key', 60, call_tool)
+    await cache.call('key', 60, call_tool)
+    assert len(calls) == 2
+
+
+def test_least_recently_used_results_are_evicted() -> None:
+    cache = ToolCallCache(max_entries=2)
+    cache.put('a', make_result('a'), 60)
+    cache.put('b', make_result('b'), 60)
+    assert cache.get('a') is not None
+    cache.put('c', make_result('c'), 60)
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.get('c') is not None
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_calls_share_one_request() -> None:
+    cache = ToolCallCache()
+    release = asyncio.Event()
+    calls = []
+
+    async def call_tool():
+        calls.append(1)
+        await release.wait()
+        return make_result('shared')
+
+    tasks = [asyncio.create_task(cache.call('key', 60, call_tool)) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*tasks)
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+
+
+@pytest.mark.asyncio
+async def test_waiter_calls_again_when_first_call_is_cancelled() -> None:
+    cache = ToolCallCache()
+    started = asyncio.Event()
+    calls = []
+
+    async def call_tool():
+        calls.append(1)
+        if len(calls) == 1:
+            started.set()
+            await asyncio.sleep(10)
+        return make_result('second')
+
+    first = asyncio.create_task(cache.call('key', 60, call_tool))
+    await started.wait()
+    second = asyncio.create_task(cache.call('key', 60, call_tool))
+    await asyncio.sleep(0)
+    first.cancel()
+    assert (await second).content[0].text == 'second'
+    assert len(calls) == 2
+    with pytest.raises(asyncio.CancelledError):
+        await first
@@ -0,0 +1,39 @@
+from tool_registry import ToolRegistry
+
+
+def make_tool(name: str) -> dict:
+    return {"name": name, "description": f"{name} tool", "input_schema": {"type": "object"}}
+
+
+def test_tool_lookup() -> None:
+    registry = ToolRegistry()
+    registry.add_connection('playwright', [make_tool('browser_navigate')])
+    tool = registry.get('browser_navigate')
+    assert tool.connection == 'playwright'
+    assert tool.name == 'browser_navigate'
+    assert registry.get('missing') is None
+
+
+def test_name_collision_is_deterministic() -> None:
+    first = ToolRegistry()
+    first.add_connection('beta', [make_tool('search')])
+    first.add_connection('alpha', [make_tool('search')])
+    second = ToolRegistry()
+    second.add_connection('alpha', [make_tool('search')])
+    second.add_connection('beta', [make_tool('search')])
+
+    for registry in (first, second):
+        assert registry.get('search').connection == 'alpha'
+        assert registry.get('beta__search').connection == 'beta'
+        assert registry.get('beta__search').name == 'search'
+
+
+def test_tools_payload_is_cached_until_connections_change() -> None:
+    registry = ToolRegistry()
+    registry.add_connection('playwright', [make_tool('browser_navigate')])
+    payload = registry.tools_payload()
+    assert registry.tools_payload() is payload
+    assert [tool['function']['name'] for tool in payload] == ['browser_navigate']
+
+    registry.remove_connection('playwright')
+    assert registry.tools_payload() == []
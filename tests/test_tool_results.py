@@ -0,0 +1,81 @@
+import json
+
+from mcp.types import CallToolResult, ImageContent, TextContent
+
+from tool_results import (ToolResultPolicy, ToolResultStore, compact_tool_result, count_text_tokens,
+                          prune_structure, read_tool_result, tool_result_text, truncate_middle)
+
+
+def test_tool_result_text_of_mcp_result() -> None:
+    result = CallToolResult(content=[
+        TextContent(type='text', text='first'),
+        ImageContent(type='image', data='aGk=', mimeType='image/png'),
+        TextContent(type='text', text='second'),
+    ])
+    assert tool_result_text(result) == 'first\n[image content]\nsecond'
+    assert tool_result_text('plain') == 'plain'
+
+    error = CallToolResult(content=[TextContent(type='text', text='boom')], isError=True)
+    assert json.loads(tool_result_text(error)) == {"error": "boom"}
+
+
+def test_results_within_budget_are_unchanged() -> None:
+    text = 'short result'
+    for strategy in ('prune', 'truncate', 'spill'):
+        assert compact_tool_result('tool', text, ToolResultPolicy(strategy, 100), ToolResultStore()) == text
+
+
+def test_truncate_keeps_head_and_tail() -> None:
+    text = 'HEAD ' + 'x' * 5000 + ' TAIL'
+    truncated = truncate_middle(text, 200)
+    assert truncated.startswith('HEAD ')
+    assert truncated.endswith(' TAIL')
+    assert 'tokens omitted' in truncated
+    assert count_text_tokens(truncated) <= 200
+
+
+def test_prune_json_shortens_lists_and_strings() -> None:
+    value = {"items": [{"id": index, "text": "word " * 200} for index in range(100)], "total": 100}
+    pruned = prune_structure(json.dumps(value, indent=2), 1000)
+    assert count_text_tokens(pruned) <= 1000
+    data = json.loads(pruned)
+    assert data["total"] == 100
+    assert data["items"][0]["id"] == 0
+    assert data["items"][-1].startswith("... ")
+
+
+def test_prune_html_drops_scripts_styles_and_attributes() -> None:
+    html = ('<html><head><style>body { color: red; }</style></head><body>'
+            '<script>var tracking = 1;</script>'
+            '<div class="card" style="margin: 0"><a href="/next" onclick="go()">Next   page</a></div>'
+            '</body></html>')
+    assert prune_structure(html, 10) == '<html><body><div><a href="/next">Next page</a></div></body></html>'
+
+
+def test_prune_falls_back_to_truncation() -> None:
+    text = '\n'.join(f'line {index}' for index in range(2000))
+    compacted = compact_tool_result('tool', text, ToolResultPolicy('prune', 300))
+    assert count_text_tokens(compacted) <= 300
+    assert compacted.startswith('line 0')
+
+
+def test_spill_stores_full_result_for_reading() -> None:
+    store = ToolResultStore()
+    text = ''.join(f'{index:05d}\n' for index in range(3000))
+    compacted = compact_tool_result('browser_snapshot', text, ToolResultPolicy('spill', 300), store)
+    assert count_text_tokens(compacted) <= 300
+    handle = compacted.rsplit('stored as ', 1)[1].split('.', 1)[0]
+    assert store.get(handle) == text
+
+    page = read_tool_result(store, {'handle': handle, 'offset': 6, 'length': 12})
+    assert page == f'[Characters 6-18 of {len(text)}]\n00001\n00002\n'
+    assert 'error' in json.loads(read_tool_result(store, {'handle': 'result_missing'}))
+
+
+def test_store_drops_oldest_results_beyond_limit() -> None:
+    store = ToolResultStore(max_bytes=10)
+    first = store.put('a' * 6)
+    assert store.put('a' * 6) == first
+    second = store.put('b' * 6)
+    assert store.get(first) is None
+    assert store.get(second) == 'b' * 6
@@ -0,0 +1,85 @@
+import asyncio
+import functools
+import json
+
+import httpx
+import pytest
+
+import warmup
+from ollama_pool import OllamaPool
+from scheduler import RequestScheduler
+from warmup import WarmupManager
+
+
+@pytest.fixture
+def ollama_requests(monkeypatch):
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requests.append((request.url.host, request.url.path, json.loads(request.content)))
+        return httpx.Response(200, json={'done': True, 'load_duration': 2_500_000_000})
+
+    monkeypatch.setattr(warmup.httpx, 'AsyncClient', functools.partial(
+        httpx.AsyncClient, transport=httpx.MockTransport(handler)))
+    return requests
+
+
+@pytest.mark.asyncio
+async def test_warm_preloads_with_active_keep_alive(ollama_requests):
+    pool = OllamaPool(['http://a:11434', 'http://b:11434'])
+    pool.nodes[1].loaded_models.add('llama3')
+    manager = WarmupManager(pool=pool, keep_alive_active='30m')
+
+    task = manager.warm('llama3', session='s1')
+    # A second warm-up of the same model on the same node shares the task
+    assert manager.warm('llama3', session='s2') is task
+    await task
+
+    assert ollama_requests == [('b', '/api/generate', {'model': 'llama3', 'keep_alive': '30m'})]
+    assert manager.active_sessions('llama3') == 2
+
+
+@pytest.mark.asyncio
+async def test_warm_up_waits_for_a_scheduler_slot(ollama_requests, monkeypatch):
+    scheduler = RequestScheduler(model_limit=1)
+    monkeypatch.setattr(warmup, 'get_request_scheduler', lambda: scheduler)
+    pool = OllamaPool(['http://a:11434'])
+    manager = WarmupManager(pool=pool)
+
+    async with scheduler.slot(backend='http://a:11434', model='ollama:qwen3', session='s1'):
+        task = manager.warm('qwen3', session='s1')
+        await asyncio.sleep(0.05)
+        # The chat request holding the model's only slot goes first
+        assert not task.done() and ollama_requests == []
+        assert scheduler.queued() == 1
+    await task
+
+    assert [path for _, path, _ in ollama_requests] == ['/api/generate']
+    assert 'qwen3' in pool.nodes[0].loaded_models
+    assert scheduler.active('http://a:11434') == 0
+
+
+@pytest.mark.asyncio
+async def test_touch_extends_keep_alive_only_while_active(ollama_requests):
+    pool = OllamaPool(['http://a:11434', 'http://b:11434'])
+    pool.nodes[0].loaded_models.add('llama3')
+
+    idle = WarmupManager(pool=pool, activity_window=-1)
+    assert idle.touch('llama3', session='s1') == []
+
+    active = WarmupManager(pool=pool, keep_alive_active='1h')
+    await asyncio.gather(*active.touch('llama3', session='s1'))
+    assert ollama_requests == [('a', '/api/generate', {'model': 'llama3', 'keep_alive': '1h'})]
+
+
+@pytest.mark.asyncio
+async def test_warm_failure_is_logged_not_raised(monkeypatch):
+    def handler(request: httpx.Request) -> httpx.Response:
+        raise httpx.ConnectError('refused', request=request)
+
+    monkeypatch.setattr(warmup.httpx, 'AsyncClient', functools.partial(
+        httpx.AsyncClient, transport=httpx.MockTransport(handler)))
+    pool = OllamaPool(['http://a:11434'])
+
+    await WarmupManager(pool=pool).warm('llama3')
+    assert 'llama3' not in pool.nodes[0].loaded_models